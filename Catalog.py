@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Time catalog of a HiST data archive: which files and frames cover a time.
+
+build (or update) the catalog of all .DMCdata and .h5 files under a directory:
+
+    python Catalog.py ~/data/hist.sqlite --scan ~/data -k 0.0188679245283019
+
+keep the catalog of a night being recorded up to date, checking for new frames every minute:
+
+    python Catalog.py ~/data/hist.sqlite --refresh ~/data/2013-04-14 --every 60
+
+which files and frames of camera 7196 cover a time window:
+
+    python Catalog.py ~/data/hist.sqlite -t 2013-04-14T08:54:10Z 2013-04-14T08:54:12Z --cam 7196
+"""
+from datetime import datetime
+from time import sleep
+
+from histutils.catalog import Catalog
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    p = ArgumentParser(description="time catalog of .DMCdata and HDF5 video files")
+    p.add_argument("catalog", help="SQLite catalog file, created if needed")
+    p.add_argument("--scan", help="add all files under these directories", nargs="+")
+    p.add_argument(
+        "--refresh",
+        help="update the catalog with new or changed files under these directories",
+        nargs="+",
+    )
+    p.add_argument("--every", help="repeat --refresh every this many seconds", type=float)
+    p.add_argument("--threads", help="files scanned at once by --refresh", type=int, default=4)
+    p.add_argument(
+        "-t",
+        "--twin",
+        help="start stop time to find frames for",
+        metavar=("start", "stop"),
+        nargs=2,
+    )
+    p.add_argument("--cam", help="only this camera serial number", type=int)
+    p.add_argument(
+        "-p",
+        "--pix",
+        help=".DMCdata nx ny  number of x and y pixels respectively",
+        nargs=2,
+        default=(512, 512),
+        type=int,
+    )
+    p.add_argument(
+        "-b",
+        "--bin",
+        help=".DMCdata nx ny  number of x and y binning respectively",
+        nargs=2,
+        default=(1, 1),
+        type=int,
+    )
+    p.add_argument("-k", "--kineticsec", help=".DMCdata kinetic rate of camera (sec)", type=float)
+    p.add_argument("-s", "--startutc", help=".DMCdata start time (default: from filename)")
+    p.add_argument(
+        "--headerbytes", help="number of header bytes: 2013-2016: 4  2011: 0", type=int, default=4
+    )
+    P = p.parse_args()
+
+    params = {
+        "xy_pixel": P.pix,
+        "xy_bin": P.bin,
+        "header_bytes": P.headerbytes,
+        "kineticsec": P.kineticsec,
+        "startUTC": P.startutc,
+    }
+
+    with Catalog(P.catalog) as C:
+        for d in P.scan or []:
+            print(f"{C.scan(d, params)} files cataloged under {d}")
+
+        while True:
+            for d in P.refresh or []:
+                print(f"{d}: {C.refresh(d, params, P.threads)}")
+
+            if P.twin:
+                for h in C.query(*P.twin, camser=P.cam):
+                    print(
+                        f"{h.path}  frames {h.start}:{h.stop}  "
+                        f"{datetime.utcfromtimestamp(h.t0)} - {datetime.utcfromtimestamp(h.t1)}"
+                    )
+
+            if not (P.refresh and P.every):
+                break
+            sleep(P.every)
@@ -8,6 +8,11 @@ full command example with metadata:
       -s 2013-04-14T06:59:55Z -k 0.018867924528301886 -t 2013-04-14T11:30:00Z 2013-04-14T11:30:02Z \
       -o /tmp/2013-04-14T113000_hst0.h5 -l 65.1186367 -147.432975 500
 
+GPS timing of each frame from the GPSDO 1PPS and camera fire tick logs, instead of the software estimate:
+
+    python ConvertDMC2h5.py ~/data/2013-04-14/2013-04-14T07-00-CamSer7196.DMCdata -o ~/work \
+      -s 2013-04-14T06:59:55Z --fire ~/data/2013-04-14/fire.txt --pps ~/data/2013-04-14/pps.txt
+
 simple command example w/o full metadata (can append metadata later):
 
     python  ConvertDMC2h5.py ~/extdrive/2011-03-01T1000/ -o ~/data/2011-03-01 --headerbytes 0
@@ -15,15 +20,20 @@ simple command example w/o full metadata (can append metadata later):
 HiST simple conversion of entire night (without metadata, which can be appended later):
 
     python ConvertDMC2h5.py ~/data/2014-04-24 -o ~/work/2014-04-24
+
+same, converting 4 files at a time, at most 2 at once on each disk:
+
+    python ConvertDMC2h5.py ~/data/2014-04-24 -o ~/work/2014-04-24 -j 4 --perdevice 2
 """
 from pathlib import Path
 from sys import argv
 from numpy import int64
 import logging
+import h5py
 
 #
-from histutils.io import dir2fn, vid2h5
-from histutils.rawDMCreader import goRead
+from histutils.io import dir2fn, vid2h5, STORAGE_PROFILES
+from histutils.convert import dmc2h5, convertfiles
 from histutils.plots import doPlayMovie, doplotsave
 
 
@@ -36,12 +46,15 @@ def dmclooper(p):
         "flipud": p.flipud,
         "fliplr": p.fliplr,
         "fire": p.fire,
+        "pps": p.pps,
         "sensorloc": p.loc,
         "cmdlog": " ".join(argv),
         "header_bytes": p.headerbytes,
         "xy_pixel": p.pix,
         "xy_bin": p.bin,
         "frame_request": p.frames,
+        "startUTC": p.startutc,
+        "ut1req": p.ut1,
     }
 
     # %% find file(s) user specified
@@ -55,6 +68,30 @@ def dmclooper(p):
 
     N = len(flist)
 
+    if p.jobs > 1:
+        todo = []
+        for fn in flist:
+            outfn = dir2fn(p.outdir, fn, ".h5")
+            if outfn.is_file():
+                logging.warning(f"\nskipping {outfn} {fn}")
+                continue
+            todo.append((fn, outfn))
+
+        written = convertfiles(
+            todo,
+            params,
+            jobs=p.jobs,
+            threads=p.threads,
+            perdevice=p.perdevice,
+            profile=p.profile,
+        )
+        failed = [fn for fn, outfn in todo if Path(outfn).expanduser() not in written]
+        for fn in failed:
+            logging.error(f"not converted: {fn}")
+        if failed:
+            raise SystemExit(f"{len(failed)} / {len(todo)} files failed to convert")
+        return
+
     for i, fn in enumerate(flist):
         params["outfn"] = dir2fn(p.outdir, fn, ".h5")
         if params["outfn"].is_file():
@@ -63,12 +100,21 @@ def dmclooper(p):
 
         logging.info(f"\n file {i+1} / {N}   {i+1 / N * 100.:.1f} % done with {flist[0].parent}")
 
-        rawImgData, rawind, finf = goRead(fn, params)
         # %% convert
-        vid2h5(None, ut1=finf["ut1"], rawind=rawind, ticks=None, params=params)
+        rawind, finf = dmc2h5(fn, params, threads=p.threads, profile=p.profile)
+        vid2h5(
+            None,
+            ut1=finf["ut1"],
+            rawind=rawind,
+            ticks=finf["ticks"],
+            params=params,
+            ut1attrs=finf["ut1attrs"],
+        )
         # %% optional plot
         if p.movie:
-            plots(rawImgData, rawind, finf)
+            # r+ so that --hist/--avg statistics are saved to /stats
+            with h5py.File(params["outfn"], "r+") as f:
+                plots(f["/rawimg"], rawind, finf)
 
 
 def plots(rawImgData, rawind, finf):
@@ -136,13 +182,34 @@ if __name__ == "__main__":
         action="store_true",
     )
     p.add_argument("--hist", help="makes a histogram of all data frames", action="store_true")
+    p.add_argument(
+        "--threads", help="number of compression threads (default: number of CPUs)", type=int
+    )
+    p.add_argument(
+        "--profile",
+        help="HDF5 chunking/compression profile",
+        choices=list(STORAGE_PROFILES),
+        default="archive",
+    )
+    p.add_argument(
+        "-j", "--jobs", help="number of files to convert in parallel", type=int, default=1
+    )
+    p.add_argument(
+        "--perdevice",
+        help="maximum files converted at once per disk (with --jobs)",
+        type=int,
+        default=1,
+    )
     p.add_argument("-v", "--verbose", help="debugging", action="store_true")
-    p.add_argument("--fire", help="fire filename")
+    p.add_argument("--fire", help="camera fire feedback tick log (with --pps for GPS timing)")
+    p.add_argument("--pps", help="GPSDO 1PPS tick log, same tick counter as --fire")
     p.add_argument("-l", "--loc", help="lat lon alt_m of sensor", type=float, nargs=3)
     p.add_argument(
         "--headerbytes", help="number of header bytes: 2013-2016: 4  2011: 0", type=int, default=4,
     )
     P = p.parse_args()
+    if P.jobs > 1 and P.movie:
+        p.error("--movie plays each file as it is converted, it can't be used with --jobs")
 
     logging.basicConfig(
         format="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S", level=logging.INFO,
@@ -7,12 +7,30 @@ import h5py
 import numpy as np
 from typing import Tuple
 
-from histutils.utils import sixteen2eight
+from histutils.utils import sixteen2eight, STRETCHES
 from histutils.plots import doPlayMovie
+from histutils.stream import prefetch_frames
+from histutils.stats import autoclim
+
+
+def playh5movie(
+    h5fn: Path,
+    imgh5: str,
+    outfn: Path,
+    clim: Tuple[int, int],
+    threads: int = 2,
+    depth: int = 4,
+    stretch: str = "linear",
+):
+    h5fn = Path(h5fn).expanduser()
 
+    if clim is None:
+        clim = autoclim(h5fn, key=imgh5)
+        print(f"contrast limits {clim}")
 
-def playh5movie(h5fn: Path, imgh5: str, outfn: Path, clim: Tuple[int, int]):
-    h5fn = Path(h5fn).expanduser()
+    if outfn:
+        hdf2video(h5fn, imgh5, outfn, clim, threads, depth, stretch)
+        return
 
     with h5py.File(h5fn, "r") as f:
         data = f[imgh5]
@@ -21,17 +39,25 @@ def playh5movie(h5fn: Path, imgh5: str, outfn: Path, clim: Tuple[int, int]):
         except KeyError:
             ut1_unix = None
 
-        if outfn:
-            hdf2video(data, outfn, clim)
-        else:
-            doPlayMovie(data, 0.1, ut1_unix=ut1_unix, clim=clim)
+        doPlayMovie(data, 0.1, ut1_unix=ut1_unix, clim=clim)
 
 
-def hdf2video(data: np.ndarray, outfn: Path, clim: Tuple[int, int]):
+def hdf2video(
+    h5fn: Path,
+    imgh5: str,
+    outfn: Path,
+    clim: Tuple[int, int],
+    threads: int = 2,
+    depth: int = 4,
+    stretch: str = "linear",
+):
     outfn = Path(outfn).expanduser()
 
     import cv2
 
+    with h5py.File(h5fn, "r") as f:
+        shape = f[imgh5].shape
+
     outfn = outfn.with_suffix(".ogv")
     cc4 = cv2.VideoWriter_fourcc(*"THEO")
     # we use isColor=True because some codecs have trouble with grayscale
@@ -40,17 +66,20 @@ def hdf2video(data: np.ndarray, outfn: Path, clim: Tuple[int, int]):
         cc4,
         fps=33,
         # frameSize needs col,row
-        frameSize=data.shape[1:][::-1],
+        frameSize=shape[1:][::-1],
         isColor=True,
     )  # right now we're only using grayscale
     if not hv.isOpened():
         raise TypeError("trouble starting video file")
-
-    for d in data:
-        # RAM usage explodes if scaling all at once on GB class file
-        # for d in bytescale(data,1000,4000):
-        # for d in sixteen2eight(data,(1000,4000)):
-        hv.write(gray2rgb(sixteen2eight(d, clim)))
+    # RAM usage explodes if reading or scaling all at once on GB class file
+    # decompression of upcoming frames overlaps with video encoding
+    # single pass: decoded frames are not kept in the frame cache
+    for _, _, data in prefetch_frames(
+        h5fn, key=imgh5, batch=32, depth=depth, threads=threads, cache=False
+    ):
+        # whole batch is scaled at once, by table lookup for uint16
+        for d in sixteen2eight(data, clim, stretch):
+            hv.write(gray2rgb(d))
 
     hv.release()
 
@@ -74,10 +103,15 @@ if __name__ == "__main__":
     p.add_argument(
         "-c",
         "--clim",
-        help="contrast limits used to convert 16-bit to 8-bit video",
+        help="contrast limits used to convert 16-bit to 8-bit video (default: 0.5 .. 99.5 percentile)",
         nargs=2,
         type=float,
     )
+    p.add_argument("--threads", help="number of read/decompression threads", type=int, default=2)
+    p.add_argument("--depth", help="number of frame batches to read ahead", type=int, default=4)
+    p.add_argument(
+        "--stretch", help="contrast stretch for 8-bit video", choices=STRETCHES, default="linear"
+    )
     P = p.parse_args()
 
-    playh5movie(P.h5fn, P.imgh5, P.output, P.clim)
+    playh5movie(P.h5fn, P.imgh5, P.output, P.clim, P.threads, P.depth, P.stretch)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+Copies a HiST HDF5 video file, storing the images with another chunking/compression profile.
+Frame playback and pixel time series (keogram) reads want very different HDF5 chunk shapes.
+
+    python Rechunkh5.py ~/data/2013-04-14T0925_hst1.h5 /tmp/2013-04-14T0925_hst1_keo.h5 -p keogram
+"""
+from histutils.io import rechunkh5, STORAGE_PROFILES
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    p = ArgumentParser(description="convert HDF5 video file between chunking/compression profiles")
+    p.add_argument("infile", help="HDF5 video file to read")
+    p.add_argument("outfile", help="HDF5 video file to write")
+    p.add_argument(
+        "-p", "--profile", help="storage profile", choices=list(STORAGE_PROFILES), required=True
+    )
+    p.add_argument(
+        "--imgh5",
+        help="path / variable inside hdf5 file to image stack (default=/rawimg)",
+        default="/rawimg",
+    )
+    P = p.parse_args()
+
+    rechunkh5(P.infile, P.outfile, P.profile, key=P.imgh5)
@@ -169,10 +169,10 @@ if __name__ == "__main__":
         "-m", "--mag", help="inclination, declination", nargs=2, type=float, default=(None, None),
     )
     p.add_argument(
-        "--cmin", help="min data values per camera", nargs="+", type=int, default=(100, 100),
+        "--cmin", help="min data values per camera (default: 0.5 percentile)", nargs="+", type=int,
     )
     p.add_argument(
-        "--cmax", help="max data values per camera", nargs="+", type=int, default=(1200, 1200),
+        "--cmax", help="max data values per camera (default: 99.5 percentile)", nargs="+", type=int,
     )
     p.add_argument("--png", help="write large numbers of PNGs instead of AVI", action="store_true")
     P = p.parse_args()
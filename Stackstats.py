@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Mean, variance, min, max and median images of a whole video file, read a batch of frames at a time.
+Results are written to the /stats group of the HDF5 file, or of --outfn.
+The median of a dark or flat field recording estimates the dark or flat frame.
+
+    python Stackstats.py ~/data/2013-04-14T0925_hst1.h5 -q 10 50 90
+"""
+from histutils.stats import stackstats
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    p = ArgumentParser(description="per-pixel statistics of a video file")
+    p.add_argument("infile", help="HDF5 video file")
+    p.add_argument("-o", "--outfn", help="HDF5 file to write statistics to (default: infile)")
+    p.add_argument(
+        "-q",
+        "--percentiles",
+        help="percentile images to write",
+        nargs="+",
+        type=float,
+        default=[50],
+    )
+    p.add_argument(
+        "-t",
+        "--twin",
+        help="start stop time of frames to use",
+        metavar=("start", "stop"),
+        nargs=2,
+    )
+    p.add_argument("--nbins", help="per-pixel histogram bins", type=int, default=64)
+    p.add_argument(
+        "--imgh5",
+        help="path / variable inside hdf5 file to image stack (default=/rawimg)",
+        default="/rawimg",
+    )
+    P = p.parse_args()
+
+    S = stackstats(
+        P.infile,
+        twin=P.twin,
+        key=P.imgh5,
+        nbins=P.nbins,
+        percentiles=P.percentiles,
+        outfn=P.outfn,
+    )
+    print(f"{S.n} frames, mean {S.mean.mean():.1f}  median {S.median.mean():.1f}")
@@ -10,6 +10,10 @@ from __future__ import division
 from datetime import timedelta
 from dateutil.parser import parse
 from argparse import ArgumentParser
+from pathlib import Path
+
+from histutils.index import loadFrameIndex
+from histutils.rawDMCreader import howbig
 
 p = ArgumentParser(
     description="calculates what approximate time a .DMCdata file ends, based on inputs"
@@ -19,6 +23,9 @@ p.add_argument("fps", help="frames per second", type=float)
 p.add_argument("-k", "--frameind", help="frame indices to give times for", nargs="+", type=int)
 p.add_argument("--xy", help="binned pixel count", nargs=2, type=int)
 p.add_argument("-f", "--filesize", help="file size in bytes of big .DMCdata file", type=int)
+p.add_argument(
+    "-i", "--infile", help=".DMCdata file to read frame indices from (with --xy), instead of --filesize"
+)
 p.add_argument(
     "--nheadbytes",
     help="number of bytes in each frame for header (default 4)",
@@ -29,7 +36,26 @@ P = p.parse_args()
 
 tstart = parse(P.starttime)
 # %% find start end times
-if P.xy and P.filesize:
+if P.xy and P.infile:
+    # actual raw frame indices of the file, from the frame index sidecar file (fast after first time)
+    params = {"header_bytes": P.nheadbytes, "startUTC": tstart, "kineticsec": 1 / P.fps}
+    finf = {
+        "super_x": P.xy[0],
+        "super_y": P.xy[1],
+        "nmetadata": P.nheadbytes // 2,
+        "header_bytes": P.nheadbytes,
+    }
+    finf.update(howbig(params, finf))
+    idx = loadFrameIndex(Path(P.infile), finf, params)
+
+    rawind = idx["rawind"]
+    tfirst = tstart + timedelta(seconds=(rawind[0] - 1) / P.fps)
+    tend = tstart + timedelta(seconds=(rawind[-1] - 1) / P.fps)
+    print(f"raw frames {rawind[0]} - {rawind[-1]}, {rawind.size} frames in file")
+    print(f"tstart {tfirst}  tend {tend}")
+    if idx["gapind"].size:
+        print(f"{idx['gaplen'].sum()} frames dropped in {idx['gapind'].size} gaps")
+elif P.xy and P.filesize:
     nframes = P.filesize // (P.xy[0] * P.xy[1] * 2 + 4)
     totalsec = nframes / P.fps
 
@@ -3,6 +3,6 @@ need to use int64 for indexing
 since Numpy thru 1.11 defaults to int32 on Windows for dtype=int,
 and we need int64 for large files
 """
-from .utils import splitconf, write_quota, sixteen2eight
-from .index import req2frame, getRawInd, meta2rawInd
+from .utils import splitconf, write_quota, sixteen2eight, scale16to8
+from .index import req2frame, getRawInd, meta2rawInd, getAllRawInd, footer2rawInd
 from .io import setupimgh5
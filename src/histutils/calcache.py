@@ -0,0 +1,125 @@
+"""
+cached loading of camera az/el/ra/dec calibration files, oriented like the camera images.
+
+Oriented arrays are kept in memory (least recently used evicted) keyed by file, modification time
+and orientation, and optionally saved to a cache directory as float32 .npy files
+that later runs memory-map instead of decoding the HDF5 file again.
+"""
+from pathlib import Path
+import os
+import logging
+import hashlib
+from functools import lru_cache
+import typing as T
+import numpy as np
+import h5py
+
+from .findnearest import AzelTree, azeltree
+from .orient import Orientation
+
+CALKEYS = ("az", "el", "ra", "dec")
+
+
+class Calibration(T.NamedTuple):
+    """
+    calibration oriented like the camera images. Arrays are read-only, shared by all users.
+    """
+
+    az: np.ndarray
+    el: np.ndarray
+    ra: np.ndarray
+    dec: np.ndarray
+    tree: AzelTree  # nearest pixel lookups
+
+
+def loadcal(
+    fn: Path, orientation: Orientation = Orientation(), cachedir: Path = None
+) -> Calibration:
+    """
+    Parameters
+    ----------
+    fn: pathlib.Path
+        HDF5 calibration file with az, el, ra, dec pixel arrays
+    orientation: Orientation, optional
+        image orientation
+    cachedir: pathlib.Path, optional
+        directory of float32 .npy memmap cache
+
+    Returns
+    -------
+    cal: Calibration
+        az, el, ra, dec arrays and spatial index
+    """
+    fn = Path(fn).expanduser().resolve()
+    st = fn.stat()
+
+    # equivalent orientations share a cache entry
+    orient = Orientation.fromd4(*orientation.d4)
+    if cachedir is not None:
+        cachedir = Path(cachedir).expanduser().resolve()
+
+    return _loadcal(fn, st.st_mtime_ns, st.st_size, orient, cachedir)
+
+
+@lru_cache(maxsize=16)
+def _loadcal(
+    fn: Path,
+    mtime_ns: int,
+    size: int,
+    orient: Orientation,
+    cachedir: T.Optional[Path],
+) -> Calibration:
+    cachefn = None
+    if cachedir is not None:
+        key = hashlib.sha1(f"{fn}{mtime_ns}{size}{orient.d4}".encode()).hexdigest()[:16]
+        cachefn = {k: cachedir / f"{fn.stem}-{key}-{k}.npy" for k in CALKEYS}
+
+        if all(f.is_file() for f in cachefn.values()):
+            logging.debug(f"memmapping cached calibration of {fn} from {cachedir}")
+            cal = {k: np.load(f, mmap_mode="r") for k, f in cachefn.items()}
+            return Calibration(**cal, tree=azeltree(cal["az"], cal["el"]))
+
+    logging.debug(f"loading calibration {fn} orientation {orient}")
+    with h5py.File(fn, "r") as f:
+        cal = {k: f[k][:] for k in CALKEYS}
+
+    assert cal["az"].ndim == cal["el"].ndim == 2
+    assert cal["az"].shape == cal["el"].shape
+
+    for k in CALKEYS:
+        cal[k] = orient.apply(cal[k])
+
+    if cachefn is not None:
+        cal = _writecache(cal, cachefn)
+
+    for v in cal.values():
+        v.flags.writeable = False
+
+    return Calibration(**cal, tree=azeltree(cal["az"], cal["el"]))
+
+
+def _writecache(
+    cal: T.Dict[str, np.ndarray], cachefn: T.Dict[str, Path]
+) -> T.Dict[str, np.ndarray]:
+    """
+    saves float32 copies, returning them memory-mapped. On failure, the arrays are used as is.
+    """
+    try:
+        next(iter(cachefn.values())).parent.mkdir(parents=True, exist_ok=True)
+        for k, fn in cachefn.items():
+            tmp = fn.with_suffix(".tmp")
+            with tmp.open("wb") as f:
+                np.save(f, cal[k].astype(np.float32))
+            os.replace(tmp, fn)
+    except OSError as e:
+        logging.warning(f"could not write calibration cache {fn}: {e}")
+        return cal
+
+    return {k: np.load(fn, mmap_mode="r") for k, fn in cachefn.items()}
+
+
+def clearcache():
+    """
+    empties the in-memory cache, e.g. after a calibration file was replaced with the same mtime
+    """
+    _loadcal.cache_clear()
@@ -18,6 +18,9 @@ import dascutils.io as dio
 from themisasi.fov import mergefov
 import themisasi
 from .plots import plotnear_rc, plotlsq_rc
+from .findnearest import azeltree, nearestpixel, edgemask
+from .calcache import loadcal
+from .orient import Orientation
 
 
 class Cam:  # use this like an advanced version of Matlab struct
@@ -141,6 +144,9 @@ class Cam:  # use this like an advanced version of Matlab struct
         self.boresightEl = splitconf(cp, "boresightElevDeg", ci)
         self.arbfov = splitconf(cp, "FOVdeg", ci)
         # %% sky mapping
+        # optional directory of oriented calibration arrays, memmapped on later runs
+        self.calcachedir = splitconf(cp, "calCacheDir", ci, dtype=Path)
+
         if calfn:
             self.cal1Dfn: T.Union[None, Path] = calfn
         else:
@@ -186,13 +192,13 @@ class Cam:  # use this like an advanced version of Matlab struct
                 self.lat = data.lat
                 self.lon = data.lon
                 self.alt_m = data.alt_m
-                self.ut1unix = datetime2unix(data.time.values.astype(datetime))
+                self.ut1unix = datetime2unix(data.time)
             elif self.name.startswith("themis"):
                 data = themisasi.load(self.fn)
                 self.lat = data.lat
                 self.lon = data.lon
                 self.alt_m = data.alt_m
-                self.ut1unix = datetime2unix(data.time.values.astype(datetime))
+                self.ut1unix = datetime2unix(data.time)
             # legacy data including HiST  (should use xarray to convert instead)
             elif self.fn.suffix == ".h5":
 
@@ -208,12 +214,10 @@ class Cam:  # use this like an advanced version of Matlab struct
 
                     self.supery, self.superx = f["/rawimg"].shape[1:]
 
-                    p = f["/params"]
+                    p = f["/params"][()]
                     self.kineticsec = p["kineticsec"]
-                    self.rotccw = p["rotccw"]
-                    self.transpose = p["transpose"] == 1
-                    self.fliplr = p["fliplr"] == 1
-                    self.flipud = p["flipud"] == 1
+                    o = Orientation.fromparams(p)
+                    self.transpose, self.rotccw, self.fliplr, self.flipud = o
 
                     c = f["/sensorloc"]
                     self.lat = c["lat"].item()
@@ -301,40 +305,16 @@ class Cam:  # use this like an advanced version of Matlab struct
             self.Baz, self.Bel, ranges, self.lat, self.lon, self.alt_m
         )
 
-    # TODO put doorientimage and doorient in one function for safety
+    @property
+    def orientation(self) -> Orientation:
+        """ shared by images and calibration, so they always match """
+        return Orientation(self.transpose, self.rotccw, self.fliplr, self.flipud)
+
     def doorientimage(self, frame):
-        if self.transpose:
-            if frame.ndim == 3:
-                frame = frame.transpose(0, 2, 1)
-            elif frame.ndim == 2:
-                frame = frame.T
-            else:
-                raise ValueError("ndim==2 or 3")
-        # rotate -- note if you use origin='lower', rotCCW -> rotCW !
-        # rotate works with first two axes
-        if self.rotccw:  # NOT isinstance integer_types!
-            if frame.ndim == 3:
-                frame = np.rot90(frame, self.rotccw, (1, 2))
-            elif frame.ndim == 2:
-                frame = np.rot90(frame, self.rotccw)
-            else:
-                raise ValueError("ndim==2 or 3")
-        # flip
-        if self.fliplr:
-            if frame.ndim == 3:
-                frame = np.fliplr(frame.transpose(1, 2, 0)).transpose(2, 0, 1)
-            elif frame.ndim == 2:
-                frame = np.fliplr(frame)
-            else:
-                raise ValueError("ndim==2 or 3")
-        if self.flipud:
-            if frame.ndim == 3:
-                frame = np.flipud(frame.transpose(1, 2, 0)).transpose(2, 0, 1)
-            elif frame.ndim == 2:
-                frame = np.flipud(frame)
-            else:
-                raise ValueError("ndim==2 or 3")
-        return frame
+        """
+        oriented view of image or image stack, without copying
+        """
+        return self.orientation.view(frame)
 
     def doorient(self):
         """
@@ -347,44 +327,16 @@ class Cam:  # use this like an advanced version of Matlab struct
             self.cal1Dfn
         )
 
-        with h5py.File(self.cal1Dfn, "r") as f:
-            az = f["az"][:]
-            el = f["el"][:]
-            ra = f["ra"][:]
-            dec = f["dec"][:]
-
-        assert az.ndim == el.ndim == 2
-        assert az.shape == el.shape
-
-        if self.transpose:
-            logging.debug("tranposing cam #{} az/el/ra/dec data. ".format(self.name))
-            az = az.T
-            el = el.T
-            ra = ra.T
-            dec = dec.T
-        if self.fliplr:
-            logging.debug("flipping horizontally cam #{} az/el/ra/dec data.".format(self.name))
-            az = np.fliplr(az)
-            el = np.fliplr(el)
-            ra = np.fliplr(ra)
-            dec = np.fliplr(dec)
-        if self.flipud:
-            logging.debug("flipping vertically cam #{} az/el/ra/dec data.".format(self.name))
-            az = np.flipud(az)
-            el = np.flipud(el)
-            ra = np.flipud(ra)
-            dec = np.flipud(dec)
-        if self.rotccw != 0:
-            logging.debug("rotating cam #{} az/el/ra/dec data.".format(self.name))
-            az = np.rot90(az, self.rotccw)
-            el = np.rot90(el, self.rotccw)
-            ra = np.rot90(ra, self.rotccw)
-            dec = np.rot90(dec, self.rotccw)
-
-        self.az = az
-        self.el = el
-        self.ra = ra
-        self.dec = dec
+        logging.debug(f"cam #{self.name} az/el/ra/dec: {self.orientation}")
+        # shared, read-only arrays: cached per calibration file and orientation
+        cal = loadcal(self.cal1Dfn, self.orientation, cachedir=self.calcachedir)
+
+        self.az = cal.az
+        self.el = cal.el
+        self.ra = cal.ra
+        self.dec = cal.dec
+        # nearest pixel lookups for this calibration
+        self.azeltree = cal.tree
 
     def debias(self, data):
         if (
@@ -537,24 +489,12 @@ class Cam:  # use this like an advanced version of Matlab struct
         assert self.az2pts.shape == self.el2pts.shape
         assert self.az.ndim == 2
 
-        npts = self.az2pts.size  # numel
-        R = np.empty(npts, int)
-        C = np.empty(npts, int)
-        # can be FAR FAR faster than scipy.spatial.distance.cdist()
-        for i in range(npts):
-            # we do this point by point because we need to know the closest pixel for each point
-            errdist = abs(np.hypot(self.az - self.az2pts[i], self.el - self.el2pts[i]))
-
-            """
-            THIS UNRAVEL_INDEX MUST BE ORDER = 'C'
-            .argmin() has flattened output
-            """
-            R[i], C[i] = np.unravel_index(errdist.argmin(), self.az.shape, order="C")
-
+        if getattr(self, "azeltree", None) is None or self.azeltree.shape != self.az.shape:
+            self.azeltree = azeltree(self.az, self.el)
+        # all points at once, closest pixel in angle
+        R, C = nearestpixel(self.azeltree, self.az2pts, self.el2pts)
         # %% dicard edge pixels
-        mask = np.logical_not(
-            ((C == 0) | (C == self.az.shape[1] - 1)) | ((R == 0) | (R == self.az.shape[0] - 1))
-        )
+        mask = np.logical_not(edgemask(R, C, self.az.shape))
 
         R = R[mask]
         C = C[mask]
@@ -0,0 +1,542 @@
+"""
+time catalog of a data archive: which .DMCdata and HDF5 video files, and which of their frames,
+cover a time window, for years of nights across many files and cameras.
+
+The catalog is a SQLite database. Each file is split into runs of consecutive frames
+(separated by dropped frames), and the time span of each run is in an R*Tree interval index
+when SQLite has it, so a query touches only the runs overlapping the window.
+
+    with Catalog("~/data/hist.sqlite") as C:
+        C.scan("~/data", params)
+        for hit in C.query("2013-04-14T08:54:10Z", "2013-04-14T08:54:12Z"):
+            print(hit.path, hit.start, hit.stop)
+"""
+from pathlib import Path
+import os
+import re
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import typing as T
+import numpy as np
+import h5py
+
+from .utils import get_camera_serial_number
+from .index import loadFrameIndex, rawind2gapmap
+from .rawDMCreader import dmcgeometry
+from .timedmc import datetime2unix
+
+SUFFIXES = (".DMCdata", ".h5")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    camser INTEGER,
+    nx INTEGER,
+    ny INTEGER,
+    header_bytes INTEGER,
+    bytes_frame INTEGER,
+    nframe INTEGER,
+    rawfirst INTEGER,
+    rawlast INTEGER,
+    kineticsec REAL,
+    tstart REAL,
+    tstop REAL,
+    timesource TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    frame0 INTEGER NOT NULL,
+    nframe INTEGER NOT NULL,
+    raw0 INTEGER,
+    t0 REAL,
+    tstop REAL,
+    dt REAL,
+    rawstep INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS runs_file ON runs(file_id);
+CREATE INDEX IF NOT EXISTS runs_t0 ON runs(t0);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+# frame times further than this from evenly spaced are looked up in the file (seconds)
+UNEVEN = 1e-6
+
+
+class Hit(T.NamedTuple):
+    """
+    frames start:stop (zero-based file frame index, stop exclusive) of a file within a time window
+    """
+
+    path: Path
+    camser: T.Optional[int]
+    start: int
+    stop: int
+    rawstart: T.Optional[int]  # raw frame index of frame start
+    t0: float  # UT1 unix time of frame start
+    t1: float  # UT1 unix time of frame stop - 1
+
+
+class Run(T.NamedTuple):
+    """
+    consecutive frames of a file, raw frame indices raw0 + rawstep * k, frame times t0 + dt * k.
+    dt is None for unevenly spaced frame times (e.g. GPS timed), which are read from the file.
+    """
+
+    frame0: int
+    nframe: int
+    raw0: T.Optional[int]
+    t0: T.Optional[float]
+    tstop: T.Optional[float]  # time of the last frame
+    dt: T.Optional[float]
+    rawstep: int = 1
+
+
+class Catalog:
+    """
+    Parameters
+    ----------
+    dbfn: pathlib.Path
+        SQLite catalog file, created if needed
+    """
+
+    def __init__(self, dbfn: Path):
+        self.dbfn = Path(dbfn).expanduser()
+        self.db = sqlite3.connect(str(self.dbfn), check_same_thread=False)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+        if "rawstep" not in [c[1] for c in self.db.execute("PRAGMA table_info(runs)")]:
+            self.db.execute("ALTER TABLE runs ADD COLUMN rawstep INTEGER NOT NULL DEFAULT 1")
+        self.rtree = _makertree(self.db)
+        self.db.commit()
+
+    # %% building
+    def scan(self, root: Path, params: T.Dict[str, T.Any] = None) -> int:
+        """
+        adds all .DMCdata and .h5 files under directory root, returning how many were added
+
+        Parameters
+        ----------
+        root: pathlib.Path
+            top directory of archive
+        params: dict, optional
+            .DMCdata file parameters, see add()
+        """
+        N = 0
+        for fn in archivefiles(root):
+            try:
+                self.add(fn, params)
+                N += 1
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"skipping {fn}: {e}")
+
+        return N
+
+    def refresh(
+        self, root: Path, params: T.Dict[str, T.Any] = None, threads: int = 4
+    ) -> T.Dict[str, int]:
+        """
+        brings the catalog of directory root up to date, e.g. every minute during a night's recording.
+        Only new files and files whose size, modification time or inode changed are scanned,
+        on a thread pool. Files no longer on disk are removed from the catalog.
+        Of a .DMCdata file still being recorded, only the new frames are indexed.
+
+        Parameters
+        ----------
+        root: pathlib.Path
+            top directory of archive
+        params: dict, optional
+            .DMCdata file parameters, see add()
+        threads: int, optional
+            files scanned at once
+
+        Returns
+        -------
+        count: dict
+            number of files added, updated, unchanged, removed
+        """
+        root = Path(root).expanduser().resolve()
+        prefix = str(root) + os.sep
+        known = {
+            path: tuple(st)
+            for path, *st in self.db.execute("SELECT path, size, mtime_ns, inode FROM files")
+            if path.startswith(prefix)
+        }
+
+        todo = []
+        ondisk = set()
+        for fn in archivefiles(root):
+            try:
+                st = fn.stat()
+            except OSError:  # deleted meanwhile
+                continue
+            ondisk.add(str(fn))
+            if known.get(str(fn)) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                todo.append(fn)
+
+        count = {"added": 0, "updated": 0, "unchanged": len(ondisk) - len(todo), "removed": 0}
+
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            futs = {pool.submit(scanfile, fn, params): fn for fn in todo}
+            # database writes stay on this thread
+            for fut in as_completed(futs):
+                fn = futs[fut]
+                try:
+                    rec, runs = fut.result()
+                except (OSError, ValueError, KeyError) as e:
+                    logging.error(f"skipping {fn}: {e}")
+                    continue
+                self._store(rec, runs)
+                count["updated" if str(fn) in known else "added"] += 1
+
+        for path in known.keys() - ondisk:
+            self.remove(path)
+            count["removed"] += 1
+
+        return count
+
+    def add(self, fn: Path, params: T.Dict[str, T.Any] = None) -> int:
+        """
+        adds or replaces file fn in the catalog, returning its id
+
+        Parameters
+        ----------
+        fn: pathlib.Path
+            .DMCdata or HDF5 video file
+        params: dict, optional
+            needed for .DMCdata files: xy_pixel, xy_bin, header_bytes, kineticsec
+            (a number, or a dict of camera serial number: kineticsec) and optionally startUTC,
+            else the start time is taken from the filename (to the minute)
+        """
+        fn = Path(fn).expanduser().resolve()
+        rec, runs = scanfile(fn, params)
+        return self._store(rec, runs)
+
+    def _store(self, rec: T.Dict[str, T.Any], runs: T.Sequence[Run]) -> int:
+        with self.db:
+            self._remove(rec["path"])
+            cols = ", ".join(rec)
+            cur = self.db.execute(
+                f"INSERT INTO files ({cols}) VALUES ({', '.join('?' * len(rec))})",
+                tuple(rec.values()),
+            )
+            fid = cur.lastrowid
+            for r in runs:
+                cur = self.db.execute(
+                    "INSERT INTO runs (file_id, frame0, nframe, raw0, t0, tstop, dt, rawstep) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (fid, *r),
+                )
+                if self.rtree and r.t0 is not None:
+                    self.db.execute(
+                        "INSERT INTO runs_rtree (id, tstart, tstop) VALUES (?, ?, ?)",
+                        (cur.lastrowid, r.t0, r.tstop),
+                    )
+            self._updatemeta()
+
+        return fid
+
+    def remove(self, fn: Path):
+        """
+        removes file fn from the catalog
+        """
+        with self.db:
+            self._remove(str(Path(fn).expanduser().resolve()))
+            self._updatemeta()
+
+    def _remove(self, path: str):
+        row = self.db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        if self.rtree:
+            self.db.execute(
+                "DELETE FROM runs_rtree WHERE id IN (SELECT id FROM runs WHERE file_id = ?)", row
+            )
+        self.db.execute("DELETE FROM runs WHERE file_id = ?", row)
+        self.db.execute("DELETE FROM files WHERE id = ?", row)
+
+    def _updatemeta(self):
+        # longest run bounds the index range scan when there is no R*Tree
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) "
+            "SELECT 'maxrun', coalesce(max(tstop - t0), 0) FROM runs"
+        )
+
+    # %% queries
+    def query(self, tstart, tstop, camser: int = None) -> T.List[Hit]:
+        """
+        frames of all files with frame times within tstart <= t <= tstop
+
+        Parameters
+        ----------
+        tstart, tstop: float or str or datetime
+            time window, UT1 unix time or anything datetime2unix() takes
+        camser: int, optional
+            only this camera serial number
+        """
+        t0, t1 = datetime2unix([tstart, tstop])
+
+        cols = "f.path, f.camser, r.frame0, r.nframe, r.raw0, r.t0, r.tstop, r.dt, r.rawstep"
+        if self.rtree:
+            # R*Tree bounds are float32, rounded outward: exact test on runs
+            sql = (
+                f"SELECT {cols} FROM runs_rtree x JOIN runs r ON r.id = x.id "
+                "JOIN files f ON f.id = r.file_id "
+                "WHERE x.tstop >= ? AND x.tstart <= ? AND r.tstop >= ? AND r.t0 <= ?"
+            )
+            args: T.Tuple[T.Any, ...] = (t0, t1, t0, t1)
+        else:
+            maxrun = self.db.execute("SELECT value FROM meta WHERE key = 'maxrun'").fetchone()
+            sql = (
+                f"SELECT {cols} FROM runs r JOIN files f ON f.id = r.file_id "
+                "WHERE r.t0 BETWEEN ? AND ? AND r.tstop >= ?"
+            )
+            args = (t0 - (maxrun[0] if maxrun else 0), t1, t0)
+
+        if camser is not None:
+            sql += " AND f.camser = ?"
+            args += (camser,)
+
+        hits = []
+        for path, cam, frame0, n, raw0, r0, r1, dt, step in self.db.execute(
+            sql + " ORDER BY r.t0", args
+        ):
+            ut1 = None
+            if n > 1 and not dt:
+                ut1 = _runtimes(path, frame0, n)
+                if ut1 is None:
+                    dt = (r1 - r0) / (n - 1)
+
+            if ut1 is not None:
+                i0 = int(np.searchsorted(ut1, t0, "left"))
+                i1 = int(np.searchsorted(ut1, t1, "right")) - 1
+            elif dt:
+                i0 = max(0, int(np.ceil((t0 - r0) / dt)))
+                i1 = min(n - 1, int(np.floor((t1 - r0) / dt)))
+            else:
+                i0 = i1 = 0
+            if i0 > i1:  # window between two frames
+                continue
+            hits.append(
+                Hit(
+                    Path(path),
+                    cam,
+                    frame0 + i0,
+                    frame0 + i1 + 1,
+                    raw0 + i0 * step if raw0 is not None else None,
+                    float(ut1[i0]) if ut1 is not None else r0 + i0 * (dt or 0),
+                    float(ut1[i1]) if ut1 is not None else r0 + i1 * (dt or 0),
+                )
+            )
+
+        return hits
+
+    def files(self, camser: int = None) -> T.List[T.Dict[str, T.Any]]:
+        """
+        catalog records of all files (or those of one camera), by start time
+        """
+        sql = "SELECT * FROM files"
+        args: T.Tuple[T.Any, ...] = ()
+        if camser is not None:
+            sql += " WHERE camser = ?"
+            args = (camser,)
+        cur = self.db.execute(sql + " ORDER BY tstart", args)
+        names = [c[0] for c in cur.description]
+        return [dict(zip(names, row)) for row in cur]
+
+    def gaps(self, fn: Path) -> T.List[T.Tuple[int, int, float, float]]:
+        """
+        dropped frames of file fn: (file frame index after which frames were dropped,
+        number of frames dropped, time of last frame before, time of first frame after).
+        For a file converted with a frame stride, frames skipped by the stride aren't dropped.
+        """
+        rows = self.db.execute(
+            "SELECT r.frame0, r.nframe, r.raw0, r.t0, r.tstop, r.rawstep FROM runs r "
+            "JOIN files f ON f.id = r.file_id WHERE f.path = ? ORDER BY r.frame0",
+            (str(Path(fn).expanduser().resolve()),),
+        ).fetchall()
+
+        return [
+            (a[0] + a[1] - 1, (b[2] - a[2]) // a[5] - a[1] if a[2] is not None else 0, a[4], b[3])
+            for a, b in zip(rows, rows[1:])
+        ]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _makertree(db: sqlite3.Connection) -> bool:
+    """
+    creates the R*Tree time index of runs if SQLite was built with it
+    """
+    try:
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS runs_rtree USING rtree(id, tstart, tstop)")
+    except sqlite3.OperationalError:
+        logging.info("SQLite without R*Tree, catalog uses a B-tree time index")
+        return False
+    return True
+
+
+# %% scanning files
+def archivefiles(root: Path) -> T.Iterator[Path]:
+    """
+    .DMCdata and .h5 files under directory root
+    """
+    root = Path(root).expanduser().resolve()
+    for fn in sorted(root.rglob("*")):
+        if fn.suffix in SUFFIXES and fn.is_file():
+            yield fn
+
+
+def scanfile(
+    fn: Path, params: T.Dict[str, T.Any] = None
+) -> T.Tuple[T.Dict[str, T.Any], T.List[Run]]:
+    """
+    catalog record and runs of consecutive frames of one .DMCdata or HDF5 video file
+    """
+    fn = Path(fn).expanduser().resolve()
+    st = fn.stat()
+    rec = {
+        "path": str(fn),
+        "camser": get_camera_serial_number([fn]).get(fn.name),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "inode": st.st_ino,
+    }
+
+    if fn.suffix == ".h5":
+        rec["kind"] = "h5"
+        runs = _scanh5(fn, rec)
+    else:
+        rec["kind"] = "DMCdata"
+        runs = _scandmc(fn, rec, params or {})
+
+    timed = [r for r in runs if r.t0 is not None]
+    rec["tstart"] = timed[0].t0 if timed else None
+    rec["tstop"] = timed[-1].tstop if timed else None
+
+    return rec, runs
+
+
+def _scandmc(fn: Path, rec: T.Dict[str, T.Any], params: T.Dict[str, T.Any]) -> T.List[Run]:
+    if "xy_pixel" not in params:
+        raise ValueError(".DMCdata files need params xy_pixel, xy_bin, header_bytes")
+
+    finf = dmcgeometry(params)
+
+    kineticsec = params.get("kineticsec")
+    if isinstance(kineticsec, dict):
+        kineticsec = kineticsec.get(rec["camser"])
+
+    tstart = params.get("startUTC")
+    rec["timesource"] = "startUTC"
+    if tstart is None:
+        tstart = filetime(fn)
+        rec["timesource"] = "filename" if tstart is not None else None
+    if tstart is not None:
+        tstart = float(datetime2unix(tstart)[0])
+    if not kineticsec:
+        tstart = rec["timesource"] = None
+
+    idx = loadFrameIndex(fn, finf)
+    gapmap = idx["gapmap"]
+
+    rec.update(
+        nx=finf["super_x"],
+        ny=finf["super_y"],
+        header_bytes=finf["header_bytes"],
+        bytes_frame=finf["bytes_frame"],
+        nframe=int(idx["rawind"].size),
+        rawfirst=int(idx["rawind"][0]) if idx["rawind"].size else None,
+        rawlast=int(idx["rawind"][-1]) if idx["rawind"].size else None,
+        kineticsec=kineticsec,
+    )
+
+    runs = []
+    for raw0, frame0, n in gapmap.tolist():
+        if tstart is None:
+            runs.append(Run(frame0, n, raw0, None, None, None))
+        else:
+            t0 = tstart + (raw0 - 1) * kineticsec
+            runs.append(Run(frame0, n, raw0, t0, t0 + (n - 1) * kineticsec, kineticsec))
+
+    return runs
+
+
+def _scanh5(fn: Path, rec: T.Dict[str, T.Any]) -> T.List[Run]:
+    with h5py.File(fn, "r") as f:
+        N, ny, nx = f["/rawimg"].shape
+        ut1 = f["/ut1_unix"][:] if "/ut1_unix" in f else None
+        rawind = f["/rawind"][:] if "/rawind" in f else None
+        kineticsec = None
+        if "/params" in f and "kineticsec" in f["/params"].dtype.names:
+            kineticsec = float(f["/params"]["kineticsec"])
+
+    rec.update(nx=nx, ny=ny, nframe=N, timesource="ut1_unix" if ut1 is not None else None)
+    step = 1
+    if rawind is not None and rawind.size == N:
+        # frame stride of the conversion, if any, isn't a gap
+        if N > 1:
+            step = max(int(np.median(np.diff(rawind))), 1)
+        gapmap = rawind2gapmap(rawind, step)
+        rec.update(rawfirst=int(rawind[0]), rawlast=int(rawind[-1]))
+    else:
+        gapmap = np.array([[0, 0, N]], dtype=np.int64)
+        rawind = None
+
+    if ut1 is not None and ut1.size == N > 1:
+        kineticsec = float(np.median(np.diff(ut1)))
+    rec["kineticsec"] = kineticsec
+
+    runs = []
+    for raw0, frame0, n in gapmap.tolist():
+        raw0 = raw0 if rawind is not None else None
+        if ut1 is None or ut1.size != N:
+            runs.append(Run(frame0, n, raw0, None, None, None, step))
+            continue
+        t = ut1[slice(frame0, frame0 + n)]
+        t0, t1 = float(t[0]), float(t[-1])
+        dt = (t1 - t0) / (n - 1) if n > 1 else kineticsec
+        if n > 1 and np.abs(t - (t0 + dt * np.arange(n))).max() > UNEVEN:
+            dt = None
+        runs.append(Run(frame0, n, raw0, t0, t1, dt, step))
+
+    return runs
+
+
+def _runtimes(path: str, frame0: int, n: int) -> T.Optional[np.ndarray]:
+    """
+    frame times of an unevenly timed run, from the file. None if the file can't be read.
+    """
+    try:
+        with h5py.File(path, "r") as f:
+            return f["/ut1_unix"][slice(frame0, frame0 + n)]
+    except (OSError, KeyError) as e:
+        logging.warning(f"{path}: frame times of an uneven run taken as even: {e}")
+        return None
+
+
+def filetime(fn: Path) -> T.Optional[datetime]:
+    """
+    start time in the name of files from the HiST acquisition program, e.g.
+    2013-04-14T07-00-CamSer7196.DMCdata (UTC, to the minute)
+    """
+    m = re.search(r"(\d{4}-\d{2}-\d{2})T(\d{2})-(\d{2})(?:-(\d{2}))?", Path(fn).name)
+    if not m:
+        return None
+
+    return datetime.strptime(
+        f"{m.group(1)}T{m.group(2)}:{m.group(3)}:{m.group(4) or '00'}", "%Y-%m-%dT%H:%M:%S"
+    ).replace(tzinfo=timezone.utc)
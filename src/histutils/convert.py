@@ -0,0 +1,263 @@
+"""
+pipelined .DMCdata -> HDF5 conversion
+
+a reader thread fills batches of frames from the memory-mapped raw file,
+a thread pool compresses the HDF5 chunks (zlib releases the GIL),
+and this thread writes the pre-compressed chunks with the HDF5 file kept open.
+"""
+from pathlib import Path
+import os
+import logging
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import typing as T
+import numpy as np
+import h5py
+
+from .utils import write_quota
+from .io import setupimgh5, chunkencoder, vid2h5
+from .rawDMCreader import getDMCparam, getDMCmemmap, frametiming
+from .stream import readahead_iter
+
+
+def dmc2h5(
+    infn: Path,
+    params: T.Dict[str, T.Any],
+    threads: int = None,
+    batch: int = 64,
+    profile: str = "archive",
+) -> T.Tuple[np.ndarray, T.Dict[str, T.Any]]:
+    """
+    converts the requested frames of a .DMCdata file to params["outfn"] HDF5 file
+
+    Parameters
+    ----------
+    infn: pathlib.Path
+        .DMCdata filename
+    params: dict
+        as for rawDMCreader.goRead(), must have "outfn"
+    threads: int, optional
+        number of compression threads (default: number of CPUs)
+    batch: int, optional
+        approximate number of frames read at a time
+    profile: str, optional
+        HDF5 chunking and compression, one of io.STORAGE_PROFILES
+
+    Returns
+    -------
+    rawFrameInd: numpy.ndarray
+        raw frame index of each converted frame
+    finf: dict
+        file parameters
+    """
+    if not params.get("outfn"):
+        raise OSError('must specify file to write in params["outfn"]')
+
+    infn = Path(infn).expanduser()
+    outfn = Path(params["outfn"]).expanduser()
+    threads = threads or os.cpu_count() or 1
+
+    finf = getDMCparam(infn, params)
+    write_quota(finf["bytes_frame"] * finf["nframeextract"], outfn)
+
+    images, rawFrameInd = getDMCmemmap(infn, finf)
+
+    setupimgh5(outfn, finf, profile=profile)
+
+    with h5py.File(outfn, "r+") as f:
+        h = f["/rawimg"]
+        encode = chunkencoder(h)
+        # batches are whole chunks along the time axis
+        step = max(1, batch // h.chunks[0]) * h.chunks[0]
+        # bound the memory of batches waiting for compression
+        depth = max(2, min(2 * threads, 2 ** 28 // (step * finf["bytes_image"])))
+
+        if encode is None:
+            logging.info(f"{outfn}: chunk filters not handled by thread pool, writing directly")
+            for j, frames in _readahead(images, step, 2):
+                k = j + frames.shape[0]
+                h[j:k, ...] = frames
+        else:
+            _writechunks(h, encode, _readahead(images, step, depth), threads)
+
+    frametiming(finf, params)
+
+    return rawFrameInd, finf
+
+
+def convertfiles(
+    files: T.Sequence[T.Tuple[Path, Path]],
+    params: T.Dict[str, T.Any],
+    jobs: int = 1,
+    threads: int = None,
+    perdevice: int = 1,
+    profile: str = "archive",
+) -> T.List[Path]:
+    """
+    converts independent .DMCdata files in a process pool, e.g. a night's files from several cameras
+
+    Parameters
+    ----------
+    files: list of tuple of pathlib.Path
+        (input .DMCdata, output .h5) filename pairs
+    params: dict
+        as for dmc2h5(), "outfn" is set for each file
+    jobs: int, optional
+        number of files converted at once
+    threads: int, optional
+        compression threads per file (default: number of CPUs / jobs)
+    perdevice: int, optional
+        maximum conversions reading or writing the same disk at once
+    profile: str, optional
+        HDF5 chunking and compression, one of io.STORAGE_PROFILES
+
+    Returns
+    -------
+    outfn: list of pathlib.Path
+        HDF5 files written
+    """
+    files = [(Path(i).expanduser(), Path(o).expanduser()) for i, o in files]
+    N = len(files)
+    if not N:
+        return []
+
+    jobs = max(1, min(jobs, N))
+    threads = threads or max(1, (os.cpu_count() or 1) // jobs)
+    # %% disk space for all pending outputs, worst case uncompressed
+    need: T.Dict[int, T.Tuple[int, Path]] = {}
+    for infn, outfn in files:
+        outfn.parent.mkdir(parents=True, exist_ok=True)
+        dev = outfn.parent.stat().st_dev
+        nbytes = need.get(dev, (0, outfn))[0] + infn.stat().st_size
+        need[dev] = (nbytes, outfn)
+    for nbytes, outfn in need.values():
+        write_quota(nbytes, outfn)
+    # %% schedule, limiting how many conversions use each disk at once
+    devices = [(i.stat().st_dev, o.parent.stat().st_dev) for i, o in files]
+    busy: T.Counter[int] = Counter()
+    pending = list(range(N))
+    running: T.Dict[T.Any, int] = {}
+    written = []
+
+    def startable(k: int) -> bool:
+        return all(busy[d] < perdevice for d in set(devices[k]))
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for k in list(pending):
+                if len(running) >= jobs:
+                    break
+                if running and not startable(k):
+                    continue
+                pending.remove(k)
+                for d in set(devices[k]):
+                    busy[d] += 1
+                p = dict(params, outfn=files[k][1])
+                running[pool.submit(_convertfile, files[k][0], p, threads, profile, k, N)] = k
+                logging.info(f"file {k+1} / {N} started: {files[k][0]}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                k = running.pop(fut)
+                for d in set(devices[k]):
+                    busy[d] -= 1
+                try:
+                    written.append(fut.result())
+                    logging.info(f"file {k+1} / {N} done: {files[k][1]}")
+                except Exception as e:
+                    logging.error(f"file {k+1} / {N} failed: {files[k][0]}  {e}")
+
+    return written
+
+
+def _convertfile(
+    infn: Path, params: T.Dict[str, T.Any], threads: int, profile: str, i: int, N: int
+) -> Path:
+    """
+    one file of convertfiles(), run in a worker process.
+    The output is written under a temporary name, renamed when done, so a failed conversion
+    doesn't leave a file that a rerun would skip as already converted.
+    """
+    outfn = Path(params["outfn"])
+    part = outfn.with_name(outfn.name + ".part")
+    params = dict(params, outfn=part)
+    try:
+        if part.is_file():  # left by a killed conversion
+            part.unlink()
+        rawind, finf = dmc2h5(infn, params, threads=threads, profile=profile)
+        vid2h5(
+            None,
+            ut1=finf["ut1"],
+            rawind=rawind,
+            ticks=finf["ticks"],
+            params=params,
+            i=i,
+            Nfile=N,
+            ut1attrs=finf["ut1attrs"],
+        )
+        os.replace(part, outfn)
+    except BaseException:
+        if part.is_file():
+            part.unlink()
+        raise
+
+    return outfn
+
+
+def _writechunks(
+    h: h5py.Dataset,
+    encode: T.Callable[[np.ndarray], bytes],
+    batches: T.Iterator[T.Tuple[int, np.ndarray]],
+    threads: int,
+):
+    """
+    compress chunks in a thread pool, writing them in order from this thread
+    """
+    pending: T.Deque[T.Tuple[T.Tuple[int, ...], T.Any]] = deque()
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for j, frames in batches:
+            for offset, chunk in _chunks(frames, j, h.chunks):
+                pending.append((offset, pool.submit(encode, chunk)))
+            # bound memory held by compressed chunks waiting to be written
+            while len(pending) > 4 * threads:
+                offset, fut = pending.popleft()
+                h.id.write_direct_chunk(offset, fut.result())
+
+            if j and not j % 2000:
+                print(f"appending images {j} to {h.file.filename}")
+
+        while pending:
+            offset, fut = pending.popleft()
+            h.id.write_direct_chunk(offset, fut.result())
+
+
+def _chunks(
+    frames: np.ndarray, j: int, chunks: T.Tuple[int, ...]
+) -> T.Iterator[T.Tuple[T.Tuple[int, ...], np.ndarray]]:
+    """
+    splits a batch of frames starting at frame j into full-size chunks.
+    Edge chunks are zero padded, as HDF5 stores them full size.
+    """
+    cf, cy, cx = chunks
+    N, Ny, Nx = frames.shape
+
+    for t in range(0, N, cf):
+        for y in range(0, Ny, cy):
+            for x in range(0, Nx, cx):
+                c = frames[slice(t, t + cf), slice(y, y + cy), slice(x, x + cx)]
+                if c.shape != chunks:
+                    pad = np.zeros(chunks, dtype=frames.dtype)
+                    pad[: c.shape[0], : c.shape[1], : c.shape[2]] = c
+                    c = pad
+                yield (j + t, y, x), c
+
+
+def _readahead(images: np.ndarray, step: int, depth: int) -> T.Iterator[T.Tuple[int, np.ndarray]]:
+    """
+    reads batches of frames in a background thread, so that disk reads overlap compression
+    """
+    # the copy is where the disk is actually read
+    batches = ((j, np.array(images[slice(j, j + step)])) for j in range(0, images.shape[0], step))
+
+    return readahead_iter(batches, depth)
@@ -0,0 +1,208 @@
+"""
+batched frame reads from HDF5 video files for playback index lists,
+which are increasing but have repeated frames (slower camera) or gaps (faster camera).
+
+Requested frames are read a batch at a time, each batch as a few contiguous hyperslabs,
+and decoded frames are kept in the process-wide frame cache (framecache.CACHE),
+so repeated frames are not read again, by this or any other reader of the file.
+"""
+from pathlib import Path
+from contextlib import contextmanager
+import typing as T
+import numpy as np
+import h5py
+
+from .orient import Orientation
+from . import framecache
+from .framecache import FrameCache, filekey, framekey
+
+
+def coalesce(ind: np.ndarray, maxgap: int = 0) -> T.List[T.Tuple[int, int]]:
+    """
+    contiguous runs (start, stop) covering increasing unique indices ind.
+    Runs separated by at most maxgap frames are merged, reading the gap instead of another read.
+    """
+    ind = np.asarray(ind, dtype=int)
+    if ind.size == 0:
+        return []
+
+    brk = np.flatnonzero(np.diff(ind) > maxgap + 1)
+    starts = np.concatenate(([ind[0]], ind[brk + 1]))
+    stops = np.concatenate((ind[brk], [ind[-1]])) + 1
+
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+class FrameFetcher:
+    """
+    reads frames of an HDF5 image stack by index, in batches of contiguous hyperslabs,
+    through the frame cache.
+
+    Parameters
+    ----------
+    src: pathlib.Path or h5py.Dataset
+        HDF5 video file (kept open until close()) or image stack.
+        Once the file is closed, frames not in the cache are read by opening it again for the read.
+    key: str, optional
+        image stack in the file
+    cache: FrameCache, optional
+        frame cache (default: the process-wide framecache.CACHE)
+    batch: int, optional
+        maximum number of requested frames read at once
+    maxgap: int, optional
+        read through gaps of up to this many frames rather than starting another read
+    """
+
+    def __init__(
+        self,
+        src: T.Union[Path, h5py.Dataset],
+        *,
+        key: str = "/rawimg",
+        cache: FrameCache = None,
+        batch: int = 64,
+        maxgap: int = 0,
+    ):
+        self._f = None
+        if isinstance(src, h5py.Dataset):
+            self.h = src
+        else:
+            self._f = h5py.File(Path(src).expanduser(), "r")
+            self.h = self._f[key]
+
+        if self.h.ndim != 3:
+            raise ValueError("image stack must be Nframe x Ny x Nx")
+
+        self.cache = framecache.CACHE if cache is None else cache
+        self.batch = max(batch, 1)
+        self.maxgap = maxgap
+        self.fn = Path(self.h.file.filename)
+        self.key = self.h.name
+        self.shape: T.Tuple[int, int, int] = self.h.shape
+        self.dtype: np.dtype = self.h.dtype
+        self._fkey = filekey(self.fn)
+
+    def frames(
+        self, ind: T.Sequence[int], orientation: Orientation = Orientation()
+    ) -> T.Iterator[np.ndarray]:
+        """
+        yields oriented frames ind in order, any order and repeats allowed.
+        Frames are read-only since they're shared with the cache.
+        """
+        ind = np.atleast_1d(np.asarray(ind, dtype=int))
+        if ind.size > 0 and (ind.min() < 0 or ind.max() >= self.shape[0]):
+            raise IndexError(f"frame indices must be within 0..{self.shape[0] - 1}")
+
+        for w0 in range(0, ind.size, self.batch):
+            win = ind[slice(w0, w0 + self.batch)].tolist()
+            # frames of this batch are kept here even if evicted from the cache meanwhile
+            got: T.Dict[int, np.ndarray] = {}
+            for i in dict.fromkeys(win):
+                frame = self.cache.get(self._key(i, orientation))
+                if frame is not None:
+                    got[i] = frame
+
+            need = np.unique([i for i in win if i not in got])
+            if need.size > 0:
+                with self._dataset() as h:
+                    for a, b in coalesce(need, self.maxgap):
+                        block = h[a:b]
+                        for i in range(a, b):
+                            # own copy, so a cached frame doesn't hold on to the whole block
+                            frame = np.array(orientation.view(block[i - a]), order="C")
+                            got[i] = self.cache.put(self._key(i, orientation), frame)
+
+            for i in win:
+                yield got[i]
+
+    def read(
+        self, ind: T.Sequence[int], orientation: Orientation = Orientation(), out: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        oriented frames ind as one array, optionally into a preallocated array
+        """
+        ind = np.atleast_1d(ind)
+        if out is None:
+            shape = (ind.size, *orientation.shape(self.shape[1:]))
+            out = np.empty(shape, dtype=self.dtype)
+
+        for j, frame in enumerate(self.frames(ind, orientation)):
+            out[j] = frame
+
+        return out
+
+    def _key(self, i: int, orientation: Orientation) -> T.Tuple[T.Any, ...]:
+        return framekey(self._fkey, self.key, i, orientation)
+
+    @contextmanager
+    def _dataset(self) -> T.Iterator[h5py.Dataset]:
+        """
+        the image stack, from the file opened again if it was closed
+        """
+        if self.h:  # a dataset of a closed file is False
+            yield self.h
+            return
+
+        with h5py.File(self.fn, "r") as f:
+            yield f[self.key]
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameSequence:
+    """
+    lazy oriented image stack of playback frames ind, read when indexed or iterated.
+    Indexes like the Ntime x Ny x Nx array it stands for, e.g. seq[t], seq[t, ...], seq[a:b].
+    """
+
+    ndim = 3
+
+    def __init__(
+        self, fetcher: FrameFetcher, ind: T.Sequence[int], orientation: Orientation = Orientation()
+    ):
+        self.fetcher = fetcher
+        self.ind = np.atleast_1d(np.asarray(ind, dtype=int))
+        self.orientation = orientation
+
+    @property
+    def shape(self) -> T.Tuple[int, int, int]:
+        return (self.ind.size, *self.orientation.shape(self.fetcher.shape[1:]))
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.fetcher.dtype
+
+    def __len__(self) -> int:
+        return self.ind.size
+
+    def __iter__(self) -> T.Iterator[np.ndarray]:
+        """
+        yields oriented frames, read-only since they're shared with the frame cache
+        """
+        yield from self.fetcher.frames(self.ind, self.orientation)
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        t, rest = key[0], key[1:]
+
+        if isinstance(t, (int, np.integer)):
+            # a copy, never the cached frame
+            img = next(self.fetcher.frames(self.ind[t], self.orientation)).copy()
+        else:
+            img = self.fetcher.read(self.ind[t], self.orientation)
+            if rest:
+                rest = (slice(None),) + rest
+
+        return img[rest] if rest else img
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        img = self[:]
+        return img if dtype is None else img.astype(dtype)
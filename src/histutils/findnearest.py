@@ -1,16 +1,79 @@
 import numpy as np
+import typing as T
+from scipy.spatial import cKDTree
 
-#
-import pymap3d.haversine as haver
+
+class AzelTree(T.NamedTuple):
+    """
+    spatial index of the pixel directions of a calibrated image
+    """
+
+    tree: cKDTree  # unit vectors of the valid pixels
+    ind: np.ndarray  # flat (C order) pixel index of each tree point
+    shape: T.Tuple[int, int]  # image shape
+
+
+def azeltree(az: np.ndarray, el: np.ndarray, deg: bool = True) -> AzelTree:
+    """
+    builds the spatial index once per calibration, for any number of nearest pixel lookups.
+    Pixels with NaN or masked az/el are excluded.
+
+    az: 2-D Numpy array of azimuths in the image
+    el: 2-D Numpy array of elevations in the image
+    """
+    assert az.ndim == 2
+    assert az.shape == el.shape
+    shape = az.shape
+
+    az = np.ma.filled(np.ma.asarray(az, dtype=float), np.nan).ravel()
+    el = np.ma.filled(np.ma.asarray(el, dtype=float), np.nan).ravel()
+
+    ind = np.flatnonzero(np.isfinite(az) & np.isfinite(el))
+
+    return AzelTree(cKDTree(_unitvec(az[ind], el[ind], deg)), ind, shape)
+
+
+def _unitvec(az: np.ndarray, el: np.ndarray, deg: bool = True) -> np.ndarray:
+    """
+    N x 3 unit vectors: nearest in Euclidean distance is nearest in angle
+    """
+    if deg:
+        az = np.radians(az)
+        el = np.radians(el)
+
+    return np.column_stack((np.cos(el) * np.sin(az), np.cos(el) * np.cos(az), np.sin(el)))
 
 
-def findClosestAzel(az, el, azpts, elpts):
+def nearestpixel(
+    tree: AzelTree, azpts: np.ndarray, elpts: np.ndarray, deg: bool = True
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    row, column of the pixel closest in angle to each az/el point, all points in one call.
+    NaN points give pixel (0, 0).
+    """
+    azpts = np.atleast_1d(azpts).ravel()
+    elpts = np.atleast_1d(elpts).ravel()
+
+    ic = np.zeros(azpts.size, dtype=int)
+    good = np.isfinite(azpts) & np.isfinite(elpts)
+    if good.any():
+        _, k = tree.tree.query(_unitvec(azpts[good], elpts[good], deg))
+        ic[good] = tree.ind[k]
+
+    """
+    THIS UNRAVEL_INDEX MUST BE ORDER = 'C'
+    """
+    return np.unravel_index(ic, tree.shape, order="C")
+
+
+def findClosestAzel(az, el, azpts, elpts, tree: AzelTree = None):
     """
     assumes that azpts, elpts are each list of 1-D arrays or 2-D arrays
     az: 2-D Numpy array of azimuths in the image
     el: 2-D Numpy array of elevations in the image
     azpts: 1-D or 2-D Numpy array of azimuth points to see where nearest neighbor index is
     elpts: 1-D or 2-D Numpy array of azimuth points to see where nearest neighbor index is
+    tree: spatial index from azeltree(az, el), to avoid rebuilding it for each call
     """
     assert az.ndim == 2
     assert az.shape == el.shape
@@ -20,57 +83,40 @@ def findClosestAzel(az, el, azpts, elpts):
 
     assert azpts.shape == elpts.shape
 
-    az = np.ma.masked_invalid(az)
-    el = np.ma.masked_invalid(el)
-
-    az = np.radians(az)
-    el = np.radians(el)
-    azpts = np.radians(azpts)
-    elpts = np.radians(elpts)
+    if tree is None:
+        tree = azeltree(az, el)
 
     if np.ma.is_masked(azpts):
         azpts = azpts.compressed()
         elpts = elpts.compressed()
-    else:
-        azpts = np.atleast_1d(azpts).ravel()
-        elpts = np.atleast_1d(elpts).ravel()
 
-    # can be FAR FAR faster than scipy.spatial.distance.cdist()
-    nearRow, nearCol = _findindex(az, el, azpts, elpts)
+    nearRow, nearCol = _findindex(tree, azpts, elpts)
 
     return nearRow, nearCol
 
 
-def _findindex(az0, el0, az, el):
+def _findindex(tree: AzelTree, az, el):
     """
     inputs:
     ------
-    az0, el0: N-D array of azimuth, elevation. May be masked arrays
-    az, el: 1-D vectors of azimuth, elevation points from other camera to find closest angle for joint FOV.
+    tree: spatial index of camera 0 az, el
+    az, el: vectors of azimuth, elevation points from other camera to find closest angle for joint FOV.
 
     output:
-    row, col:  index of camera 0 closest to camera 1 FOV for each unmasked pixel
-
-    I think with some minor tweaks this could be numba.jit if too slow.
+    row, col:  index of camera 0 closest to camera 1 FOV for each point, edge pixels masked
     """
+    r, c = nearestpixel(tree, az, el)
 
-    assert az0.size == el0.size  # just for clarity
-    assert az.ndim == el.ndim == 1, "expect vector of test points"
-    ic = np.empty(az.size, dtype=int)
-
-    for i, (a, e) in enumerate(zip(az, el)):
-        # we do this point by point because we need to know the closest pixel for each point
-        # errang = haver.anglesep(az,el, apt,ept, deg=False)
-        ic[i] = haver.anglesep_meeus(az0, el0, a, e, deg=False).argmin()
-
-    """
-    THIS UNRAVEL_INDEX MUST BE ORDER = 'C'
-    """
-    r, c = np.unravel_index(ic, az0.shape, order="C")
-
-    mask = (c == 0) | (c == az0.shape[1] - 1) | (r == 0) | (r == az0.shape[0] - 1)
+    mask = edgemask(r, c, tree.shape)
 
     r = np.ma.masked_where(mask, r)
     c = np.ma.masked_where(mask, c)
 
     return r, c
+
+
+def edgemask(r: np.ndarray, c: np.ndarray, shape: T.Tuple[int, int]) -> np.ndarray:
+    """
+    True for pixels on the edge of the image
+    """
+    return (c == 0) | (c == shape[1] - 1) | (r == 0) | (r == shape[0] - 1)
@@ -0,0 +1,157 @@
+"""
+process-wide cache of decoded image frames, shared by all readers and viewers,
+so scrubbing back and forth or replaying doesn't read and decompress the same frames again.
+
+Frames are keyed by (file, dataset, frame index, orientation) and kept up to a memory budget,
+least recently used evicted first. Cached frames are read-only, since they are shared.
+
+    from histutils.framecache import CACHE
+    CACHE.maxbytes = 2 * 2 ** 30  # 2 GB budget
+    print(CACHE.stats())
+"""
+from pathlib import Path
+import os
+import threading
+from collections import OrderedDict
+import typing as T
+import numpy as np
+
+from .orient import Orientation
+
+FileKey = T.Tuple[T.Any, ...]
+
+
+class FrameCache:
+    """
+    LRU cache of frames with a budget in bytes. Safe to use from several threads.
+
+    Parameters
+    ----------
+    maxbytes: int
+        memory budget, 0 disables caching
+    """
+
+    def __init__(self, maxbytes: int = 512 * 2 ** 20):
+        self._frames: T.Dict[T.Hashable, T.Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self._maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def maxbytes(self) -> int:
+        return self._maxbytes
+
+    @maxbytes.setter
+    def maxbytes(self, maxbytes: int):
+        with self._lock:
+            self._maxbytes = maxbytes
+            self._evict()
+
+    def get(self, key: T.Hashable) -> T.Optional[T.Any]:
+        """
+        cached frame or None, counting the hit or miss
+        """
+        with self._lock:
+            v = self._frames.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key: T.Hashable, value: T.Any) -> T.Any:
+        """
+        caches a frame (or tuple of frame and metadata), made read-only. Returns value.
+        Values larger than the whole budget are not cached.
+        """
+        n = _nbytes(value)
+        for v in value if isinstance(value, tuple) else (value,):
+            if isinstance(v, np.ndarray):
+                v.flags.writeable = False
+
+        with self._lock:
+            if n > self._maxbytes:
+                return value
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self.nbytes -= _nbytes(old)
+            self._frames[key] = value
+            self.nbytes += n
+            self._evict()
+
+        return value
+
+    def _evict(self):
+        while self.nbytes > self._maxbytes and self._frames:
+            _, v = self._frames.popitem(last=False)
+            self.nbytes -= _nbytes(v)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def stats(self) -> T.Dict[str, int]:
+        return {
+            "frames": len(self),
+            "nbytes": self.nbytes,
+            "maxbytes": self._maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def __contains__(self, key: T.Hashable) -> bool:
+        return key in self._frames
+
+
+def _nbytes(value: T.Any) -> int:
+    if isinstance(value, tuple):
+        return sum(getattr(v, "nbytes", 0) for v in value)
+    return getattr(value, "nbytes", 0)
+
+
+def filekey(f: T.Union[Path, T.BinaryIO], appendonly: bool = False) -> T.Optional[FileKey]:
+    """
+    identity of a file's contents: path, device, inode and (unless frames are only ever appended,
+    as for .DMCdata) modification time. None if f is not a file on disk.
+
+    Parameters
+    ----------
+    f: pathlib.Path or BinaryIO
+        file path or open file
+    appendonly: bool, optional
+        existing frames never change, so the file growing doesn't invalidate them
+    """
+    try:
+        if isinstance(f, (str, Path)):
+            name = Path(f).expanduser().resolve()
+            st = name.stat()
+        else:
+            name = Path(f.name).resolve()
+            st = os.fstat(f.fileno())
+    except (AttributeError, OSError, TypeError, ValueError):
+        return None
+
+    if appendonly:
+        return (str(name), st.st_dev, st.st_ino)
+    return (str(name), st.st_dev, st.st_ino, st.st_mtime_ns)
+
+
+def framekey(
+    fkey: FileKey, dataset: str, i: int, orientation: Orientation = Orientation()
+) -> T.Tuple[T.Any, ...]:
+    """
+    cache key of frame i of dataset in file fkey, as oriented.
+    Equivalent orientations share a key.
+    """
+    return (fkey, dataset, int(i), orientation.d4)
+
+
+CACHE = FrameCache()
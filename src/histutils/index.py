@@ -1,8 +1,12 @@
 from pathlib import Path
+import os
 import numpy as np
 import typing as T
 import logging
-from struct import pack, unpack
+
+from .timedmc import datetime2unix, frame2ut1
+
+IDXVERSION = 2  # bump when the sidecar contents change
 
 
 def getRawInd(fn: Path, finf: T.Dict[str, int]) -> T.Tuple[int, int]:
@@ -43,14 +47,352 @@ def meta2rawInd(f: T.io.BinaryIO, Nmetadata: int) -> int:
     if Nmetadata < 1:
         rawind = None  # undefined
     else:
-        # FIXME works for .DMCdata version 1 only
         metad = np.fromfile(f, dtype=np.uint16, count=Nmetadata)
-        metad = pack("<2H", metad[1], metad[0])  # reorder 2 uint16
-        rawind = unpack("<I", metad)[0]  # always a tuple
+        rawind = int(footer2rawInd(metad))
+
+    return rawind
+
+
+def getAllRawInd(fn: Path, finf: T.Dict[str, int], start: int = 0) -> np.ndarray:
+    """
+    decodes the raw frame index of every frame in a .DMCdata file at once.
+    Only the footer bytes of each frame are read, via a strided memory map.
+
+    Parameters
+    ----------
+    fn: pathlib.Path
+        .DMCdata filename
+    finf: dict
+        needs nmetadata, bytes_image, bytes_frame
+    start: int, optional
+        first file frame to decode, e.g. the new frames of a file being recorded
+
+    Returns
+    -------
+    rawind: numpy.ndarray
+        int64 one-based raw frame index of each complete frame in the file from start on
+    """
+    fn = Path(fn).expanduser()
+    if not isinstance(finf["nmetadata"], int):
+        raise TypeError(finf["nmetadata"])
+
+    nframe = max(fn.stat().st_size // finf["bytes_frame"] - start, 0)
+
+    if finf["nmetadata"] < 1 or nframe < 1:  # no header, only raw images
+        return np.arange(start + 1, start + nframe + 1, dtype=np.int64)
+
+    footer = np.dtype(
+        {
+            "names": ["footer"],
+            "formats": [(np.uint16, (finf["nmetadata"],))],
+            "offsets": [finf["bytes_image"]],
+            "itemsize": finf["bytes_frame"],
+        }
+    )
+
+    mm = np.memmap(fn, dtype=footer, mode="r", offset=start * finf["bytes_frame"], shape=(nframe,))
+    rawind = footer2rawInd(mm["footer"])
+    del mm  # close the map, rawind is a new array
 
     return rawind
 
 
+def footer2rawInd(metad: np.ndarray) -> np.ndarray:
+    """
+    vectorized meta2rawInd for many frames at once
+
+    Parameters
+    ----------
+    metad: numpy.ndarray
+        uint16 footer words of each frame, shape ... x Nmetadata
+
+    Returns
+    -------
+    rawind: numpy.ndarray
+        int64 one-based raw frame index of each frame
+    """
+    # FIXME works for .DMCdata version 1 only
+    metad = np.asarray(metad)
+    # the two uint16 words are stored swapped relative to a little-endian uint32
+    return (metad[..., 0].astype(np.int64) << 16) | metad[..., 1].astype(np.int64)
+
+
+def idxfilename(fn: Path) -> Path:
+    """
+    frame index sidecar filename for a .DMCdata file e.g. my.DMCdata -> my.DMCdata.idx.npz
+    """
+    fn = Path(fn).expanduser()
+    return fn.with_name(fn.name + ".idx.npz")
+
+
+def loadFrameIndex(
+    fn: Path, finf: T.Dict[str, T.Any], params: T.Dict[str, T.Any] = None, write: bool = True
+) -> T.Dict[str, T.Any]:
+    """
+    per-frame index of a .DMCdata file, persisted in a sidecar file next to it
+    so that later calls do not have to scan the file again.
+    The sidecar is rebuilt if the file size or modification time changed,
+    except that only the new frames are indexed if the file grew (is being recorded).
+
+    Parameters
+    ----------
+    fn: pathlib.Path
+        .DMCdata filename
+    finf: dict
+        needs nmetadata, header_bytes, bytes_image, bytes_frame
+    params: dict, optional
+        startUTC, kineticsec for the UT1 estimate
+    write: bool, optional
+        write / update the sidecar file (a read-only archive is OK either way)
+
+    Returns
+    -------
+    idx: dict
+        rawind: int64 raw frame index of each frame
+        offset: int64 byte offset of each frame in the file
+        gapind: file frame index after which frames were dropped
+        gaplen: number of raw frames dropped at each gapind
+        gapmap: run-length map raw index -> file frame, see rawind2gapmap()
+        ut1: estimated UT1 unix time of each frame, None if startUTC, kineticsec were not given
+    """
+    fn = Path(fn).expanduser()
+    if not fn.is_file():
+        raise FileNotFoundError(fn)
+
+    st = fn.stat()
+    key = np.array(
+        [IDXVERSION, st.st_size, st.st_mtime_ns, finf["bytes_frame"], finf["header_bytes"]],
+        dtype=np.int64,
+    )
+
+    idxfn = idxfilename(fn)
+    idx = _readFrameIndex(idxfn, key, grown=True)
+
+    changed = idx is None or not np.array_equal(idx["key"], key)
+    if changed and idx is not None:
+        idx = _growFrameIndex(fn, finf, idx, key)
+
+    if idx is None:
+        logging.info(f"indexing frames of {fn}")
+        idx = _newFrameIndex(key, getAllRawInd(fn, finf), finf)
+    # %% absolute time estimate, recomputed only if the timing parameters changed
+    tstart = kineticsec = None
+    if params and params.get("startUTC") is not None and params.get("kineticsec"):
+        tstart = float(datetime2unix(params["startUTC"])[0])
+        kineticsec = float(params["kineticsec"])
+
+        if changed or idx["tstart"] != tstart or idx["kineticsec"] != kineticsec:
+            idx["ut1"] = frame2ut1(tstart, kineticsec, idx["rawind"])
+            idx["tstart"] = np.array(tstart)
+            idx["kineticsec"] = np.array(kineticsec)
+            changed = True
+
+    if changed and write:
+        _writeFrameIndex(idxfn, idx)
+
+    out = {k: idx[k] for k in ("rawind", "offset", "gapind", "gaplen", "gapmap")}
+    out["ut1"] = idx["ut1"] if tstart is not None else None
+
+    return out
+
+
+def _newFrameIndex(
+    key: np.ndarray, rawind: np.ndarray, finf: T.Dict[str, T.Any]
+) -> T.Dict[str, T.Any]:
+    gapmap = rawind2gapmap(rawind)
+
+    return {
+        "key": key,
+        "rawind": rawind,
+        "offset": np.arange(rawind.size, dtype=np.int64) * finf["bytes_frame"],
+        "gapind": gapmap[1:, 1] - 1,
+        "gaplen": gapmap[1:, 0] - (gapmap[:-1, 0] + gapmap[:-1, 2]),
+        "gapmap": gapmap,
+        "ut1": np.empty(0),
+        "tstart": np.array(np.nan),
+        "kineticsec": np.array(np.nan),
+    }
+
+
+def _growFrameIndex(
+    fn: Path, finf: T.Dict[str, T.Any], idx: T.Dict[str, T.Any], key: np.ndarray
+) -> T.Optional[T.Dict[str, T.Any]]:
+    """
+    index of a file that grew since idx, reading only the footers of the new frames.
+    None if the indexed frames changed too, e.g. the file was overwritten.
+    """
+    old = idx["rawind"]
+    N = old.size
+    # the last indexed frame must be the same, else the file was rewritten
+    if N and not np.array_equal(getAllRawInd(fn, finf, N - 1)[:1], old[-1:]):
+        logging.info(f"{fn} was rewritten, reindexing")
+        return None
+
+    new = getAllRawInd(fn, finf, N)
+    logging.info(f"indexing {new.size} new frames of {fn}")
+
+    return _newFrameIndex(key, np.concatenate((old, new)), finf)
+
+
+def _readFrameIndex(idxfn: Path, key: np.ndarray, grown: bool = False) -> T.Dict[str, np.ndarray]:
+    """
+    sidecar index if its key matches, or with grown=True also if the file has only grown since
+    """
+    if not idxfn.is_file():
+        return None
+
+    try:
+        with np.load(idxfn, allow_pickle=False) as z:
+            old = z["key"]
+            # same version and frame size, smaller file
+            if not np.array_equal(old, key) and not (
+                grown
+                and old.shape == key.shape
+                and old[0] == key[0]
+                and (old[3:] == key[3:]).all()
+                and old[1] < key[1]
+            ):
+                logging.info(f"{idxfn} is stale, reindexing")
+                return None
+            return {k: z[k] for k in z.files}
+    except (OSError, KeyError, ValueError) as e:
+        logging.warning(f"could not read frame index {idxfn}  {e}")
+        return None
+
+
+def _writeFrameIndex(idxfn: Path, idx: T.Dict[str, np.ndarray]):
+    # write then rename so that a concurrent reader never sees a partial file
+    tmpfn = idxfn.with_name(idxfn.name + f".{os.getpid()}.tmp")
+    try:
+        with tmpfn.open("wb") as f:
+            np.savez(f, **idx)
+        os.replace(tmpfn, idxfn)
+    except OSError as e:  # read-only archive, etc.
+        logging.warning(f"could not write frame index {idxfn}  {e}")
+        try:
+            tmpfn.unlink()
+        except OSError:
+            pass
+
+
+def rawind2gapmap(rawind: np.ndarray, step: int = 1) -> np.ndarray:
+    """
+    finds dropped frames, giving a compact run-length map of raw frame index -> file frame index
+
+    Parameters
+    ----------
+    rawind: numpy.ndarray
+        raw frame index of each frame in the file
+    step: int, optional
+        raw index step between consecutive frames, e.g. of a file converted with a frame stride
+
+    Returns
+    -------
+    gapmap: numpy.ndarray
+        Nrun x 3 int64, each row is a run of raw indices step apart:
+        (first raw index, file frame index of first raw index, number of frames)
+    """
+    rawind = np.asarray(rawind, dtype=np.int64)
+    if rawind.size == 0:
+        return np.empty((0, 3), dtype=np.int64)
+
+    jump = np.diff(rawind)
+    if (jump < 1).any():
+        logging.error(
+            f"raw frame index goes backward or repeats at {np.flatnonzero(jump < 1)[:10]}, "
+            "was the camera restarted?"
+        )
+
+    start = np.concatenate(([0], np.flatnonzero(jump != step) + 1))
+    length = np.diff(np.append(start, rawind.size))
+
+    return np.column_stack((rawind[start], start, length))
+
+
+def raw2frame(gapmap: np.ndarray, rawreq: np.ndarray, side: str = "exact") -> np.ndarray:
+    """
+    file frame index of raw frame indices, by bisection of the gap map
+
+    Parameters
+    ----------
+    gapmap: numpy.ndarray
+        from rawind2gapmap()
+    rawreq: numpy.ndarray
+        raw frame indices requested
+    side: str
+        what to do when a requested frame was dropped or is outside the file
+        "exact": -1
+        "prev": last frame before (-1 if none)
+        "next": first frame after (-1 if none)
+        "nearest": closest frame in the file
+
+    Returns
+    -------
+    frame: numpy.ndarray
+        int64 zero-based file frame index
+    """
+    rawreq = np.atleast_1d(np.asarray(rawreq, dtype=np.int64))
+    if gapmap.shape[0] == 0:
+        return np.full(rawreq.shape, -1, dtype=np.int64)
+
+    S, F, L = gapmap[:, 0], gapmap[:, 1], gapmap[:, 2]
+    nrun = S.size
+    # run containing, or just before, each request
+    r = np.searchsorted(S, rawreq, side="right") - 1
+    rc = r.clip(0)
+    off = rawreq - S[rc]
+    inside = (r >= 0) & (off < L[rc])
+
+    if side == "exact":
+        return np.where(inside, F[rc] + off, -1)
+
+    prev = np.where(r >= 0, F[rc] + np.minimum(off, L[rc] - 1), -1)
+    n = r + 1
+    nc = n.clip(max=nrun - 1)
+    nxt = np.where(n < nrun, F[nc], -1)
+
+    if side == "prev":
+        return prev
+    if side == "next":
+        return np.where(inside, F[rc] + off, nxt)
+    if side != "nearest":
+        raise ValueError(f"unknown side {side}")
+
+    dprev = np.where(prev >= 0, rawreq - (S[rc] + L[rc] - 1), np.iinfo(np.int64).max)
+    dnext = np.where(nxt >= 0, S[nc] - rawreq, np.iinfo(np.int64).max)
+
+    return np.where(inside, F[rc] + off, np.where(dprev <= dnext, prev, nxt))
+
+
+def ut12frameGap(treq, gapmap: np.ndarray, tstart, kineticsec: float) -> T.Optional[np.ndarray]:
+    """
+    like timedmc.ut12frame, but resolves the requested times to file frames through the
+    dropped-frame map, so that frames after a gap are correct, in O(log Nrun) per request.
+
+    treq: scalar, vector, or (start, stop) of ut1_unix time or parseable datetime string
+    """
+    if treq is None:
+        return None
+
+    treq = np.atleast_1d(treq)
+    t0 = datetime2unix(tstart)[0]
+    # inverse of frame2ut1()
+    if treq.size == 2:  # all frames strictly between start, stop
+        rawstart = (datetime2unix(treq[0])[0] - t0) / kineticsec + 1
+        rawstop = (datetime2unix(treq[1])[0] - t0) / kineticsec + 1
+
+        first = raw2frame(gapmap, np.floor(rawstart) + 1, "next")[0]
+        last = raw2frame(gapmap, np.ceil(rawstop) - 1, "prev")[0]
+        if first < 0 or last < first:
+            return np.empty(0, dtype=np.int64)
+
+        return np.arange(first, last + 1, dtype=np.int64)
+
+    raw = np.rint((datetime2unix(treq) - t0) / kineticsec + 1)
+
+    return raw2frame(gapmap, raw, "nearest")
+
+
 def req2frame(req: T.Sequence[int], N: int = 0) -> np.ndarray:
     """
     output has to be numpy.arange for > comparison
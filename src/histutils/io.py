@@ -1,10 +1,14 @@
 from pathlib import Path
+import zlib
 import numpy as np
 import h5py
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, Callable, Optional, Tuple
+from math import gcd
 from datetime import datetime
 import logging
 
+from .orient import Orientation
+
 
 def dir2fn(ofn: Path, ifn: Path, suffix: str = ".h5") -> Path:
     """
@@ -71,11 +75,137 @@ def imgwriteincr(fn: Path, imgs: np.ndarray, imgslice: Union[int, slice]):
         with h5py.File(fn, "r+") as f:
             f["/rawimg"][imgslice, :, :] = imgs
     elif isinstance(fn, h5py.File):
-        f["/rawimg"][imgslice, :, :] = imgs
+        fn["/rawimg"][imgslice, :, :] = imgs
     else:
         raise TypeError(f"{fn} must be Path or h5py.File instead of {type(fn)}")
 
 
+class ImageStackWriter:
+    """
+    keeps one HDF5 file open while writing a huge image stack, buffering frames so that
+    they are written as one hyperslab instead of one HDF5 write per frame.
+
+    with ImageStackWriter(outfn, finf) as W:
+        for j, img in enumerate(frames):
+            W.write(img, j)
+
+    Parameters
+    ----------
+    fn: pathlib.Path
+        HDF5 filename to write / append to
+    params: dict
+        super_y, super_x, nframeextract of the image stack, created by setupimgh5() if needed.
+        An existing image stack must have this shape, dtype and profile chunks.
+    nbuffer: int, optional
+        number of frames to buffer before writing
+    cachebytes: int, optional
+        HDF5 chunk cache size in bytes
+    key: str, optional
+        image stack dataset in the HDF5 file
+    profile: str, optional
+        chunking and compression of a new image stack, one of STORAGE_PROFILES
+    """
+
+    def __init__(
+        self,
+        fn: Path,
+        params: Dict[str, Any],
+        *,
+        nbuffer: int = 32,
+        cachebytes: int = 64 * 2 ** 20,
+        key: str = "/rawimg",
+        dtype=np.uint16,
+        profile: str = "archive",
+    ):
+        self.fn = Path(fn).expanduser()
+        if self.fn.is_dir():
+            raise IsADirectoryError(self.fn)
+
+        self.params = params
+        self.nbuffer = max(1, nbuffer)
+        self.cachebytes = cachebytes
+        self.key = key
+        self.dtype = dtype
+        self.profile = profile
+
+        self.f: h5py.File = None
+        self.h: h5py.Dataset = None
+        self.buf: np.ndarray = None
+        self.start = 0  # image stack index of first buffered frame
+        self.nbuf = 0  # number of frames buffered
+
+    def __enter__(self) -> "ImageStackWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.f = h5py.File(self.fn, "a", rdcc_nbytes=self.cachebytes)
+        if self.key not in self.f:
+            setupimgh5(self.f, self.params, dtype=self.dtype, key=self.key, profile=self.profile)
+        self.h = self.f[self.key]
+
+        # an image stack left by an earlier run must be the one this run would create
+        shape = (self.params["nframeextract"], self.params["super_y"], self.params["super_x"])
+        if (self.h.shape, self.h.dtype, self.h.chunks) != (
+            shape,
+            np.dtype(self.dtype),
+            profilechunks(self.profile, shape),
+        ):
+            found = f"{self.h.shape} {self.h.dtype} chunks {self.h.chunks}"
+            self.f.close()
+            self.f = self.h = None
+            raise ValueError(
+                f"{self.fn}:{self.key} is {found}, not {shape} {np.dtype(self.dtype)} "
+                f"{self.profile} chunks. Remove the old output file first."
+            )
+        self.buf = np.empty((self.nbuffer,) + self.h.shape[1:], dtype=self.h.dtype)
+
+    def write(self, imgs: np.ndarray, j: int = None):
+        """
+        imgs: Ny x Nx image or N x Ny x Nx images
+        j: image stack index of first image (default: just after the previous images written)
+        """
+        if self.h is None:
+            raise OSError(f"{self.fn} is not open")
+
+        imgs = np.asarray(imgs)
+        if imgs.ndim == 2:
+            imgs = imgs[None, ...]
+
+        if j is None:
+            j = self.start + self.nbuf
+        if j != self.start + self.nbuf:  # not contiguous with buffer
+            self.flush()
+            self.start = j
+
+        for img in imgs:
+            if self.nbuf == self.nbuffer:
+                self.flush()
+            self.buf[self.nbuf] = img
+            self.nbuf += 1
+
+    def flush(self):
+        if self.nbuf:
+            stop = self.start + self.nbuf
+            self.h[slice(self.start, stop), :, :] = self.buf[: self.nbuf]
+            if stop // 2000 > self.start // 2000:
+                print(f"appending images {stop} to {self.fn}")
+            self.start = stop
+            self.nbuf = 0
+
+    def close(self):
+        if self.f is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.f.close()
+            self.f = self.h = None
+
+
 def vid2h5(
     data: np.ndarray,
     *,
@@ -88,6 +218,7 @@ def vid2h5(
     det=None,
     tstart=None,
     cmdlog: str = None,
+    ut1attrs: Dict[str, Any] = None,
 ):
 
     if not params.get("outfn"):
@@ -149,6 +280,9 @@ def vid2h5(
                 fut1.attrs["units"] = "seconds since Unix epoch Jan 1 1970 midnight"
 
             f["/ut1_unix"][ind] = ut1
+            # e.g. the GPS & fire timing model, see timedmc.firetime()
+            for k, v in (ut1attrs or {}).items():
+                f["/ut1_unix"].attrs[k] = v
 
         if tstart is not None and "tstart" not in f:
             f["/tstart"] = tstart
@@ -185,15 +319,9 @@ def vid2h5(
             f["/detect"][i] = det[i]
 
         if "params" not in f:
+            o = Orientation.fromparams(params).toparams()
             cparam = np.array(
-                (
-                    params["kineticsec"],
-                    params["rotccw"],
-                    params["transpose"],
-                    params["flipud"],
-                    params["fliplr"],
-                    1,
-                ),
+                (params["kineticsec"], o["rotccw"], o["transpose"], o["flipud"], o["fliplr"], 1),
                 dtype=[
                     ("kineticsec", "f8"),
                     ("rotccw", "i1"),
@@ -233,6 +361,50 @@ def vid2h5(
             f["/hdf5version"] = h5py.version.hdf5_version_tuple
 
 
+# HDF5 image stack storage profiles.
+# chunks are frames x rows x cols, None means the whole image axis.
+# * archive: one gzip image per chunk, smallest files, fine for frame by frame playback
+# * fast-read: several LZF frames per chunk, for fast full-frame reads
+# * keogram: long time runs of small tiles, for reading pixel time series e.g. along a 1-D cut
+STORAGE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "archive": {
+        "chunks": (1, None, None),
+        # no difference in filesize from 1 to 5, except much faster to use lower numbers!
+        "compression": "gzip",
+        "compression_opts": 1,
+        "shuffle": True,
+        "fletcher32": True,
+    },
+    "fast-read": {
+        "chunks": (8, None, None),
+        "compression": "lzf",
+        "compression_opts": None,
+        "shuffle": True,
+        "fletcher32": False,
+    },
+    "keogram": {
+        "chunks": (256, 16, 16),
+        "compression": "gzip",
+        "compression_opts": 1,
+        "shuffle": True,
+        "fletcher32": True,
+    },
+}
+
+
+def profilechunks(profile: str, shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    """
+    chunk shape of a storage profile for an image stack of this shape
+    """
+    try:
+        chunks = STORAGE_PROFILES[profile]["chunks"]
+    except KeyError:
+        raise ValueError(f"unknown storage profile {profile}, choose from {list(STORAGE_PROFILES)}")
+
+    # HDF5 chunks may not be bigger than a fixed size dataset
+    return tuple(max(1, min(c or n, n)) for c, n in zip(chunks, shape))
+
+
 def setupimgh5(
     f: Union[Path, h5py.File],
     params: Dict[str, int],
@@ -241,6 +413,7 @@ def setupimgh5(
     writemode: str = "r+",
     key: str = "/rawimg",
     cmdlog: str = None,
+    profile: str = "archive",
 ):
     """
     Configures an HDF5 file for storing image stacks, enabling video player in
@@ -251,6 +424,9 @@ def setupimgh5(
     f: HDF5 handle (or filename)
 
     h: HDF5 dataset handle
+
+    profile: str, optional
+        chunking and compression, one of STORAGE_PROFILES
     """
     if isinstance(f, (str, Path)):  # assume new HDF5 file wanted
         f = Path(f).expanduser()
@@ -260,21 +436,25 @@ def setupimgh5(
             writemode = "w"
 
         with h5py.File(f, writemode) as F:
-            setupimgh5(F, params, dtype=dtype, writemode=writemode, key=key)
+            setupimgh5(
+                F, params, dtype=dtype, writemode=writemode, key=key, cmdlog=cmdlog, profile=profile
+            )
 
     elif isinstance(f, h5py.File):
         Nrow, Ncol = params["super_y"], params["super_x"]
+        shape = (params["nframeextract"], Nrow, Ncol)
+        chunks = profilechunks(profile, shape)
+        opts = STORAGE_PROFILES[profile]
 
         h = f.create_dataset(
             key,
-            shape=(params["nframeextract"], Nrow, Ncol),
+            shape=shape,
             dtype=dtype,
-            chunks=(1, Nrow, Ncol),  # each image is a chunk
-            compression="gzip",
-            # no difference in filesize from 1 to 5, except much faster to use lower numbers!
-            compression_opts=1,
-            shuffle=True,
-            fletcher32=True,
+            chunks=chunks,
+            compression=opts["compression"],
+            compression_opts=opts["compression_opts"],
+            shuffle=opts["shuffle"],
+            fletcher32=opts["fletcher32"],
             track_times=True,
         )
         h.attrs["CLASS"] = np.string_("IMAGE")
@@ -282,8 +462,186 @@ def setupimgh5(
         h.attrs["IMAGE_SUBCLASS"] = np.string_("IMAGE_GRAYSCALE")
         h.attrs["DISPLAY_ORIGIN"] = np.string_("LL")
         h.attrs["IMAGE_WHITE_IS_ZERO"] = np.uint8(0)
+        h.attrs["storage_profile"] = np.string_(profile)
 
         if cmdlog and isinstance(cmdlog, str):
             f["/cmdlog"] = cmdlog
     else:
         raise TypeError(f"{type(f)} is not correct, must be filename or h5py.File HDF5 file handle")
+
+
+def rechunkh5(
+    infn: Path,
+    outfn: Path,
+    profile: str,
+    *,
+    key: str = "/rawimg",
+    batchbytes: int = 256 * 2 ** 20,
+):
+    """
+    copies an HDF5 image stack file, storing the image stack with another storage profile.
+    The images are copied a batch of frames at a time, so files bigger than RAM are OK.
+    Everything else in the file is copied as is.
+
+    Parameters
+    ----------
+    infn: pathlib.Path
+        HDF5 file to read
+    outfn: pathlib.Path
+        HDF5 file to write
+    profile: str
+        storage profile of the output, one of STORAGE_PROFILES
+    key: str, optional
+        image stack to rechunk
+    batchbytes: int, optional
+        approximate memory used per batch of frames
+    """
+    infn = Path(infn).expanduser()
+    outfn = Path(outfn).expanduser()
+    if outfn.exists() and outfn.samefile(infn):
+        raise FileExistsError(f"do not overwrite input file! {infn}")
+
+    name = key.strip("/")
+    if "/" in name:
+        raise ValueError(f"image stack {key} must be at the top level of {infn}")
+
+    with h5py.File(infn, "r") as fi, h5py.File(outfn, "w") as fo:
+        for k in fi:
+            if k != name:
+                fi.copy(fi[k], fo, name=k)
+        for k, v in fi.attrs.items():
+            fo.attrs[k] = v
+
+        hi = fi[key]
+        N, Nrow, Ncol = hi.shape
+        setupimgh5(
+            fo,
+            {"nframeextract": N, "super_y": Nrow, "super_x": Ncol},
+            dtype=hi.dtype,
+            key=key,
+            profile=profile,
+        )
+        ho = fo[key]
+        for k, v in hi.attrs.items():
+            if k != "storage_profile":
+                ho.attrs[k] = v
+        # %% batches are whole chunks of both input and output along time
+        cin = hi.chunks[0] if hi.chunks else 1
+        align = cin * ho.chunks[0] // gcd(cin, ho.chunks[0])
+        step = max(1, batchbytes // (align * Nrow * Ncol * hi.dtype.itemsize)) * align
+
+        for j in range(0, N, step):
+            ind = slice(j, min(j + step, N))
+            ho[ind, :, :] = hi[ind, :, :]
+            print(f"{ind.stop} / {N} frames rechunked to {outfn}\r", end="")
+        print()
+
+
+def chunkencoder(h: h5py.Dataset) -> Optional[Callable[[np.ndarray], bytes]]:
+    """
+    returns a function that applies the filter pipeline of dataset h to one full chunk,
+    giving bytes for h.id.write_direct_chunk().
+    The encoder releases the GIL while compressing, so it can run in a thread pool.
+
+    None if the filters of h are not ones we know how to apply (use normal writes then).
+    """
+    if h.chunks is None or h.compression not in (None, "gzip") or h.scaleoffset is not None:
+        return None
+
+    level = h.compression_opts
+    itemsize = h.dtype.itemsize
+    shuffle = h.shuffle and itemsize > 1
+    fletcher32 = h.fletcher32
+
+    def encode(chunk: np.ndarray) -> bytes:
+        if chunk.shape != h.chunks:
+            raise ValueError(f"chunk shape {chunk.shape} != dataset chunk shape {h.chunks}")
+
+        chunk = np.ascontiguousarray(chunk, dtype=h.dtype)
+        # same order as the HDF5 filter pipeline h5py sets up: shuffle, deflate, fletcher32
+        if shuffle:
+            buf = chunk.view(np.uint8).reshape((-1, itemsize)).T.tobytes()
+        else:
+            buf = chunk.tobytes()
+        if level is not None:
+            buf = zlib.compress(buf, level)
+        if fletcher32:
+            buf += _fletcher32(buf).to_bytes(4, "little")
+
+        return buf
+
+    return encode
+
+
+def chunkdecoder(h: h5py.Dataset) -> Optional[Callable[[bytes], np.ndarray]]:
+    """
+    inverse of chunkencoder(): returns a function that decodes the bytes from
+    h.id.read_direct_chunk() into a chunk shaped array, verifying the fletcher32 checksum.
+    The decoder releases the GIL while decompressing, so it can run in a thread pool.
+
+    None if the filters of h are not ones we know how to undo (use normal reads then).
+    """
+    if h.chunks is None or h.compression not in (None, "gzip") or h.scaleoffset is not None:
+        return None
+
+    compressed = h.compression is not None
+    dtype = h.dtype
+    chunks = h.chunks
+    itemsize = dtype.itemsize
+    shuffle = h.shuffle and itemsize > 1
+    fletcher32 = h.fletcher32
+
+    def decode(buf: bytes) -> np.ndarray:
+        if fletcher32:
+            buf, stored = buf[:-4], buf[-4:]
+            check = _fletcher32(buf).to_bytes(4, "little")
+            # HDF5 < 1.6.3 wrote the checksum with the bytes of each 16-bit half swapped
+            if stored != check and stored != check[1::-1] + check[:1:-1]:
+                raise OSError("fletcher32 checksum mismatch, the HDF5 file is corrupted")
+        if compressed:
+            buf = zlib.decompress(buf)
+        if shuffle:
+            a = np.frombuffer(buf, dtype=np.uint8).reshape((itemsize, -1)).T.copy()
+        else:
+            a = np.frombuffer(buf, dtype=np.uint8)
+
+        return a.view(dtype).reshape(chunks)
+
+    return decode
+
+
+def _fletcher32(buf: bytes) -> int:
+    """
+    HDF5 H5_checksum_fletcher32(), summing blocks of 360 big-endian 16-bit words at a time
+    """
+    N = len(buf)
+    words = np.frombuffer(buf, dtype=">u2", count=N // 2).astype(np.int64)
+
+    nblock = -(-words.size // 360)
+    blocks = np.zeros(nblock * 360, dtype=np.int64)
+    blocks[: words.size] = words
+    blocks = blocks.reshape((nblock, 360))
+    # each word adds to sum2 once per remaining word in its block (zero padding adds nothing)
+    tlen = np.full(nblock, 360, dtype=np.int64)
+    if nblock:
+        tlen[-1] = words.size - (nblock - 1) * 360
+    S = blocks.sum(axis=1)
+    W = (blocks * np.arange(360, 0, -1)).sum(axis=1) - (360 - tlen) * S
+
+    sum1 = sum2 = 0
+    for t, s, w in zip(tlen.tolist(), S.tolist(), W.tolist()):
+        sum2 = (sum2 + t * sum1 + w) & 0xFFFFFFFF
+        sum1 = (sum1 + s) & 0xFFFFFFFF
+        sum1 = (sum1 & 0xFFFF) + (sum1 >> 16)
+        sum2 = (sum2 & 0xFFFF) + (sum2 >> 16)
+
+    if N % 2:
+        sum1 += buf[-1] << 8
+        sum2 += sum1
+        sum1 = (sum1 & 0xFFFF) + (sum1 >> 16)
+        sum2 = (sum2 & 0xFFFF) + (sum2 >> 16)
+
+    sum1 = (sum1 & 0xFFFF) + (sum1 >> 16)
+    sum2 = (sum2 & 0xFFFF) + (sum2 >> 16)
+
+    return (sum2 << 16) | sum1
@@ -0,0 +1,210 @@
+"""
+keogram (pixel time series along a 1-D cut) extraction from HDF5 video files,
+reading only the parts of the image stack containing the cut pixels.
+
+Cut pixels are given in oriented image coordinates (as Cam.cutrow, Cam.cutcol) and mapped back
+to the raw image stored in the file. With the "keogram" storage profile (small tiles, long in time)
+only the tiles under the cut are decompressed. For any storage profile, the whole-file keogram
+of a cut can be cached in the file under /keogram, so later extractions read only that.
+"""
+from pathlib import Path
+import logging
+import hashlib
+import typing as T
+import numpy as np
+import h5py
+
+from .orient import Orientation
+
+
+def keogram(
+    src: T.Union[Path, h5py.Dataset],
+    cutrow: np.ndarray,
+    cutcol: np.ndarray,
+    ind: np.ndarray = None,
+    orientation: Orientation = Orientation(),
+    *,
+    key: str = "/rawimg",
+    cache: bool = False,
+    batch: int = 1024,
+) -> np.ndarray:
+    """
+    Parameters
+    ----------
+    src: pathlib.Path or h5py.Dataset
+        HDF5 video file or its image stack
+    cutrow, cutcol: numpy.ndarray of int
+        pixels of the cut in the oriented image
+    ind: numpy.ndarray of int, optional
+        frame indices, may be repeated or out of order (default: all frames)
+    orientation: Orientation, optional
+        orientation of the images (e.g. Cam.orientation)
+    cache: bool, optional
+        use (and if needed create) the whole-file keogram of this cut under /keogram of the file
+    batch: int, optional
+        frames read at a time
+
+    Returns
+    -------
+    keo: numpy.ndarray
+        Npixel x Ntime, like im[:, cutrow, cutcol].T of the oriented image stack im
+    """
+    if not isinstance(src, h5py.Dataset):
+        fn = Path(src).expanduser()
+        f = None
+        if cache:
+            try:
+                f = h5py.File(fn, "r+")
+            except OSError:
+                logging.warning(f"{fn} is not writable, reading keogram without cache")
+                cache = False
+        if f is None:
+            f = h5py.File(fn, "r")
+
+        with f:
+            return keogram(f[key], cutrow, cutcol, ind, orientation, cache=cache, batch=batch)
+
+    h = src
+    if h.ndim != 3:
+        raise ValueError("image stack must be Nframe x Ny x Nx")
+
+    row, col = orientation.origpixel(
+        np.atleast_1d(cutrow), np.atleast_1d(cutcol), orientation.shape(h.shape)
+    )
+
+    if ind is None:
+        ind = np.arange(h.shape[0])
+    ind = np.atleast_1d(ind).astype(int)
+    if ind.size > 0 and (ind.min() < 0 or ind.max() >= h.shape[0]):
+        raise IndexError(f"frame indices must be within 0..{h.shape[0] - 1}")
+    # h5py needs increasing indices: read each frame once, then put in requested order
+    uind, inv = np.unique(ind, return_inverse=True)
+
+    if cache:
+        keo = _cachedkeogram(h, row, col, batch)
+        if keo is not None:
+            if uind.size == 0:
+                return np.empty((row.size, 0), dtype=h.dtype)
+            # small enough to read the whole time span at once
+            span = keo[slice(uind[0], uind[-1] + 1)]
+            return span[uind - uind[0]][inv].T
+
+    return readkeogram(h, row, col, uind, batch)[inv].T
+
+
+def readkeogram(
+    h: h5py.Dataset,
+    row: np.ndarray,
+    col: np.ndarray,
+    ind: np.ndarray,
+    batch: int = 1024,
+    maxbytes: int = 64 * 2 ** 20,
+) -> np.ndarray:
+    """
+    reads pixels (row, col) of the raw image stack for increasing frame indices ind,
+    one read per chunk tile under the pixels.
+    Where a chunk is a whole frame, one read per run of rows holding cut pixels instead.
+
+    Parameters
+    ----------
+    batch: int, optional
+        maximum frames read at a time
+    maxbytes: int, optional
+        maximum bytes read at a time
+
+    Returns
+    -------
+    keo: numpy.ndarray
+        Ntime x Npixel
+    """
+    keo = np.empty((ind.size, row.size), dtype=h.dtype)
+    if ind.size == 0:
+        return keo
+
+    Ny, Nx = h.shape[1:]
+    # contiguous datasets are read a row at a time
+    cf, cy, cx = h.chunks if h.chunks else (1, 1, Nx)
+
+    tiles: T.Dict[T.Tuple[int, int], T.List[int]] = {}
+    for i, (r, c) in enumerate(zip(row.tolist(), col.tolist())):
+        tiles.setdefault((r // cy, c // cx), []).append(i)
+
+    # pixel indices of each read
+    boxes: T.List[np.ndarray] = []
+    for j in tiles.values():
+        j = np.asarray(j)
+        if cy < Ny or cx < Nx:
+            boxes.append(j)
+            continue
+        r = row[j]
+        rows = np.unique(r)
+        for run in np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1):
+            boxes.append(j[(r >= run[0]) & (r <= run[-1])])
+
+    sel = [
+        (j, slice(row[j].min(), row[j].max() + 1), slice(col[j].min(), col[j].max() + 1))
+        for j in boxes
+    ]
+    # frames per read, within the memory budget and in whole chunks in time if possible
+    framebytes = h.dtype.itemsize * sum((r.stop - r.start) * (c.stop - c.start) for _, r, c in sel)
+    nt = max(min(batch, maxbytes // framebytes), 1)
+    if nt >= cf:
+        nt = nt // cf * cf
+
+    for t0 in range(0, ind.size, nt):
+        out = slice(t0, min(t0 + nt, ind.size))
+        tind = ind[out]
+        # slice if consecutive frames, much faster than point selection
+        tsel = slice(tind[0], tind[-1] + 1) if tind[-1] - tind[0] + 1 == tind.size else tind
+        for j, rs, cs in sel:
+            block = h[tsel, rs, cs]
+            keo[out, j] = block[:, row[j] - rs.start, col[j] - cs.start]
+
+    return keo
+
+
+def keoname(row: np.ndarray, col: np.ndarray) -> str:
+    """
+    /keogram dataset name for raw image pixels row, col
+    """
+    rc = np.stack((row, col)).astype(np.int64)
+    return "/keogram/" + hashlib.sha1(rc.tobytes()).hexdigest()[:16]
+
+
+def _cachedkeogram(
+    h: h5py.Dataset, row: np.ndarray, col: np.ndarray, batch: int
+) -> T.Optional[h5py.Dataset]:
+    """
+    whole-file keogram of the cut, written first if needed. None if the file is read-only.
+    """
+    name = keoname(row, col)
+    f = h.file
+    if name in f and f[name].shape == (h.shape[0], row.size):
+        return f[name]
+    if f.mode != "r+":
+        logging.warning(f"{f.filename} is opened read-only, reading keogram without cache")
+        return None
+
+    if name in f:  # video was appended to since
+        del f[name]
+
+    N = h.shape[0]
+    d = f.create_dataset(
+        name,
+        shape=(N, row.size),
+        dtype=h.dtype,
+        chunks=(min(N, 4096), row.size),
+        compression="gzip",
+        compression_opts=1,
+        shuffle=True,
+    )
+    d.attrs["rawrow"] = row
+    d.attrs["rawcol"] = col
+    d.attrs["source"] = h.name
+    d.attrs["description"] = "time x pixel keogram of raw image pixels rawrow, rawcol"
+
+    for t0 in range(0, N, max(batch, 1)):
+        tind = np.arange(t0, min(t0 + batch, N))
+        d[slice(t0, t0 + tind.size)] = readkeogram(h, row, col, tind, batch)
+
+    return d
@@ -0,0 +1,139 @@
+"""
+image orientation: transpose, rotate counterclockwise, flip left-right, flip up-down, in that order.
+
+Any combination of these is one of the 8 symmetries of a square (dihedral group D4),
+which is always an optional swap of the image axes followed by optional flips of each axis.
+That is applied to images and image stacks as a single strided view, or a single copy.
+"""
+import typing as T
+import numpy as np
+
+
+class Orientation(T.NamedTuple):
+    """
+    camera orientation as stored in the HDF5 /params record
+    """
+
+    transpose: bool = False
+    rotccw: int = 0  # 90 degree steps
+    fliplr: bool = False
+    flipud: bool = False
+
+    @classmethod
+    def fromparams(cls, params: T.Any) -> "Orientation":
+        """
+        from a params dict or the /params record of an HDF5 video file
+        """
+        return cls(
+            transpose=bool(params["transpose"]),
+            rotccw=int(params["rotccw"]) % 4,
+            fliplr=bool(params["fliplr"]),
+            flipud=bool(params["flipud"]),
+        )
+
+    @classmethod
+    def fromd4(cls, swap: bool, flipy: bool, flipx: bool) -> "Orientation":
+        return cls(transpose=swap, rotccw=0, fliplr=flipx, flipud=flipy)
+
+    def toparams(self) -> T.Dict[str, int]:
+        return {
+            "rotccw": int(self.rotccw) % 4,
+            "transpose": int(bool(self.transpose)),
+            "flipud": int(bool(self.flipud)),
+            "fliplr": int(bool(self.fliplr)),
+        }
+
+    @property
+    def d4(self) -> T.Tuple[bool, bool, bool]:
+        """
+        the composed transform: swap axes, then flip rows (y), flip columns (x)
+        """
+        swap = flipy = flipx = False
+
+        def transpose(swap, flipy, flipx):
+            return not swap, flipx, flipy
+
+        if self.transpose:
+            swap, flipy, flipx = transpose(swap, flipy, flipx)
+        for _ in range(int(self.rotccw) % 4):  # rot90 is fliplr then transpose
+            swap, flipy, flipx = transpose(swap, flipy, not flipx)
+        if self.fliplr:
+            flipx = not flipx
+        if self.flipud:
+            flipy = not flipy
+
+        return swap, flipy, flipx
+
+    @property
+    def isidentity(self) -> bool:
+        return not any(self.d4)
+
+    def inverse(self) -> "Orientation":
+        swap, flipy, flipx = self.d4
+        if swap:  # flips happened on the swapped axes
+            flipy, flipx = flipx, flipy
+        return Orientation.fromd4(swap, flipy, flipx)
+
+    def shape(self, shape: T.Tuple[int, ...]) -> T.Tuple[int, ...]:
+        """
+        shape of oriented image or stack
+        """
+        if self.d4[0]:
+            return (*shape[:-2], shape[-1], shape[-2])
+        return tuple(shape)
+
+    def view(self, img: np.ndarray) -> np.ndarray:
+        """
+        oriented view of an image (y, x) or image stack (time, y, x), without copying
+        """
+        if img.ndim not in (2, 3):
+            raise ValueError("ndim==2 or 3")
+
+        swap, flipy, flipx = self.d4
+        if swap:
+            img = img.swapaxes(-2, -1)
+
+        return img[..., slice(None, None, -1 if flipy else 1), slice(None, None, -1 if flipx else 1)]
+
+    def apply(self, img: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """
+        oriented C-contiguous copy of an image or image stack, in one pass.
+
+        Parameters
+        ----------
+        img: numpy.ndarray
+            image (y, x) or image stack (time, y, x)
+        out: numpy.ndarray, optional
+            preallocated output, shape self.shape(img.shape)
+        """
+        v = self.view(img)
+        if out is None:
+            return np.ascontiguousarray(v)
+
+        np.copyto(out, v)
+        return out
+
+    def pixel(
+        self, row: np.ndarray, col: np.ndarray, shape: T.Tuple[int, ...]
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        row, column in the oriented image of pixels row, col of the original image of shape
+        """
+        swap, flipy, flipx = self.d4
+        ny, nx = shape[-2:]
+        if swap:
+            row, col = col, row
+            ny, nx = nx, ny
+
+        row = ny - 1 - np.asarray(row) if flipy else np.asarray(row)
+        col = nx - 1 - np.asarray(col) if flipx else np.asarray(col)
+
+        return row, col
+
+    def origpixel(
+        self, row: np.ndarray, col: np.ndarray, shape: T.Tuple[int, ...]
+    ) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        row, column in the original image of pixels row, col of the oriented image of shape
+        """
+        return self.inverse().pixel(row, col, shape)
@@ -17,6 +17,9 @@ from matplotlib.colors import LogNorm
 #
 from pymap3d import ecef2geodetic
 
+from .stream import playframes
+from .stats import autoclim, stackstats
+
 
 def doPlayMovie(data, playMovie, ut1_unix=None, rawFrameInd=None, clim=None):
     if not playMovie or data is None:
@@ -26,6 +29,10 @@ def doPlayMovie(data, playMovie, ut1_unix=None, rawFrameInd=None, clim=None):
     hf1 = figure(1)
     hAx = hf1.gca()
 
+    if clim is None:
+        clim = autoclim(data)
+        print(f"image viewing limits {clim} from 0.5 .. 99.5 percentile of all frames")
+
     try:
         hIm = hAx.imshow(
             data[0, ...], vmin=clim[0], vmax=clim[1], cmap="gray", origin="lower", norm=LogNorm(),
@@ -45,7 +52,7 @@ def doPlayMovie(data, playMovie, ut1_unix=None, rawFrameInd=None, clim=None):
     else:
         titleut = False
 
-    for i, d in enumerate(data):
+    for i, d in enumerate(playframes(data)):
         hIm.set_data(d)
         try:
             if titleut:
@@ -82,17 +89,21 @@ def doplotsave(bigfn, data, rawind, clim, dohist, meanImg):
         return
 
     bigfn = Path(bigfn)
+    if not dohist and not meanImg:
+        return
+    # a batch of frames at a time, written to /stats if data is in a writable HDF5 file
+    S = stackstats(data)
 
     if dohist:
         ax = figure().gca()
-        hist(data.ravel(), bins=256, log=True)
+        dn = S.hist.counts.nonzero()[0]
+        hist(dn, bins=256, weights=S.hist.counts[dn], log=True)
         ax.set_title("histogram of {}".format(bigfn))
         ax.set_ylabel("frequency of occurence")
         ax.set_xlabel("data value")
 
     if meanImg:
-        # DO NOT use dtype= here, it messes up internal calculation!
-        meanStack = data.mean(axis=0).astype(uint16)
+        meanStack = S.mean.astype(uint16)
         fg = figure(32)
         ax = fg.gca()
         if clim:
@@ -107,7 +118,7 @@ def doplotsave(bigfn, data, rawind, clim, dohist, meanImg):
         ax.set_title("mean of image frames")
         fg.colorbar(hi)
 
-        pngfn = bigfn.with_suffix("_mean.png")
+        pngfn = bigfn.parent / (bigfn.stem + "_mean.png")
         print(f"writing mean PNG {pngfn}")
         fg.savefig(pngfn, dpi=150, bbox_inches="tight")
 
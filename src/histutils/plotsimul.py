@@ -31,6 +31,8 @@ def plotPlainImg(sim, cam, rawdata, t, odir):
     http://stackoverflow.com/questions/22408237/named-colors-in-matplotlib
     """
     for R, C in zip(rawdata, cam):
+        if R is None:  # keogram only
+            continue
         fg = figure()
         ax = fg.gca()
         ax.set_axis_off()  # no ticks
@@ -59,7 +61,7 @@ def plotRealImg(sim, cam, rawdata, t: int, odir: Path = None, fg=None):
     """
     sim: histfeas/simclass.py
     cam: camclass.py
-    rawdata: nframe x ny x nx ndarray
+    rawdata: nframe x ny x nx ndarray, or None for a camera with just a keogram
     t: integer index to read
     odir: output directory (where to write results)
 
@@ -91,7 +93,10 @@ def plotRealImg(sim, cam, rawdata, t: int, odir: Path = None, fg=None):
         axs = [fg.add_subplot(1, ncols, i + 1) for i in range(ncols)]
 
     for i, C in enumerate(cam):
-        if C.usecam:  # HiST cameras
+        if C.usecam and rawdata[i] is None:  # keogram only, no frames were read
+            T[i] = datetime.utcfromtimestamp(C.tKeo[t])
+            axs[i].set_axis_off()
+        elif C.usecam:  # HiST cameras
             # print('frame {}'.format(t))
             # hold times for all cameras at this time step
             T[i] = updateframe(t, rawdata[i], None, cam[i], axs[i], fg)
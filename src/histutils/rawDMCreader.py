@@ -13,9 +13,11 @@ import typing.io as Tio
 
 #
 from .utils import write_quota
-from .io import imgwriteincr, setupimgh5
-from .index import getRawInd, meta2rawInd, req2frame
-from .timedmc import frame2ut1, ut12frame
+from .io import ImageStackWriter
+from .index import loadFrameIndex, meta2rawInd, footer2rawInd, req2frame, ut12frameGap
+from .timedmc import ut12frame, datetime2unix, firetime
+from . import framecache
+from .framecache import filekey, framekey
 
 #
 BPP = 16  # bits per pixel
@@ -32,56 +34,234 @@ def goRead(
     finf = getDMCparam(infn, params)
     write_quota(finf["bytes_frame"] * finf["nframeextract"], params.get("outfn"))
 
-    rawFrameInd = np.zeros(finf["nframeextract"], dtype=np.int64)
     # %% output (variable or file)
     if params.get("outfn"):
-        setupimgh5(params["outfn"], finf)
         data = None
+        rawFrameInd = np.zeros(finf["nframeextract"], dtype=np.int64)
+        # %% read, with the HDF5 file kept open and frames written in blocks
+        with infn.open("rb") as fid, ImageStackWriter(params["outfn"], finf) as W:
+            # j and i are NOT the same in general when not starting from beginning of file!
+            for j, i in enumerate(finf["frameindrel"]):
+                D, rawFrameInd[j] = getDMCframe(fid, i, finf, cache=False)
+                W.write(D, j)
     else:
-        data = np.zeros(
-            (finf["nframeextract"], finf["super_y"], finf["super_x"]), dtype=np.uint16, order="C",
-        )
-    # %% read
-    with infn.open("rb") as fid:
-        # j and i are NOT the same in general when not starting from beginning of file!
-        for j, i in enumerate(finf["frameindrel"]):
-            D, rawFrameInd[j] = getDMCframe(fid, i, finf)
-            if params.get("outfn"):
-                imgwriteincr(params["outfn"], D, j)
-            else:
-                data[j, ...] = D
-    # %% absolute time estimate, software timing (at your peril)
-    finf["ut1"] = frame2ut1(params.get("startUTC"), params.get("kineticraw"), rawFrameInd)
+        # one copy of the requested frames out of the memory map
+        data, rawFrameInd = getDMCmemmap(infn, finf)
+        data = np.array(data, order="C")
+    # %% absolute time: GPS & fire timing if available, else software estimate (at your peril)
+    frametiming(finf, params)
 
     return data, rawFrameInd, finf
 
 
+def goReadMemmap(
+    infn: Path, params: T.Dict[str, T.Any]
+) -> T.Tuple[np.ndarray, np.ndarray, T.Dict[str, T.Any]]:
+    """
+    like goRead, but the images are a read-only view into a memory map of the file.
+    Nothing is read from disk until the pixels are touched.
+
+    Returns
+    -------
+    data: numpy.ndarray
+        Nframe x Ny x Nx uint16 view of the requested frames (a copy only if the
+        frame request was not evenly spaced)
+    rawFrameInd: numpy.ndarray
+        int64 raw frame index of each requested frame
+    finf: dict
+        file parameters
+    """
+    infn = Path(infn).expanduser()
+
+    finf = getDMCparam(infn, params)
+
+    data, rawFrameInd = getDMCmemmap(infn, finf)
+
+    finf["ut1"] = frameut1(finf)
+
+    return data, rawFrameInd, finf
+
+
+def frameut1(finf: T.Dict[str, T.Any]) -> np.ndarray:
+    """
+    UT1 estimate of the extracted frames, taken from the frame index.
+    None if startUTC and kineticsec were not specified.
+    """
+    ut1 = finf["frameindex"]["ut1"]
+    if ut1 is None:
+        return None
+
+    return ut1[finf["frameindrel"]]
+
+
+def frametiming(finf: T.Dict[str, T.Any], params: T.Dict[str, T.Any]):
+    """
+    UT1 of the extracted frames into finf["ut1"], from the GPSDO 1PPS and camera fire logs
+    params["pps"], params["fire"] when given, else the software estimate frameut1().
+    With fire timing, also finf["ticks"] fire tick of each frame and finf["ut1attrs"] clock model.
+    """
+    finf["ut1"] = frameut1(finf)
+    finf["ticks"] = finf["ut1attrs"] = None
+
+    if not params.get("fire"):
+        return
+    if not params.get("pps"):
+        logging.warning("fire log needs the GPSDO 1PPS log to time frames, using software estimate")
+        return
+
+    tstart = params.get("startUTC")
+    timing = firetime(
+        datetime2unix(tstart)[0] if tstart is not None else None,
+        Path(params["fire"]).expanduser(),
+        Path(params["pps"]).expanduser(),
+        finf["frameindex"]["rawind"][finf["frameindrel"]],
+    )
+    if timing.missing.any():
+        logging.warning(f"{timing.missing.sum()} frames without fire pulse, interpolated UT1")
+
+    finf["ut1"] = timing.ut1
+    finf["ticks"] = timing.ticks
+    finf["ut1attrs"] = timing.model.attrs()
+    finf["ut1attrs"]["nmissing"] = int(timing.missing.sum())
+
+
+def dmcdtype(finf: T.Dict[str, int]) -> np.dtype:
+    """
+    structured dtype of one .DMCdata frame: image pixels followed by the footer
+
+    ***LABVIEW USES ROW-MAJOR C ORDERING!!
+    """
+    names = ["image"]
+    formats: T.List[T.Any] = [(np.uint16, (finf["super_y"], finf["super_x"]))]
+    offsets = [0]
+    if finf["nmetadata"] > 0:
+        names.append("footer")
+        formats.append((np.uint16, (finf["nmetadata"],)))
+        offsets.append(finf["bytes_image"])
+
+    return np.dtype(
+        {"names": names, "formats": formats, "offsets": offsets, "itemsize": finf["bytes_frame"]}
+    )
+
+
+def getDMCmemmap(
+    fn: Path, finf: T.Dict[str, T.Any], frameind: np.ndarray = None
+) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    memory map a .DMCdata file without any per-frame read loop
+
+    Parameters
+    ----------
+    fn: pathlib.Path
+        .DMCdata filename
+    finf: dict
+        file parameters from getDMCparam
+    frameind: numpy.ndarray, optional
+        zero-based frame indices relative to the file start.
+        Default finf["frameindrel"], or all frames if that is absent.
+
+    Returns
+    -------
+    images: numpy.ndarray
+        Nframe x Ny x Nx uint16 strided view of the images
+    rawind: numpy.ndarray
+        int64 raw frame index of each frame
+    """
+    fn = Path(fn).expanduser()
+    if not fn.is_file():
+        raise FileNotFoundError(fn)
+
+    # partial trailing frame (truncated file) is left out of the map
+    nframe = fn.stat().st_size // finf["bytes_frame"]
+    if nframe < 1:
+        raise ValueError(f"{fn} is smaller than a single image frame")
+
+    mm = np.memmap(fn, dtype=dmcdtype(finf), mode="r", shape=(nframe,))
+
+    if frameind is None:
+        frameind = finf.get("frameindrel")
+
+    if frameind is not None:
+        frameind = np.atleast_1d(np.asarray(frameind, dtype=np.int64))
+        if ((frameind < 0) | (frameind >= nframe)).any():
+            raise ValueError(f"frames requested outside the {nframe} frames in {fn}")
+
+    ind = _ind2slice(frameind)
+    frames = mm[ind]
+
+    if finf["nmetadata"] > 0:
+        rawind = footer2rawInd(frames["footer"])
+    else:  # 2011 no metadata
+        rawind = np.arange(nframe, dtype=np.int64)[ind] + 1
+
+    return frames["image"], rawind
+
+
+def _ind2slice(ind: np.ndarray) -> T.Union[slice, np.ndarray]:
+    """
+    evenly spaced increasing non-negative indices become a slice,
+    so that indexing gives a view instead of a copy
+    """
+    if ind is None:
+        return slice(None)
+
+    if ind.size == 0:
+        return ind
+    if ind.size == 1:
+        return slice(ind[0], ind[0] + 1)
+
+    step = ind[1] - ind[0]
+    if step > 0 and (np.diff(ind) == step).all():
+        return slice(ind[0], ind[-1] + 1, step)
+
+    return ind
+
+
 def getDMCparam(fn: Path, params: T.Dict[str, T.Any]) -> T.Dict[str, T.Any]:
     """
     nHeadBytes=4 for 2013-2016 data
     nHeadBytes=0 for 2011 data
     """
+    if not fn.is_file():  # leave this here, getsize() doesn't fail on directory
+        raise FileNotFoundError(fn)
+
+    finf = dmcgeometry(params)
+
+    if fn.stat().st_size < finf["bytes_frame"]:
+        raise ValueError(f"File size {fn.stat().st_size} is smaller than a single image frame!")
+    # per-frame raw index, reused from the sidecar file if the .DMCdata file is unchanged
+    idx = loadFrameIndex(fn, finf, params)
+    finf["frameindex"] = idx
+
+    finf["first_frame"], finf["last_frame"] = int(idx["rawind"][0]), int(idx["rawind"][-1])
+    if finf["first_frame"] < 1:
+        raise ValueError(finf["first_frame"])
+    if max(finf["first_frame"], finf["last_frame"]) > 100_000_000:
+        logging.error(f"raw frame index seems impossibly large {finf['last_frame']}")
+
+    FrameIndRel = whichframes(fn, params, finf, idx)
+
+    finf["nframeextract"] = FrameIndRel.size
+    finf["frameindrel"] = FrameIndRel
+
+    return finf
+
+
+def dmcgeometry(params: T.Dict[str, T.Any]) -> T.Dict[str, int]:
+    """
+    frame size and layout of a .DMCdata file, from xy_pixel, xy_bin and header_bytes alone
+    """
     finf = {
         "nmetadata": params["header_bytes"] // 2,
         "header_bytes": params["header_bytes"],
     }  # FIXME for DMCdata version 1 only
 
-    if not fn.is_file():  # leave this here, getsize() doesn't fail on directory
-        raise FileNotFoundError(fn)
-
     # int() in case we are fed a float or int
     finf["super_x"] = int(params["xy_pixel"][0] // params["xy_bin"][0])
     finf["super_y"] = int(params["xy_pixel"][1] // params["xy_bin"][1])
 
     finf.update(howbig(params, finf))
 
-    finf["first_frame"], finf["last_frame"] = getRawInd(fn, finf)
-
-    FrameIndRel = whichframes(fn, params, finf)
-
-    finf["nframeextract"] = FrameIndRel.size
-    finf["frameindrel"] = FrameIndRel
-
     return finf
 
 
@@ -94,7 +274,9 @@ def howbig(params: T.Dict[str, T.Any], finf: T.Dict[str, T.Any]) -> T.Dict[str,
     return sizes
 
 
-def whichframes(fn: Path, params: T.Dict[str, T.Any], finf: T.Dict[str, T.Any]) -> np.ndarray:
+def whichframes(
+    fn: Path, params: T.Dict[str, T.Any], finf: T.Dict[str, T.Any], idx: T.Dict[str, T.Any] = None
+) -> np.ndarray:
 
     fileSizeBytes = fn.stat().st_size
 
@@ -107,22 +289,21 @@ def whichframes(fn: Path, params: T.Dict[str, T.Any], finf: T.Dict[str, T.Any])
             f"\n bytes per frame: {finf['bytes_frame']:d}"
         )
 
-    first_frame, last_frame = getRawInd(fn, finf)
+    if idx is None:
+        idx = loadFrameIndex(fn, finf, params)
 
-    if fn.suffix == ".DMCdata":
-        nFrame = fileSizeBytes // finf["bytes_frame"]
-        logging.info(f"{nFrame} frames, Bytes: {fileSizeBytes} in file {fn}")
+    first_frame, last_frame = idx["rawind"][0], idx["rawind"][-1]
+    # frames actually in the file, whether or not some were dropped
+    nFrame = idx["rawind"].size
+    logging.info(f"{nFrame} frames, Bytes: {fileSizeBytes} in file {fn}")
 
-        nFrameRaw = last_frame - first_frame + 1
-        if nFrameRaw != nFrame:
-            logging.warning(f"there may be missed frames: nFrameRaw {nFrameRaw}   nFrame {nFrame}")
-    else:  # CMOS
-        nFrame = last_frame - first_frame + 1
+    gapmap = idx["gapmap"]
+    if gapmap.shape[0] > 1:
+        logging.warning(
+            f"{(last_frame - first_frame + 1) - nFrame} frames dropped in {gapmap.shape[0] - 1} gaps"
+        )
 
-    allrawframe = np.arange(first_frame, last_frame + 1, 1, dtype=np.int64)
     logging.info(f"first / last raw frame #'s: {first_frame}  / {last_frame} ")
-    # %% absolute time estimate
-    ut1_unix_all = frame2ut1(params.get("startUTC"), params.get("kineticsec"), allrawframe)
     # %% setup frame indices
     """
     if no requested frames were specified, read all frames. Otherwise, just
@@ -130,15 +311,19 @@ def whichframes(fn: Path, params: T.Dict[str, T.Any], finf: T.Dict[str, T.Any])
     Assignments have to be "int64", not just python "int".
     Windows python 2.7 64-bit on files >2.1GB, the bytes will wrap
     """
-    FrameIndRel = ut12frame(
-        params.get("ut1req"), np.arange(0, nFrame, 1, dtype=np.int64), ut1_unix_all
-    )
+    if params.get("startUTC") is not None and params.get("kineticsec"):
+        # requested times -> raw index -> file frame, through the dropped-frame map
+        FrameIndRel = ut12frameGap(
+            params.get("ut1req"), gapmap, params["startUTC"], params["kineticsec"]
+        )
+    else:
+        FrameIndRel = ut12frame(params.get("ut1req"), np.arange(nFrame, dtype=np.int64), idx["ut1"])
 
     # NOTE: no ut1req or problems with ut1req, canNOT use else, need to test len() in case index is [0] validly
     if FrameIndRel is None or len(FrameIndRel) == 0:
         FrameIndRel = req2frame(params.get("frame_request"), nFrame)
 
-    badReqInd = (FrameIndRel > nFrame) | (FrameIndRel < 0)
+    badReqInd = (FrameIndRel >= nFrame) | (FrameIndRel < 0)
     # check if we requested frames beyond what the BigFN contains
     if badReqInd.any():
         # don't include frames in case of None
@@ -157,7 +342,7 @@ def whichframes(fn: Path, params: T.Dict[str, T.Any], finf: T.Dict[str, T.Any])
 
 
 def getDMCframe(
-    f: T.Union[Tio.BinaryIO, Path], iFrm: int, finf: T.Dict[str, int]
+    f: T.Union[Tio.BinaryIO, Path], iFrm: int, finf: T.Dict[str, int], cache: bool = True
 ) -> T.Tuple[np.ndarray, int]:
     """
     read a single image frame
@@ -166,12 +351,26 @@ def getDMCframe(
     ----------
     f: pathlib.Path or BinaryIO
         open file handle or file path
+    cache: bool, optional
+        use the process-wide frame cache, then the frame is read-only.
+        Turn off for single passes over a file, e.g. conversion.
     """
     if isinstance(f, Path):
         if not f.is_file():  # need for Windows PermissionError
             raise FileNotFoundError(f)
         with f.open("rb") as g:
-            return getDMCframe(g, iFrm, finf)
+            return getDMCframe(g, iFrm, finf, cache)
+
+    key = None
+    if cache:
+        # frames are only ever appended, so a growing file's frames stay valid
+        fkey = filekey(f, appendonly=True)
+        if fkey is not None:
+            geom = f"DMCdata/{finf['super_y']}x{finf['super_x']}/{finf['bytes_frame']}"
+            key = framekey(fkey, geom, iFrm)
+            hit = framecache.CACHE.get(key)
+            if hit is not None:
+                return hit
     # on windows, "int" is int32 and overflows at 2.1GB!  We need np.int64
     currByte = iFrm * finf["bytes_frame"]
     # %% advance to start of frame in bytes
@@ -200,4 +399,7 @@ def getDMCframe(
     if rawFrameInd is None:  # 2011 no metadata file
         rawFrameInd = iFrm + 1  # fallback
 
+    if key is not None:
+        framecache.CACHE.put(key, (currFrame, rawFrameInd))
+
     return currFrame, rawFrameInd
@@ -8,12 +8,14 @@ INPUT FILE FORMAT: intended for use with "DMCdata" raw format, 4-byte
 import logging
 from datetime import datetime
 from time import time
-import h5py
-from numpy import arange, unique, atleast_1d, around, array, isfinite
-from scipy.interpolate import interp1d
+from numpy import unique, atleast_1d, array
 
 # local
 from .get1Dcut import get1Dcut
+from .stats import autoclim
+from .keogram import keogram
+from .fetch import FrameFetcher, FrameSequence
+from .sync import mutualtimes, synctimeline, timeline
 
 
 def getSimulData(sim, cam, odir=None, verbose=0):
@@ -55,27 +57,26 @@ def HSTsync(sim, cam, verbose):
     # %% determine mutual start/stop frame
     # FIXME: assumes that all cameras overlap in time at least a little.
     # we will play only over UTC times for which both sites have frames available
-    # who started last
-    mutualStart = max([C.filestartutc for C in cam if C.usecam])
-    mutualStop = min([C.filestoputc for C in cam if C.usecam])  # who ended first
-    # %% make playback time steps
-    """
-    based on the "simulated" UTC times that do not necessarily correspond exactly
-    with either camera.
-    """
-    tall = arange(mutualStart, mutualStop, sim.kineticsec)
+    usecam = [C for C in cam if C.usecam]
+    ut1s = [C.ut1unix for C in usecam]
+    mutualStart, mutualStop = mutualtimes(ut1s)
 
     logging.info(
-        f"{tall.size} mutual frames available "
+        "mutual frames available "
         f"from {datetime.utcfromtimestamp(mutualStart)}"
         f"to {datetime.utcfromtimestamp(mutualStop)}"
     )
-    # %% adjust start/stop to user request
+    # %% make playback time steps
+    """
+    based on the "simulated" UTC times that do not necessarily correspond exactly
+    with either camera.
+    """
     try:
-        treq = treqlist
+        tl = synctimeline(ut1s, treqlist)
     except NameError:
         # keep greater than start time
-        treq = tall[(tall > reqStart) & (tall < reqStop)]
+        tl = timeline(ut1s, sim.kineticsec, reqStart, reqStop)
+    treq = tl.t
 
     assert len(treq) > 0, "did not find any times within your limits"
 
@@ -84,22 +85,18 @@ def HSTsync(sim, cam, verbose):
             treq.size, treq[0], treq[-1]
         )
     )
-    # %% use *nearest neighbor* interpolation to find mutual frames to display.
+    # %% *nearest neighbor* frames to display.
     """ sometimes one camera will have frames repeated, while the other camera
     might skip some frames altogether
     """
-    for C in cam:
-        if C.usecam:
-            ft = interp1d(
-                C.ut1unix, arange(C.ut1unix.size, dtype=int), kind="nearest", bounds_error=False,
-            )
-
-            ind = around(ft(treq))
-            ind = ind[isfinite(ind)]  # discard requests outside of file bounds
-            # these are the indices for each time (the slower camera will use some frames twice in a row)
-            C.pbInd = ind.astype(int)
-            print("using frames {} to {} for camera {}".format(C.pbInd[0], C.pbInd[-1], C.name))
-
+    for C, ind, repeat, skip in zip(usecam, tl.ind, tl.repeat, tl.skip):
+        # discard requests outside of file bounds
+        # these are the indices for each time (the slower camera will use some frames twice in a row)
+        C.pbInd = ind[ind >= 0]
+        print("using frames {} to {} for camera {}".format(C.pbInd[0], C.pbInd[-1], C.name))
+        logging.info(f"camera {C.name}: {repeat.sum()} repeated frames, {skip.sum()} skipped frames")
+
+    sim.timeline = tl
     sim.nTimeSlice = treq.size
 
     return cam, sim
@@ -118,24 +115,32 @@ def HSTframeHandler(sim, cam, odir=None, verbose=0):
     for C in cam:
         if not C.usecam:
             continue
-        """
-        This two-step indexing if repeated frames is 40 times faster to read at once,
-        even with this indexing trick than frame by frame
-        """
         ind = unique(C.pbInd)
         if len(ind) < 1:
             continue
-        # http://docs.h5py.org/en/latest/high/dataset.html#fancy-indexing
-        # IOError: Can't read data (Src and dest data spaces have different sizes)
-        # if you have repeated index in fancy indexing
-        with h5py.File(str(C.fn), "r", libver="latest") as f:
-            im = f["/rawimg"][ind, ...]
-            # in case repeated frames selected, which h5py 2.5 can't handle (fancy indexing, non-increasing)
-            if ind.size != C.pbInd.size:
-                # FIXME allows repeated indexes which h5py 2.5 does not for mmap
-                im = im[C.pbInd - ind[0], ...]
-            im = C.doorientimage(im)
-            rawdata.append(im)
+        # %% keogram only: read just the cut pixels instead of whole frames
+        if getattr(sim, "keoonly", False) and hasattr(C, "cutrow"):
+            C.keo = keogram(
+                C.fn,
+                C.cutrow,
+                C.cutcol,
+                C.pbInd,
+                C.orientation,
+                cache=getattr(sim, "keocache", False),
+            )
+            C.tKeo = C.ut1unix[C.pbInd]
+            rawdata.append(None)  # no frames, plotsimul shows just the time
+            continue
+        """
+        frames are read on demand in batches of contiguous hyperslabs, with repeated frames
+        (this camera slower than the playback rate) served from the frame cache.
+        The file is opened again only for the duration of each read.
+        """
+        with FrameFetcher(C.fn) as F:
+            # contrast from the frames being played, when not set by user
+            if None in C.clim:
+                auto = autoclim(F.h, start=ind[0], stop=ind[-1] + 1)
+                C.clim = [a if c is None else c for c, a in zip(C.clim, auto)]
             # %% assign slice & time to class variables
             # NOTE C.ut1unix is timeshift corrected, f['/ut1_unix'] is UNcorrected!
             # need value for non-Boolean indexing (as of h5py 2.5)
@@ -146,12 +151,10 @@ def HSTframeHandler(sim, cam, odir=None, verbose=0):
             DON'T use try-except AttributeError as that's too broad and causes confusion
             """
             if hasattr(C, "cutrow"):
-                if im.ndim == 3:
-                    C.keo = im[:, C.cutrow, C.cutcol].T  # row = pix, col = time
-                elif im.ndim == 2:
-                    C.keo = im[C.cutrow, C.cutcol].T
-                else:
-                    raise ValueError("ndim==2 or 3")
+                # row = pix, col = time
+                C.keo = keogram(F.h, C.cutrow, C.cutcol, C.pbInd, C.orientation)
+
+        rawdata.append(FrameSequence(F, C.pbInd, C.orientation))
 
     logging.debug(f"Loaded all image frames in {time() - tic:.2f} sec.")
 
@@ -0,0 +1,513 @@
+"""
+streaming image statistics over whole video files, with bounded memory.
+
+16-bit histograms are exact (one bin per data number) and can be merged,
+so a file can be split across processes and the partial histograms added up.
+
+    clim = autoclim(fn)  # 0.5 .. 99.5 percentile contrast limits, cached in the HDF5 file
+    S = stackstats(fn)  # mean, variance, min, max, median images, written to /stats of the file
+"""
+from pathlib import Path
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import typing as T
+import numpy as np
+import h5py
+
+from .stream import iter_frames, _batches
+from .timedmc import datetime2unix
+
+NBIN = 2 ** 16
+
+
+class Histogram16:
+    """
+    histogram of 16-bit image data, one bin per data number
+
+    Parameters
+    ----------
+    counts: numpy.ndarray, optional
+        existing 65536 element histogram to continue from
+    """
+
+    def __init__(self, counts: np.ndarray = None):
+        if counts is None:
+            counts = np.zeros(NBIN, dtype=np.int64)
+        elif counts.shape != (NBIN,):
+            raise ValueError(f"a 16-bit histogram has {NBIN} bins, not {counts.shape}")
+
+        self.counts = counts.astype(np.int64)
+
+    def update(self, img: np.ndarray) -> "Histogram16":
+        """
+        adds image(s) of any shape to the histogram.
+        Non-uint16 data is clipped to the uint16 range, NaN are skipped.
+        """
+        img = np.asarray(img)
+        if img.dtype != np.uint16:
+            if img.dtype.kind == "f":
+                img = img[np.isfinite(img)]
+            img = img.clip(0, NBIN - 1).astype(np.uint16)
+
+        self.counts += np.bincount(img.ravel(), minlength=NBIN)
+        return self
+
+    def merge(self, other: "Histogram16") -> "Histogram16":
+        self.counts += other.counts
+        return self
+
+    def __iadd__(self, other: "Histogram16") -> "Histogram16":
+        return self.merge(other)
+
+    def __add__(self, other: "Histogram16") -> "Histogram16":
+        return Histogram16(self.counts + other.counts)
+
+    @property
+    def n(self) -> int:
+        """ number of pixels accumulated """
+        return int(self.counts.sum())
+
+    def percentile(self, q: T.Union[float, T.Sequence[float]]) -> np.ndarray:
+        """
+        data number at percentile(s) q in [0, 100], like numpy.percentile(method="lower")
+        """
+        n = self.n
+        if n == 0:
+            raise ValueError("histogram is empty")
+
+        rank = np.asarray(q, dtype=float) / 100 * (n - 1)
+        return np.searchsorted(self.counts.cumsum(), rank, side="right")
+
+    def clim(self, lo: float = 0.5, hi: float = 99.5) -> T.Tuple[int, int]:
+        """
+        contrast limits from percentiles, always at least one data number apart
+        """
+        cmin, cmax = self.percentile((lo, hi)).tolist()
+        return cmin, max(cmax, cmin + 1)
+
+
+def histframes(
+    path: Path,
+    start: int = 0,
+    stop: int = None,
+    step: int = 1,
+    *,
+    twin: T.Sequence[T.Any] = None,
+    batch: int = 64,
+    params: T.Dict[str, T.Any] = None,
+    key: str = "/rawimg",
+    jobs: int = 1,
+) -> Histogram16:
+    """
+    histogram of a video file, read a batch of frames at a time
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        .DMCdata, .h5 or .fits video file
+    start, stop, step: int, optional
+        zero-based frame indices of the file, like range()
+    twin: tuple, optional
+        start, stop time of frames to use (datetime, parseable string or UT1 unix)
+    jobs: int, optional
+        HDF5 only: number of processes, each histogramming part of the file
+
+    other parameters as stream.iter_frames()
+    """
+    path = Path(path).expanduser()
+    if twin is not None:
+        twin = datetime2unix(twin).astype(float)
+
+    if jobs > 1 and path.suffix.lower() in (".h5", ".hdf5"):
+        with h5py.File(path, "r") as f:
+            ind = range(f[key].shape[0])[start:stop:step]
+
+        parts = np.array_split(np.arange(len(ind)), jobs)
+        H = Histogram16()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futs = [
+                pool.submit(
+                    histframes,
+                    path,
+                    ind[p[0]],
+                    ind[p[-1]] + 1,
+                    step,
+                    twin=twin,
+                    batch=batch,
+                    key=key,
+                )
+                for p in parts
+                if p.size > 0
+            ]
+            for fut in futs:
+                H += fut.result()
+        return H
+
+    H = Histogram16()
+    for ut1, _, frames in iter_frames(
+        path, start, stop, step, batch=batch, params=params, key=key, readahead=2
+    ):
+        H.update(_inwindow(frames, ut1, twin))
+
+    return H
+
+
+def _inwindow(frames: np.ndarray, ut1: T.Optional[np.ndarray], twin: T.Optional[np.ndarray]):
+    if twin is None:
+        return frames
+    if ut1 is None:
+        raise ValueError("time window requested, but frame times are not known")
+
+    return frames[(ut1 >= twin[0]) & (ut1 <= twin[1])]
+
+
+def autoclim(
+    src: T.Union[Path, h5py.Dataset, np.ndarray],
+    lo: float = 0.5,
+    hi: float = 99.5,
+    *,
+    start: int = 0,
+    stop: int = None,
+    step: int = 1,
+    twin: T.Sequence[T.Any] = None,
+    key: str = "/rawimg",
+    params: T.Dict[str, T.Any] = None,
+    jobs: int = 1,
+    write: bool = True,
+) -> T.Tuple[int, int]:
+    """
+    percentile based contrast limits of a video, without loading the whole video.
+
+    For HDF5, the result is stored as attributes "clim", "clim_percentiles", "clim_window"
+    of the image stack and reused next time for the same percentiles and frames.
+
+    Parameters
+    ----------
+    src: pathlib.Path or h5py.Dataset or numpy.ndarray
+        video file, open HDF5 image stack, or images in memory
+    lo, hi: float, optional
+        percentiles of the contrast limits
+    start, stop, step: int, optional
+        zero-based frame indices to use, like range()
+    twin: tuple, optional
+        start, stop time of frames to use (datetime, parseable string or UT1 unix)
+    write: bool, optional
+        store the contrast limits in the HDF5 file if it's writable
+
+    Returns
+    -------
+    clim: tuple of int
+        low, high contrast limits
+    """
+    if isinstance(src, h5py.Dataset):
+        return _autoclim_h5(src, lo, hi, start, stop, step, twin, write and src.file.mode == "r+")
+
+    if not isinstance(src, (str, Path)):  # in memory
+        return Histogram16().update(np.asarray(src)[start:stop:step]).clim(lo, hi)
+
+    path = Path(src).expanduser()
+    if path.suffix.lower() not in (".h5", ".hdf5"):
+        H = histframes(path, start, stop, step, twin=twin, params=params, key=key)
+        return H.clim(lo, hi)
+
+    with h5py.File(path, "r") as f:
+        clim = _cachedclim(f[key], lo, hi, _window(start, stop, step, twin))
+    if clim is not None:
+        return clim
+
+    clim = histframes(path, start, stop, step, twin=twin, key=key, jobs=jobs).clim(lo, hi)
+
+    if write:
+        try:
+            with h5py.File(path, "r+") as f:
+                _storeclim(f[key], clim, lo, hi, _window(start, stop, step, twin))
+        except OSError as e:  # read-only file or in use
+            logging.warning(f"could not store contrast limits in {path}: {e}")
+
+    return clim
+
+
+def _autoclim_h5(
+    h: h5py.Dataset,
+    lo: float,
+    hi: float,
+    start: int,
+    stop: T.Optional[int],
+    step: int,
+    twin: T.Optional[T.Sequence[T.Any]],
+    write: bool,
+) -> T.Tuple[int, int]:
+    """ contrast limits of an already open HDF5 image stack """
+    window = _window(start, stop, step, twin)
+    clim = _cachedclim(h, lo, hi, window)
+    if clim is not None:
+        return clim
+
+    if twin is not None:
+        twin = datetime2unix(twin).astype(float)
+    ut1 = h.file["/ut1_unix"] if "/ut1_unix" in h.file else None
+
+    H = Histogram16()
+    for s in _batches(h.shape[0], start, stop, step, 64):
+        H.update(_inwindow(h[s, ...], ut1[s] if ut1 is not None else None, twin))
+
+    clim = H.clim(lo, hi)
+    if write:
+        _storeclim(h, clim, lo, hi, window)
+
+    return clim
+
+
+def _window(start: int, stop: T.Optional[int], step: int, twin) -> np.ndarray:
+    """ frames used, as stored in the HDF5 file """
+    t = datetime2unix(twin).astype(float) if twin is not None else (np.nan, np.nan)
+    return np.array((start, np.nan if stop is None else stop, step, t[0], t[1]), dtype=float)
+
+
+def _cachedclim(
+    h: h5py.Dataset, lo: float, hi: float, window: np.ndarray
+) -> T.Optional[T.Tuple[int, int]]:
+    try:
+        if not np.allclose(h.attrs["clim_percentiles"], (lo, hi)):
+            return None
+        if not np.array_equal(h.attrs["clim_window"], window, equal_nan=True):
+            return None
+        return tuple(h.attrs["clim"].tolist())
+    except KeyError:
+        return None
+
+
+def _storeclim(h: h5py.Dataset, clim: T.Tuple[int, int], lo: float, hi: float, window: np.ndarray):
+    h.attrs["clim"] = np.array(clim, dtype=np.int64)
+    h.attrs["clim_percentiles"] = np.array((lo, hi), dtype=float)
+    h.attrs["clim_window"] = window
+
+
+class StackStats:
+    """
+    per-pixel statistics of an image stack, updated a batch of frames at a time.
+    Mean and variance are exact (Welford / Chan et al. batch update).
+    Median and other percentile images are interpolated from a coarse per-pixel histogram.
+
+    Parameters
+    ----------
+    shape: tuple of int
+        Ny, Nx of one image
+    edges: numpy.ndarray, optional
+        per-pixel histogram bin edges. Default: from the 0.1 .. 99.9 percentile of the first batch.
+        Data outside the edges is counted in the first/last bin.
+    nbins: int, optional
+        number of per-pixel histogram bins, when edges is not given
+    """
+
+    def __init__(self, shape: T.Tuple[int, int], edges: np.ndarray = None, nbins: int = 64):
+        self.shape = tuple(shape)
+        self.n = 0
+        self.mean = np.zeros(self.shape, dtype=np.float64)
+        self.m2 = np.zeros(self.shape, dtype=np.float64)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        self.hist = Histogram16()
+
+        self.nbins = nbins if edges is None else len(edges) - 1
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        # uint32: a whole night at 53 fps is ~ 2 million frames
+        self.pixhist = np.zeros((np.prod(self.shape), self.nbins), dtype=np.uint32)
+
+    def update(self, frames: np.ndarray) -> "StackStats":
+        """
+        adds a batch of frames, Nbatch x Ny x Nx
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[None, ...]
+        if frames.shape[1:] != self.shape:
+            raise ValueError(f"frames {frames.shape[1:]} do not match {self.shape}")
+        nb = frames.shape[0]
+        if nb == 0:
+            return self
+
+        if self.edges is None:
+            lo, hi = np.percentile(frames, (0.1, 99.9))
+            self.edges = np.linspace(lo, max(hi, lo + self.nbins), self.nbins + 1)
+        # %% mean, variance
+        bmean = frames.mean(axis=0, dtype=np.float64)
+        bm2 = ((frames - bmean) ** 2).sum(axis=0)
+        self._merge_moments(nb, bmean, bm2)
+
+        np.minimum(self.min, frames.min(axis=0), out=self.min)
+        np.maximum(self.max, frames.max(axis=0), out=self.max)
+        self.hist.update(frames)
+        # %% per-pixel histogram, each pixel appears once per frame so plain fancy indexing works
+        pix = np.arange(self.pixhist.shape[0])
+        for frame in frames:
+            b = np.searchsorted(self.edges, frame.ravel(), side="right") - 1
+            self.pixhist[pix, b.clip(0, self.nbins - 1)] += 1
+
+        return self
+
+    def _merge_moments(self, nb: int, bmean: np.ndarray, bm2: np.ndarray):
+        n = self.n + nb
+        delta = bmean - self.mean
+        self.mean += delta * (nb / n)
+        self.m2 += bm2 + delta ** 2 * (self.n * nb / n)
+        self.n = n
+
+    def merge(self, other: "StackStats") -> "StackStats":
+        """
+        combines statistics of another part of the same video, with the same histogram edges
+        """
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.edges = other.edges
+        elif not np.array_equal(self.edges, other.edges):
+            raise ValueError("per-pixel histogram edges must be the same to merge")
+
+        self._merge_moments(other.n, other.mean, other.m2)
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        self.hist += other.hist
+        self.pixhist += other.pixhist
+        return self
+
+    @property
+    def var(self) -> np.ndarray:
+        """ sample variance of each pixel """
+        return self.m2 / max(self.n - 1, 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+    @property
+    def median(self) -> np.ndarray:
+        return self.percentile(50)
+
+    def percentile(self, q: float) -> np.ndarray:
+        """
+        approximate percentile image, linearly interpolated within the per-pixel histogram bin
+        """
+        if self.n == 0:
+            raise ValueError("no frames accumulated")
+
+        cum = self.pixhist.cumsum(axis=1)
+        rank = q / 100 * self.n
+        b = (cum < rank).sum(axis=1).clip(0, self.nbins - 1)
+
+        pix = np.arange(cum.shape[0])
+        below = np.where(b > 0, cum[pix, b - 1], 0)
+        frac = (rank - below) / np.maximum(self.pixhist[pix, b], 1)
+
+        width = np.diff(self.edges)
+        img = (self.edges[b] + frac.clip(0, 1) * width[b]).reshape(self.shape)
+
+        return img.clip(self.min, self.max)
+
+    def write(
+        self,
+        fn: T.Union[Path, h5py.File],
+        group: str = "/stats",
+        percentiles: T.Sequence[float] = (50,),
+    ):
+        """
+        writes the statistics images to an HDF5 file, replacing any existing group
+        """
+        if not isinstance(fn, h5py.File):
+            with h5py.File(Path(fn).expanduser(), "a") as f:
+                self.write(f, group, percentiles)
+            return
+
+        if group in fn:
+            del fn[group]
+        g = fn.create_group(group)
+        g.attrs["nframes"] = self.n
+
+        imgs = [("mean", self.mean), ("var", self.var), ("min", self.min), ("max", self.max)]
+        for q in percentiles:
+            imgs.append(("median" if q == 50 else f"p{q:g}", self.percentile(q)))
+
+        for k, v in imgs:
+            g.create_dataset(k, data=v.astype(np.float32), compression="gzip")
+
+        g["hist"] = self.hist.counts
+        g["hist"].attrs["description"] = "number of pixels with each data number 0..65535"
+        g["edges"] = self.edges
+
+
+def stackstats(
+    src: T.Union[Path, h5py.Dataset, np.ndarray],
+    start: int = 0,
+    stop: int = None,
+    step: int = 1,
+    *,
+    twin: T.Sequence[T.Any] = None,
+    batch: int = 32,
+    params: T.Dict[str, T.Any] = None,
+    key: str = "/rawimg",
+    nbins: int = 64,
+    edges: np.ndarray = None,
+    percentiles: T.Sequence[float] = (50,),
+    write: bool = True,
+    outfn: Path = None,
+) -> StackStats:
+    """
+    mean, variance, min, max and approximate percentile images of a video, plus the histogram
+    of all pixels, reading a batch of frames at a time.
+    For example, the median of a dark or flat field recording estimates the dark or flat frame.
+
+    Parameters
+    ----------
+    src: pathlib.Path or h5py.Dataset or numpy.ndarray
+        video file, open HDF5 image stack, or images in memory
+    start, stop, step: int, optional
+        zero-based frame indices to use, like range()
+    twin: tuple, optional
+        start, stop time of frames to use (datetime, parseable string or UT1 unix)
+    percentiles: list of float, optional
+        percentile images to write
+    write: bool, optional
+        write /stats group to the HDF5 video file (if writable)
+    outfn: pathlib.Path, optional
+        write /stats group to this HDF5 file instead, e.g. for .DMCdata
+
+    other parameters as stream.iter_frames()
+    """
+    if twin is not None:
+        twin = datetime2unix(twin).astype(float)
+
+    if isinstance(src, (str, Path)):
+        path = Path(src).expanduser()
+        S = None
+        for ut1, _, frames in iter_frames(
+            path, start, stop, step, batch=batch, params=params, key=key, readahead=2
+        ):
+            if S is None:
+                S = StackStats(frames.shape[1:], edges, nbins)
+            S.update(_inwindow(frames, ut1, twin))
+
+        if S is None:
+            raise ValueError(f"no frames selected from {path}")
+        if outfn is None and write and path.suffix.lower() in (".h5", ".hdf5"):
+            outfn = path
+    else:
+        ut1 = None
+        if isinstance(src, h5py.Dataset):
+            if "/ut1_unix" in src.file:
+                ut1 = src.file["/ut1_unix"]
+            if outfn is None and write and src.file.mode == "r+":
+                outfn = src.file
+        elif twin is not None:
+            raise ValueError("time window needs an HDF5 video with /ut1_unix")
+
+        S = StackStats(src.shape[1:], edges, nbins)
+        for s in _batches(src.shape[0], start, stop, step, batch):
+            S.update(_inwindow(src[s, ...], ut1[s] if ut1 is not None else None, twin))
+
+    if outfn is not None:
+        try:
+            S.write(outfn, percentiles=percentiles)
+        except OSError as e:  # read-only file or in use
+            logging.warning(f"could not write statistics to {outfn}: {e}")
+
+    return S
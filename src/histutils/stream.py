@@ -0,0 +1,477 @@
+"""
+streaming frame reader over .DMCdata, converted HDF5 and FITS video files,
+for processing full-night files with bounded memory.
+
+    for ut1, rawind, frames in iter_frames(fn, batch=100):
+        ...
+
+and over a .DMCdata file still being recorded, as its frames land:
+
+    for ut1, rawind, frames in follow_frames(fn, params):
+        ...
+"""
+from pathlib import Path
+from contextlib import contextmanager
+import logging
+import os
+import time
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import typing as T
+import numpy as np
+import h5py
+from dateutil.parser import parse
+
+try:
+    from astropy.io import fits
+except ImportError:
+    fits = None
+try:
+    from inotify_simple import INotify, flags as inflags
+except ImportError:
+    INotify = None
+
+from .io import chunkdecoder
+from . import framecache
+from .framecache import filekey, framekey
+from .index import footer2rawInd
+from .rawDMCreader import getDMCparam, getDMCmemmap, dmcgeometry, dmcdtype
+from .timedmc import frame2ut1
+
+Batch = T.Tuple[T.Optional[np.ndarray], T.Optional[np.ndarray], np.ndarray]
+
+
+def iter_frames(
+    path: Path,
+    start: int = 0,
+    stop: int = None,
+    step: int = 1,
+    *,
+    batch: int = 64,
+    params: T.Dict[str, T.Any] = None,
+    key: str = "/rawimg",
+    readahead: int = 0,
+) -> T.Iterator[Batch]:
+    """
+    yields batches of frames from a video file
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        .DMCdata, .h5 or .fits video file
+    start, stop, step: int, optional
+        zero-based frame indices of the file, like range() with a positive step
+    batch: int, optional
+        maximum number of frames per batch
+    params: dict, optional
+        .DMCdata only: xy_pixel, xy_bin, header_bytes and optionally startUTC, kineticsec
+    key: str, optional
+        HDF5 only: image stack in the file
+    readahead: int, optional
+        number of batches read ahead in a background thread (0: no background thread)
+
+    Yields
+    ------
+    ut1: numpy.ndarray
+        UT1 unix time of each frame (None if unknown)
+    rawind: numpy.ndarray
+        raw frame index of each frame (None if unknown)
+    frames: numpy.ndarray
+        Nbatch x Ny x Nx images
+    """
+    path = Path(path).expanduser()
+    if not path.is_file():
+        raise FileNotFoundError(path)
+    if batch < 1:
+        raise ValueError("batch must be at least one frame")
+    if step < 1:
+        raise ValueError("frames are read forward, step must be positive")
+
+    suffix = path.suffix.lower()
+    if suffix in (".h5", ".hdf5"):
+        gen = _iter_h5(path, start, stop, step, batch, key)
+    elif suffix in (".fits", ".fit"):
+        gen = _iter_fits(path, start, stop, step, batch)
+    else:  # .DMCdata or 2011 .dat
+        if params is None:
+            raise ValueError(f"{path}: .DMCdata needs params with xy_pixel, xy_bin, header_bytes")
+        gen = _iter_dmc(path, start, stop, step, batch, params)
+
+    if readahead > 0:
+        gen = readahead_iter(gen, readahead)
+
+    yield from gen
+
+
+def _batches(N: int, start: int, stop: T.Optional[int], step: int, batch: int) -> T.Iterator[slice]:
+    """
+    slices of at most batch frames covering range(start, stop, step) of N frames
+    """
+    r = range(N)[slice(start, stop, step)]
+    for i in range(0, len(r), batch):
+        b = r[i : i + batch]  # noqa: E203
+        yield slice(b.start, b.stop, b.step)
+
+
+def _iter_h5(
+    path: Path, start: int, stop: T.Optional[int], step: int, batch: int, key: str
+) -> T.Iterator[Batch]:
+
+    with h5py.File(path, "r") as f:
+        h = f[key]
+        ut1 = f["/ut1_unix"] if "/ut1_unix" in f else None
+        rawind = f["/rawind"] if "/rawind" in f else None
+
+        for s in _batches(h.shape[0], start, stop, step, batch):
+            yield (
+                ut1[s] if ut1 is not None else None,
+                rawind[s] if rawind is not None else None,
+                h[s, ...],
+            )
+
+
+def _iter_dmc(
+    path: Path, start: int, stop: T.Optional[int], step: int, batch: int, params: T.Dict[str, T.Any]
+) -> T.Iterator[Batch]:
+    # index of all frames, the frame selection is done here
+    params = {k: v for k, v in params.items() if k not in ("frame_request", "ut1req")}
+    finf = getDMCparam(path, params)
+
+    images, rawind = getDMCmemmap(path, finf)
+    ut1 = finf["frameindex"]["ut1"]
+
+    for s in _batches(images.shape[0], start, stop, step, batch):
+        # the copy is where the disk is actually read
+        yield (ut1[s] if ut1 is not None else None, rawind[s], np.array(images[s]))
+
+
+def _iter_fits(
+    path: Path, start: int, stop: T.Optional[int], step: int, batch: int
+) -> T.Iterator[Batch]:
+    if fits is None:
+        raise ImportError("astropy")
+
+    with fits.open(path, mode="readonly", memmap=True) as f:
+        h = f[0]
+        data = h.data
+        if data.ndim == 2:
+            data = data[None, ...]
+        N = data.shape[0]
+        # %% Andor Solis timing, see solis.getNeoParam()
+        try:
+            first = int(h.header["USERTXT1"].split("Images:")[1].split("-")[0])
+        except (KeyError, IndexError, ValueError):
+            first = 1
+        rawind = np.arange(first, first + N, dtype=np.int64)
+        try:
+            tstart = parse(h.header["DATE"] + "Z").timestamp()
+            ut1 = frame2ut1(tstart, h.header["KCT"], rawind)
+        except (KeyError, ValueError):
+            ut1 = None
+
+        for s in _batches(N, start, stop, step, batch):
+            yield (ut1[s] if ut1 is not None else None, rawind[s], np.array(data[s]))
+
+
+def follow_frames(
+    path: Path,
+    params: T.Dict[str, T.Any],
+    start: T.Optional[int] = 0,
+    *,
+    batch: int = 64,
+    poll: float = 0.2,
+    timeout: float = None,
+) -> T.Iterator[Batch]:
+    """
+    yields the frames of a .DMCdata file being recorded as they land, like ``tail -f``,
+    for quick-look display or conversion during acquisition.
+
+    A frame is yielded once all its bytes are in the file: a partial trailing frame,
+    seen as a file size that isn't a multiple of bytes_frame, waits for the rest of its bytes.
+    The file is watched with inotify if the inotify_simple module is installed (Linux),
+    otherwise its size is polled.
+
+    Parameters
+    ----------
+    path: pathlib.Path
+        .DMCdata file, possibly still empty
+    params: dict
+        xy_pixel, xy_bin, header_bytes and optionally startUTC, kineticsec
+    start: int, optional
+        zero-based frame index of the file to start at. None: only frames written from now on
+    batch: int, optional
+        maximum number of frames per batch
+    poll: float, optional
+        maximum seconds between checks of the file size
+    timeout: float, optional
+        stop after this many seconds without a new frame (default: follow forever)
+
+    Yields
+    ------
+    same as iter_frames()
+    """
+    path = Path(path).expanduser()
+    if not path.is_file():
+        raise FileNotFoundError(path)
+    if batch < 1:
+        raise ValueError("batch must be at least one frame")
+
+    finf = dmcgeometry(params)
+    nbytes = finf["bytes_frame"]
+    dtype = dmcdtype(finf)
+    tstart, kineticsec = params.get("startUTC"), params.get("kineticsec")
+
+    with path.open("rb") as f, _watchfile(path) as wait:
+        i = os.fstat(f.fileno()).st_size // nbytes if start is None else start
+        last = time.monotonic()
+
+        while True:
+            size = os.fstat(f.fileno()).st_size
+            nframe = size // nbytes
+            if nframe < i:
+                logging.warning(f"{path} truncated to {nframe} frames, following from its start")
+                i = 0
+
+            if nframe > i:
+                N = min(nframe - i, batch)
+                f.seek(i * nbytes)
+                frames = np.frombuffer(f.read(N * nbytes), dtype=dtype)
+                if finf["nmetadata"] > 0:
+                    rawind = footer2rawInd(frames["footer"])
+                else:  # 2011 no metadata
+                    rawind = np.arange(i + 1, i + N + 1, dtype=np.int64)
+                i += N
+                last = time.monotonic()
+
+                yield (
+                    frame2ut1(tstart, kineticsec, rawind) if tstart and kineticsec else None,
+                    rawind,
+                    np.array(frames["image"]),
+                )
+                continue
+
+            if size % nbytes:
+                logging.debug(f"{path}: waiting for the rest of frame {nframe}")
+            if timeout is not None and time.monotonic() - last > timeout:
+                return
+
+            wait(poll)
+
+
+@contextmanager
+def _watchfile(path: Path) -> T.Iterator[T.Callable[[float], T.Any]]:
+    """
+    gives wait(sec), which returns once the file is written to, or after sec at most
+    """
+    ino = None
+    if INotify is not None:
+        ino = INotify()
+        try:
+            ino.add_watch(str(path), inflags.MODIFY | inflags.CLOSE_WRITE)
+        except OSError as e:  # out of watches, or a network filesystem
+            logging.info(f"polling {path}, inotify failed: {e}")
+            ino.close()
+            ino = None
+
+    if ino is None:
+        yield time.sleep
+        return
+
+    try:
+        yield lambda sec: ino.read(timeout=int(sec * 1000))
+    finally:
+        ino.close()
+
+
+def prefetch_frames(
+    path: Path,
+    start: int = 0,
+    stop: int = None,
+    step: int = 1,
+    *,
+    batch: int = 16,
+    depth: int = 4,
+    threads: int = 2,
+    params: T.Dict[str, T.Any] = None,
+    key: str = "/rawimg",
+    cache: bool = False,
+) -> T.Iterator[Batch]:
+    """
+    like iter_frames(), but upcoming batches are read and decompressed on worker threads
+    while the consumer is busy with the current batch, e.g. rendering or video encoding.
+
+    For HDF5 the compressed chunks are read as is and decompressed by the worker threads,
+    since zlib releases the GIL while h5py serializes its own decompression.
+    Other files are read ahead in one background thread.
+
+    Parameters
+    ----------
+    depth: int, optional
+        maximum number of batches read ahead of the consumer
+    threads: int, optional
+        number of worker threads
+    cache: bool, optional
+        HDF5 frames go through the process-wide frame cache, so replaying doesn't decode again.
+        Off by default, a single pass over a file would just evict more useful frames.
+
+    other parameters as iter_frames()
+    """
+    path = Path(path).expanduser()
+    if step < 1:
+        raise ValueError("frames are read forward, step must be positive")
+    if path.suffix.lower() not in (".h5", ".hdf5"):
+        yield from iter_frames(
+            path, start, stop, step, batch=batch, params=params, key=key, readahead=depth
+        )
+        return
+
+    with h5py.File(path, "r") as f, ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        h = f[key]
+        decode = chunkdecoder(h)
+        fkey = filekey(path) if cache else None
+        ut1 = f["/ut1_unix"][:] if "/ut1_unix" in f else None
+        rawind = f["/rawind"][:] if "/rawind" in f else None
+
+        pending: T.Deque[T.Tuple[slice, T.Any]] = deque()
+        try:
+            for s in _batches(h.shape[0], start, stop, step, batch):
+                pending.append((s, pool.submit(_cachedbatch, h, decode, s, fkey)))
+                if len(pending) < max(1, depth):
+                    continue
+                s, fut = pending.popleft()
+                yield (
+                    ut1[s] if ut1 is not None else None,
+                    rawind[s] if rawind is not None else None,
+                    fut.result(),
+                )
+
+            while pending:
+                s, fut = pending.popleft()
+                yield (
+                    ut1[s] if ut1 is not None else None,
+                    rawind[s] if rawind is not None else None,
+                    fut.result(),
+                )
+        finally:  # consumer stopped early
+            for _, fut in pending:
+                fut.cancel()
+
+
+def playframes(
+    data, *, batch: int = 16, depth: int = 4, threads: int = 2
+) -> T.Iterator[np.ndarray]:
+    """
+    yields single frames of an image stack for display.
+    An open HDF5 dataset is read ahead with prefetch_frames(), anything else is iterated as is.
+    """
+    if not isinstance(data, h5py.Dataset) or data.ndim != 3:
+        yield from data
+        return
+
+    for _, _, frames in prefetch_frames(
+        data.file.filename, batch=batch, depth=depth, threads=threads, key=data.name
+    ):
+        yield from frames
+
+
+def _cachedbatch(
+    h: h5py.Dataset,
+    decode: T.Optional[T.Callable[[bytes], np.ndarray]],
+    s: slice,
+    fkey: T.Optional[framecache.FileKey],
+) -> np.ndarray:
+    """
+    frames s of an image stack from the frame cache if all there, else read and cached
+    """
+    if fkey is None:
+        return _readbatch(h, decode, s)
+
+    C = framecache.CACHE
+    keys = [framekey(fkey, h.name, i) for i in range(s.start, s.stop, s.step)]
+    frames = []
+    for k in keys:
+        frame = C.get(k)
+        if frame is None:
+            break
+        frames.append(frame)
+    else:
+        return np.stack(frames)
+
+    out = _readbatch(h, decode, s)
+    for k, frame in zip(keys, out):
+        C.put(k, frame.copy())
+
+    return out
+
+
+def _readbatch(
+    h: h5py.Dataset, decode: T.Optional[T.Callable[[bytes], np.ndarray]], s: slice
+) -> np.ndarray:
+    """
+    reads frames s of an image stack, decompressing the chunks in this thread if possible
+    """
+    if decode is None:
+        return h[s, ...]
+
+    ind = np.arange(s.start, s.stop, s.step)
+    N, Ny, Nx = h.shape
+    cf, cy, cx = h.chunks
+    out = np.empty((ind.size, Ny, Nx), dtype=h.dtype)
+
+    for t0 in np.unique(ind // cf * cf).tolist():
+        j = np.flatnonzero((ind >= t0) & (ind < t0 + cf))
+        for y in range(0, Ny, cy):
+            for x in range(0, Nx, cx):
+                try:
+                    mask, buf = h.id.read_direct_chunk((t0, y, x))
+                except (KeyError, OSError, RuntimeError):  # chunk never written
+                    mask, buf = 1, None
+                if mask:  # filters were skipped or chunk missing, let HDF5 deal with it
+                    return h[s, ...]
+
+                c = decode(buf)
+                out[j, y : y + cy, x : x + cx] = c[ind[j] - t0, : Ny - y, : Nx - x]  # noqa: E203
+
+    return out
+
+
+def readahead_iter(gen: T.Iterator[T.Any], depth: int) -> T.Iterator[T.Any]:
+    """
+    runs an iterator in a background thread, up to depth items ahead of the consumer
+    """
+    q: queue.Queue = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for item in gen:
+                if stop.is_set():
+                    break
+                q.put(item)
+        except Exception as e:  # re-raised in the consuming thread
+            q.put(e)
+        finally:
+            q.put(done)
+
+    t = threading.Thread(target=reader, daemon=True)
+    t.start()
+
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # unblock the reader if it is waiting on a full queue
+        while t.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                t.join(0.1)
@@ -0,0 +1,147 @@
+"""
+multi-camera time synchronization: for each playback time, the nearest frame of each camera.
+
+Frame times of each camera must be increasing, as UT1 unix times of HiST frames are.
+Lookups are binary searches (numpy.searchsorted), so any number of cameras over a whole night
+is fast; iter_timeline() produces the timeline a chunk at a time for bounded memory.
+"""
+import typing as T
+import numpy as np
+
+
+class Timeline(T.NamedTuple):
+    """
+    synchronized playback timeline of Ncam cameras
+    """
+
+    t: np.ndarray  # Ntime playback UT1 unix times
+    ind: np.ndarray  # Ncam x Ntime frame index of each camera, -1 outside camera's time span
+    terr: np.ndarray  # Ncam x Ntime frame time minus playback time [sec], NaN outside time span
+    repeat: np.ndarray  # Ncam x Ntime True if frame is the same as the previous time step
+    skip: np.ndarray  # Ncam x Ntime number of camera frames skipped since the previous time step
+
+
+def mutualtimes(ut1s: T.Sequence[np.ndarray]) -> T.Tuple[float, float]:
+    """
+    start, stop time where all cameras have frames: who started last, who ended first
+    """
+    return max(u[0] for u in ut1s), min(u[-1] for u in ut1s)
+
+
+def nearestframe(ut1: np.ndarray, t: np.ndarray) -> T.Tuple[np.ndarray, np.ndarray]:
+    """
+    index of the frame nearest to each time t (-1 outside frame times), and its time error.
+    Exactly halfway between two frames chooses the earlier frame.
+
+    Parameters
+    ----------
+    ut1: numpy.ndarray
+        increasing frame times of one camera
+    t: numpy.ndarray
+        times to look up
+    """
+    t = np.asarray(t, dtype=float)
+    if ut1.size == 1:
+        i = np.zeros(t.shape, dtype=int)
+    else:
+        i = np.searchsorted(ut1, t).clip(1, ut1.size - 1)
+        i -= (t - ut1[i - 1]) <= (ut1[i] - t)
+
+    outside = (t < ut1[0]) | (t > ut1[-1])
+    ind = np.where(outside, -1, i)
+    terr = np.where(outside, np.nan, ut1[i] - t)
+
+    return ind, terr
+
+
+def synctimeline(
+    ut1s: T.Sequence[np.ndarray],
+    t: np.ndarray,
+    prev: np.ndarray = None,
+) -> Timeline:
+    """
+    timeline of cameras with frame times ut1s at playback times t
+
+    Parameters
+    ----------
+    ut1s: list of numpy.ndarray
+        increasing frame times of each camera
+    t: numpy.ndarray
+        playback times
+    prev: numpy.ndarray, optional
+        frame index of each camera at the playback time before t[0], to continue a timeline
+    """
+    t = np.atleast_1d(np.asarray(t, dtype=float))
+    Ncam = len(ut1s)
+
+    ind = np.empty((Ncam, t.size), dtype=np.int64)
+    terr = np.empty((Ncam, t.size))
+    for k, u in enumerate(ut1s):
+        ind[k], terr[k] = nearestframe(u, t)
+
+    if prev is None:
+        prev = np.full(Ncam, -1)
+    last = np.concatenate((np.asarray(prev)[:, None], ind), axis=1)[:, :-1]
+    valid = (ind >= 0) & (last >= 0)
+
+    repeat = valid & (ind == last)
+    skip = np.where(valid, (ind - last - 1).clip(0), 0)
+
+    return Timeline(t, ind, terr, repeat, skip)
+
+
+def iter_timeline(
+    ut1s: T.Sequence[np.ndarray],
+    kineticsec: float,
+    tstart: float = None,
+    tstop: float = None,
+    *,
+    chunk: int = 65536,
+) -> T.Iterator[Timeline]:
+    """
+    yields the timeline a chunk of playback times at a time, for long time spans.
+    Playback times are every kineticsec from the start of the mutual time span of the cameras,
+    strictly between tstart, tstop if given.
+    """
+    ut1s = [np.asarray(u, dtype=float) for u in ut1s]
+    for u in ut1s:
+        if u.size == 0:
+            raise ValueError("camera without frames")
+        if (np.diff(u) < 0).any():
+            raise ValueError("frame times must be increasing")
+
+    start, stop = mutualtimes(ut1s)
+    N = int(np.ceil((stop - start) / kineticsec)) if stop > start else 0
+
+    # only the chunks overlapping the requested time span
+    k1 = N if tstop is None else min(N, max(0, int(np.ceil((tstop - start) / kineticsec)) + 1))
+    k0 = 0 if tstart is None else min(k1, max(0, int((tstart - start) // kineticsec)))
+
+    prev = None
+    for k0 in range(k0, k1, chunk):
+        t = start + np.arange(k0, min(k0 + chunk, k1)) * kineticsec
+        if tstart is not None:
+            t = t[t > tstart]
+        if tstop is not None:
+            t = t[t < tstop]
+        if t.size == 0:
+            continue
+
+        tl = synctimeline(ut1s, t, prev)
+        prev = tl.ind[:, -1]
+        yield tl
+
+
+def timeline(
+    ut1s: T.Sequence[np.ndarray], kineticsec: float, tstart: float = None, tstop: float = None
+) -> Timeline:
+    """
+    whole timeline at once, see iter_timeline()
+    """
+    chunks = list(iter_timeline(ut1s, kineticsec, tstart, tstop))
+    if not chunks:
+        return synctimeline(ut1s, np.empty(0))
+
+    return Timeline(
+        *(np.concatenate([getattr(c, k) for c in chunks], axis=-1) for k in Timeline._fields)
+    )
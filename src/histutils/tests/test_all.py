@@ -1,9 +1,18 @@
 #!/usr/bin/env python
 from pathlib import Path
+import shutil
 import numpy as np
 import pytest
 
-from histutils.rawDMCreader import goRead
+from histutils.rawDMCreader import goRead, goReadMemmap, getDMCparam, getDMCframe
+from histutils.index import (
+    getAllRawInd,
+    loadFrameIndex,
+    idxfilename,
+    rawind2gapmap,
+    raw2frame,
+    ut12frameGap,
+)
 
 R = Path(__file__).parent
 
@@ -33,5 +42,98 @@ def test_rawread():
     assert (testframe[0, -5:, -1] == [1939, 1981, 1828, 1752, 1966]).all()
 
 
+def test_memmap():
+    bigfn = R / "testframes.DMCdata"
+
+    params = {
+        "xy_pixel": (512, 512),
+        "xy_bin": (1, 1),
+        "header_bytes": 4,
+    }
+
+    data, rawind, finf = goReadMemmap(bigfn, params)
+
+    assert not data.flags.owndata  # view, not a copy
+    assert data.shape == (2, 512, 512)
+    assert (rawind == [710730, 710731]).all()
+    assert (data[0, :5, 0] == [956, 700, 1031, 730, 732]).all()
+
+    ref = goRead(bigfn, params)[0]
+    assert (data == ref).all()
+
+
+def test_allrawind():
+    bigfn = R / "testframes.DMCdata"
+
+    params = {"xy_pixel": (512, 512), "xy_bin": (1, 1), "header_bytes": 4}
+    finf = getDMCparam(bigfn, params)
+
+    rawind = getAllRawInd(bigfn, finf)
+
+    assert rawind.dtype == np.int64
+    assert (rawind == [getDMCframe(bigfn, np.int64(i), finf)[1] for i in range(2)]).all()
+
+
+def test_frameindex(tmp_path):
+    bigfn = tmp_path / "testframes.DMCdata"
+    shutil.copy(R / "testframes.DMCdata", bigfn)
+
+    params = {
+        "xy_pixel": (512, 512),
+        "xy_bin": (1, 1),
+        "header_bytes": 4,
+        "startUTC": "2013-04-14T06:59:55Z",
+        "kineticsec": 0.0188679245283019,
+    }
+    finf = getDMCparam(bigfn, params)
+
+    idxfn = idxfilename(bigfn)
+    assert idxfn.is_file()
+    mtime = idxfn.stat().st_mtime_ns
+
+    idx = loadFrameIndex(bigfn, finf, params)
+    assert idxfn.stat().st_mtime_ns == mtime  # reused, not rebuilt
+    assert (idx["rawind"] == [710730, 710731]).all()
+    assert (idx["offset"] == [0, finf["bytes_frame"]]).all()
+    assert idx["gapind"].size == 0
+    assert idx["ut1"][1] - idx["ut1"][0] == pytest.approx(params["kineticsec"], abs=1e-6)
+    # %% file changed -> reindex
+    with bigfn.open("ab") as f:
+        f.write(bytes(finf["bytes_image"]) + bytes([12, 0, 0, 0]))  # rawind 786432
+
+    idx = loadFrameIndex(bigfn, finf, params)
+    assert idx["rawind"][-1] == 12 << 16
+    assert idx["gapind"].tolist() == [1]
+    assert idx["gaplen"][0] == (12 << 16) - 710731 - 1
+
+
+def test_gapmap():
+    # frames 13, 14, 17 and 20-21 dropped
+    rawind = np.array([10, 11, 12, 15, 16, 18, 19, 22])
+
+    gapmap = rawind2gapmap(rawind)
+    assert gapmap.tolist() == [[10, 0, 3], [15, 3, 2], [18, 5, 2], [22, 7, 1]]
+
+    req = np.arange(8, 25)
+    assert (raw2frame(gapmap, rawind) == np.arange(rawind.size)).all()
+    exact = raw2frame(gapmap, req)
+    assert (exact[np.isin(req, rawind)] == np.arange(rawind.size)).all()
+    assert (exact[~np.isin(req, rawind)] == -1).all()
+
+    assert raw2frame(gapmap, [13, 14, 17, 21, 9, 23], "prev").tolist() == [2, 2, 4, 6, -1, 7]
+    assert raw2frame(gapmap, [13, 14, 17, 21, 9, 23], "next").tolist() == [3, 3, 5, 7, 0, -1]
+    assert raw2frame(gapmap, [13, 14, 21, 1, 99], "nearest").tolist() == [2, 3, 7, 0, 7]
+    # %% time requests
+    tstart = 1000.0
+    kineticsec = 0.5
+    ut1 = tstart + (rawind - 1) * kineticsec
+
+    assert ut12frameGap(ut1[4], gapmap, tstart, kineticsec).tolist() == [4]
+    assert ut12frameGap(ut1, gapmap, tstart, kineticsec).tolist() == list(range(rawind.size))
+    # open interval, like ut12frame
+    trange = (ut1[1], ut1[6])
+    assert ut12frameGap(trange, gapmap, tstart, kineticsec).tolist() == [2, 3, 4, 5]
+
+
 if __name__ == "__main__":
     pytest.main(["-xrsv", __file__])
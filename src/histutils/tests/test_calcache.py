@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import h5py
+import numpy as np
+import pytest
+
+from histutils.calcache import loadcal, clearcache
+from histutils.orient import Orientation
+
+
+@pytest.fixture
+def calfn(tmp_path):
+    fn = tmp_path / "cal.h5"
+    el, az = np.meshgrid(np.linspace(10, 80, 6), np.linspace(0, 90, 4), indexing="ij")
+    with h5py.File(fn, "w") as f:
+        f["az"] = az
+        f["el"] = el
+        f["ra"] = az + 100
+        f["dec"] = el - 100
+    return fn
+
+
+@pytest.mark.parametrize("orient", [Orientation(), Orientation(True, 1, True, False)])
+def test_loadcal(calfn, orient):
+    clearcache()
+    cal = loadcal(calfn, orient)
+
+    with h5py.File(calfn, "r") as f:
+        assert (cal.az == orient.view(f["az"][:])).all()
+        assert (cal.dec == orient.view(f["dec"][:])).all()
+
+    assert loadcal(calfn, orient) is cal  # memoized
+    assert loadcal(calfn, Orientation.fromd4(*orient.d4)) is cal  # same orientation
+    with pytest.raises(ValueError):
+        cal.az[0, 0] = 0  # shared, read-only
+
+    assert cal.tree.shape == cal.az.shape
+
+
+def test_calcachedir(calfn, tmp_path):
+    clearcache()
+    cachedir = tmp_path / "cache"
+    cal = loadcal(calfn, Orientation(transpose=True), cachedir=cachedir)
+
+    assert len(list(cachedir.glob("*.npy"))) == 4
+    assert cal.el.dtype == np.float32
+    assert isinstance(cal.el, np.memmap)
+
+    clearcache()
+    cal2 = loadcal(calfn, Orientation(transpose=True), cachedir=cachedir)
+    assert (cal2.ra == cal.ra).all()
+
+    # changed file is reloaded
+    with h5py.File(calfn, "r+") as f:
+        f["az"][0, 0] = 5
+    assert loadcal(calfn, Orientation(transpose=True), cachedir=cachedir).az[0, 0] == 5
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
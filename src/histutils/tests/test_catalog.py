@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+from pathlib import Path
+import shutil
+import h5py
+import numpy as np
+import pytest
+from pytest import approx
+
+import histutils.catalog as cat
+from histutils.catalog import Catalog, filetime
+
+R = Path(__file__).parent
+T0 = 1365922795.0  # 2013-04-14T06:59:55Z
+PARAMS = {
+    "xy_pixel": (512, 512),
+    "xy_bin": (1, 1),
+    "header_bytes": 4,
+    "kineticsec": {7196: 0.0188679245283019},
+}
+
+
+def makeh5(fn: Path, rawind: np.ndarray, t0: float, dt: float):
+    with h5py.File(fn, "w") as f:
+        f["/rawimg"] = np.zeros((rawind.size, 4, 6), dtype=np.uint16)
+        f["/rawind"] = rawind
+        f["/ut1_unix"] = t0 + (rawind - rawind[0]) * dt
+
+
+@pytest.fixture(params=[True, False], ids=["rtree", "btree"])
+def archive(tmp_path, monkeypatch, request):
+    if not request.param:
+        monkeypatch.setattr(cat, "_makertree", lambda db: False)
+
+    night = tmp_path / "2013-04-14"
+    night.mkdir()
+    shutil.copy(R / "testframes.DMCdata", night / "2013-04-14T07-00-CamSer7196.DMCdata")
+    # 1 s of 10 fps with frames 6-7 dropped
+    makeh5(night / "2013-04-14T07-00-CamSer1387.h5", np.r_[1:6, 8:11], T0, 0.1)
+
+    C = Catalog(tmp_path / "cat.sqlite")
+    assert C.rtree == request.param
+    assert C.scan(tmp_path, PARAMS) == 2
+    yield C, night
+    C.close()
+
+
+def test_query(archive):
+    C, night = archive
+    h5 = night / "2013-04-14T07-00-CamSer1387.h5"
+
+    hits = C.query(T0 + 0.15, T0 + 0.75)
+    assert len(hits) == 2
+    assert hits[0].path == h5.resolve() and hits[0].camser == 1387
+    assert (hits[0].start, hits[0].stop, hits[0].rawstart) == (2, 5, 3)
+    assert hits[0].t0 == approx(T0 + 0.2) and hits[0].t1 == approx(T0 + 0.4)
+    # after the dropped frames
+    assert (hits[1].start, hits[1].stop, hits[1].rawstart) == (5, 6, 8)
+
+    assert C.query(T0 + 0.51, T0 + 0.59) == []  # in the gap
+    assert C.query(T0 + 5, T0 + 6) == []
+
+    assert C.gaps(h5) == [(4, 2, approx(T0 + 0.4), approx(T0 + 0.7))]
+
+
+def test_dmcdata(archive):
+    C, night = archive
+    dmc = [f for f in C.files() if f["kind"] == "DMCdata"][0]
+
+    assert dmc["camser"] == 7196 and dmc["timesource"] == "filename"
+    assert dmc["nframe"] == 2 and (dmc["nx"], dmc["ny"]) == (512, 512)
+    # started 07:00 per filename, raw frames 710730, 710731
+    t = filetime(Path(dmc["path"])).timestamp() + (710731 - 1) * 0.0188679245283019
+    assert dmc["tstop"] == approx(t)
+
+    hits = C.query(t - 0.001, t + 1, camser=7196)
+    assert len(hits) == 1 and (hits[0].start, hits[0].stop, hits[0].rawstart) == (1, 2, 710731)
+    assert C.query(t - 0.001, t + 1, camser=1387) == []
+
+    C.remove(dmc["path"])
+    assert C.query(t - 0.001, t + 1) == [] and len(C.files()) == 1
+
+
+def test_strided(tmp_path):
+    fn = tmp_path / "2013-04-14T07-00-CamSer1387.h5"
+    # every 3rd raw frame, one dropped
+    rawind = np.r_[1:30:3, 34:60:3]
+    makeh5(fn, rawind, T0, 0.1 / 3)
+
+    with Catalog(tmp_path / "cat.sqlite") as C:
+        C.add(fn)
+        assert C.gaps(fn) == [(9, 1, approx(T0 + 0.9), approx(T0 + 1.1))]
+
+        (h,) = C.query(T0 + 0.15, T0 + 0.45)
+        assert (h.start, h.stop, h.rawstart) == (2, 5, 7)
+        (h,) = C.query(T0 + 1.15, T0 + 1.25)
+        assert (h.start, h.stop, h.rawstart) == (11, 12, 37)
+
+
+def test_uneven(tmp_path):
+    fn = tmp_path / "2013-04-14T07-00-CamSer1387.h5"
+    rawind = np.arange(1, 101)
+    # GPS timed: frame period drifting from 0.1 s
+    ut1 = T0 + np.cumsum(np.r_[0, np.full(99, 0.1) + np.linspace(0, 0.004, 99)])
+    makeh5(fn, rawind, T0, 0.1)
+    with h5py.File(fn, "r+") as f:
+        f["/ut1_unix"][:] = ut1
+
+    with Catalog(tmp_path / "cat.sqlite") as C:
+        C.add(fn)
+        for i in (10, 50, 99):
+            (h,) = C.query(ut1[i] - 1e-4, ut1[i] + 1e-4)
+            assert (h.start, h.stop, h.rawstart) == (i, i + 1, i + 1)
+            assert h.t0 == ut1[i] and h.t1 == ut1[i]
+
+        (h,) = C.query(ut1[40], ut1[60] - 1e-4)
+        assert (h.start, h.stop) == (40, 60)
+
+
+def test_refresh(tmp_path, monkeypatch):
+    import histutils.index as index
+
+    night = tmp_path / "night"
+    night.mkdir()
+    dmc = night / "2013-04-14T07-00-CamSer7196.DMCdata"
+    shutil.copy(R / "testframes.DMCdata", dmc)
+    h5 = night / "2013-04-14T07-00-CamSer1387.h5"
+    makeh5(h5, np.arange(1, 11), T0, 0.1)
+
+    C = Catalog(tmp_path / "cat.sqlite")
+    assert C.refresh(night, PARAMS) == {"added": 2, "updated": 0, "unchanged": 0, "removed": 0}
+    assert C.refresh(night, PARAMS) == {"added": 0, "updated": 0, "unchanged": 2, "removed": 0}
+
+    # the camera records 1 more frame after dropping one, plus part of the next
+    starts = []
+    getAllRawInd = index.getAllRawInd
+
+    def spy(fn, finf, start=0):
+        starts.append(start)
+        return getAllRawInd(fn, finf, start)
+
+    monkeypatch.setattr(index, "getAllRawInd", spy)
+
+    frame = bytearray((R / "testframes.DMCdata").read_bytes()[:524292])
+    frame[-4:] = np.array([710733 >> 16, 710733 & 0xFFFF], dtype="<u2").tobytes()
+    with dmc.open("ab") as f:
+        f.write(frame + frame[:1000])
+    h5.unlink()
+
+    assert C.refresh(night, PARAMS) == {"added": 0, "updated": 1, "unchanged": 0, "removed": 1}
+    # only the new tail was read (and the last indexed frame, to check it didn't change)
+    assert sorted(starts) == [1, 2]
+
+    f = C.files()
+    assert len(f) == 1 and f[0]["nframe"] == 3 and f[0]["rawlast"] == 710733
+    assert len(C.gaps(dmc)) == 1
+    C.close()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+from pathlib import Path
+import shutil
+import numpy as np
+import h5py
+import pytest
+
+from histutils.io import chunkencoder, ImageStackWriter, rechunkh5, profilechunks
+import histutils.convert as convert
+from histutils.convert import dmc2h5, convertfiles
+from histutils.rawDMCreader import goRead
+
+R = Path(__file__).parent
+
+
+@pytest.mark.parametrize("shape,chunks", [((3, 64, 128), (1, 64, 128)), ((5, 50, 70), (2, 16, 32))])
+def test_chunkencoder(tmp_path, shape, chunks):
+    fn = tmp_path / "direct.h5"
+    img = np.random.randint(0, 4000, shape, dtype=np.uint16)
+
+    with h5py.File(fn, "w") as f:
+        h = f.create_dataset(
+            "x",
+            shape=shape,
+            dtype=np.uint16,
+            chunks=chunks,
+            compression="gzip",
+            compression_opts=1,
+            shuffle=True,
+            fletcher32=True,
+        )
+        encode = chunkencoder(h)
+        for t in range(0, shape[0], chunks[0]):
+            for y in range(0, shape[1], chunks[1]):
+                for x in range(0, shape[2], chunks[2]):
+                    c = np.zeros(chunks, dtype=np.uint16)
+                    v = img[t : t + chunks[0], y : y + chunks[1], x : x + chunks[2]]  # noqa: E203
+                    c[: v.shape[0], : v.shape[1], : v.shape[2]] = v  # noqa: E203
+                    h.id.write_direct_chunk((t, y, x), encode(c))
+    # HDF5 verifies the fletcher32 checksum on read
+    with h5py.File(fn, "r") as f:
+        assert (f["x"][:] == img).all()
+
+
+@pytest.mark.parametrize("profile", ["archive", "fast-read", "keogram"])
+def test_dmc2h5(tmp_path, profile):
+    bigfn = R / "testframes.DMCdata"
+    params = {
+        "xy_pixel": (512, 512),
+        "xy_bin": (1, 1),
+        "header_bytes": 4,
+        "outfn": tmp_path / "testframes.h5",
+    }
+
+    try:
+        rawind, finf = dmc2h5(bigfn, params, threads=2, profile=profile)
+    except OSError as e:  # write_quota
+        pytest.skip(str(e))
+
+    assert (rawind == [710730, 710731]).all()
+
+    ref = goRead(bigfn, {k: v for k, v in params.items() if k != "outfn"})[0]
+    with h5py.File(params["outfn"], "r") as f:
+        assert (f["/rawimg"][:] == ref).all()
+        assert f["/rawimg"].chunks == profilechunks(profile, ref.shape)
+
+
+def test_rechunk(tmp_path):
+    infn = R / "testframes_cam0.h5"
+    outfn = tmp_path / "keogram.h5"
+
+    rechunkh5(infn, outfn, "keogram")
+
+    with h5py.File(infn, "r") as fi, h5py.File(outfn, "r") as fo:
+        assert fo["/rawimg"].chunks == (2, 16, 16)
+        assert fo["/rawimg"].attrs["storage_profile"] == b"keogram"
+        assert (fo["/rawimg"][:] == fi["/rawimg"][:]).all()
+        assert (fo["/ut1_unix"][:] == fi["/ut1_unix"][:]).all()
+
+
+def test_imagestackwriter(tmp_path):
+    fn = tmp_path / "stack.h5"
+    imgs = np.random.randint(0, 4000, (10, 8, 6), dtype=np.uint16)
+    params = {"super_y": 8, "super_x": 6, "nframeextract": 10}
+
+    with ImageStackWriter(fn, params, nbuffer=3) as W:
+        for j in range(4):
+            W.write(imgs[j], j)
+        W.write(imgs[4:7])
+        W.write(imgs[8:], 8)  # skip one frame
+        W.write(imgs[7], 7)
+
+    with h5py.File(fn, "r") as f:
+        assert (f["/rawimg"][:] == imgs).all()
+
+    # same stack again: rewritten in place
+    with ImageStackWriter(fn, params) as W:
+        W.write(imgs[::-1])
+    with h5py.File(fn, "r") as f:
+        assert (f["/rawimg"][:] == imgs[::-1]).all()
+
+    # stale output of another shape or storage profile
+    for p, profile in (({**params, "nframeextract": 12}, "archive"), (params, "fast-read")):
+        with pytest.raises(ValueError):
+            with ImageStackWriter(fn, p, profile=profile):
+                pass
+
+
+def test_goread_h5(tmp_path):
+    bigfn = R / "testframes.DMCdata"
+    params = {"xy_pixel": (512, 512), "xy_bin": (1, 1), "header_bytes": 4}
+
+    ref, refind, _ = goRead(bigfn, params)
+
+    params["outfn"] = tmp_path / "testframes.h5"
+    try:
+        data, rawind, _ = goRead(bigfn, params)
+    except OSError as e:  # write_quota
+        pytest.skip(str(e))
+
+    assert data is None
+    assert (rawind == refind).all()
+    with h5py.File(params["outfn"], "r") as f:
+        assert (f["/rawimg"][:] == ref).all()
+
+
+def test_convertfiles(tmp_path):
+    params = {
+        "xy_pixel": (512, 512),
+        "xy_bin": (1, 1),
+        "header_bytes": 4,
+        "kineticsec": 0.0188679245283019,
+        "rotccw": 0,
+        "transpose": False,
+        "flipud": False,
+        "fliplr": False,
+    }
+
+    files = []
+    for i in range(3):
+        fn = tmp_path / f"in{i}.DMCdata"
+        shutil.copy(R / "testframes.DMCdata", fn)
+        files.append((fn, tmp_path / "out" / f"out{i}.h5"))
+
+    try:
+        written = convertfiles(files, params, jobs=2, threads=1, perdevice=2)
+    except OSError as e:  # write_quota
+        pytest.skip(str(e))
+
+    assert sorted(written) == [f[1] for f in files]
+    for fn in written:
+        with h5py.File(fn, "r") as f:
+            assert (f["/rawind"][:] == [710730, 710731]).all()
+
+
+def test_convertfiles_failed(tmp_path, monkeypatch):
+    params = {
+        "xy_pixel": (512, 512),
+        "xy_bin": (1, 1),
+        "header_bytes": 4,
+        "kineticsec": 0.0188679245283019,
+        "rotccw": 0,
+        "transpose": False,
+        "flipud": False,
+        "fliplr": False,
+    }
+    good, bad = tmp_path / "good.DMCdata", tmp_path / "bad.DMCdata"
+    shutil.copy(R / "testframes.DMCdata", good)
+    bad.write_bytes((R / "testframes.DMCdata").read_bytes()[:1000])  # truncated
+    files = [(good, tmp_path / "out" / "good.h5"), (bad, tmp_path / "out" / "bad.h5")]
+
+    try:
+        written = convertfiles(files, params, jobs=2, threads=1, perdevice=2)
+    except OSError as e:  # write_quota
+        pytest.skip(str(e))
+
+    assert written == [files[0][1]]
+    assert sorted(f.name for f in (tmp_path / "out").iterdir()) == ["good.h5"]
+
+    # failing after the output was created: nothing left behind
+    def fail(finf, params):
+        raise ValueError("corrupt fire log")
+
+    monkeypatch.setattr(convert, "frametiming", fail)
+    outfn = tmp_path / "out" / "good2.h5"
+    with pytest.raises(ValueError):
+        convert._convertfile(good, dict(params, outfn=outfn), 1, "archive", 0, 1)
+    assert sorted(f.name for f in (tmp_path / "out").iterdir()) == ["good.h5"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+from pathlib import Path
+import h5py
+import numpy as np
+import pytest
+
+from histutils.fetch import coalesce, FrameFetcher, FrameSequence
+from histutils.framecache import FrameCache
+from histutils.orient import Orientation
+
+R = Path(__file__).parent
+
+
+def test_coalesce():
+    assert coalesce([]) == []
+    assert coalesce([0, 1, 2, 5, 6, 9]) == [(0, 3), (5, 7), (9, 10)]
+    assert coalesce([0, 1, 2, 5, 6, 9], maxgap=2) == [(0, 10)]
+    assert coalesce([0, 1, 2, 5, 7, 9], maxgap=1) == [(0, 3), (5, 10)]
+
+
+@pytest.fixture
+def stack(tmp_path):
+    im = np.arange(20 * 4 * 6, dtype=np.uint16).reshape((20, 4, 6))
+    fn = tmp_path / "stack.h5"
+    with h5py.File(fn, "w") as f:
+        f["/rawimg"] = im
+    return fn, im
+
+
+def test_fetch_repeats(stack):
+    fn, im = stack
+    # repeated (slower camera), skipped (faster camera) and out of order frames
+    ind = [2, 2, 2, 3, 3, 7, 9, 11, 11, 0, 19]
+
+    C = FrameCache()
+    with FrameFetcher(fn, batch=4, cache=C) as F:
+        got = F.read(ind)
+        assert (got == im[ind]).all()
+        # each frame read once, repeats across batches from the cache
+        assert C.misses == np.unique(ind).size
+        assert C.hits == 2
+
+        frame = next(F.frames(7))
+        assert not frame.flags.writeable
+
+        with pytest.raises(IndexError):
+            F.read([20])
+
+
+def test_fetch_nocache(stack):
+    fn, im = stack
+    ind = [5, 5, 6, 5, 5]
+
+    C = FrameCache(0)
+    with FrameFetcher(fn, cache=C, batch=2) as F:
+        assert (F.read(ind) == im[ind]).all()
+        # repeats within a batch are read once, across batches again
+        assert C.misses == 4 and len(C) == 0
+
+
+def test_fetch_closed(stack):
+    fn, im = stack
+
+    C = FrameCache()
+    with FrameFetcher(fn, cache=C) as F:
+        assert (F.read([1, 2]) == im[[1, 2]]).all()
+    assert not F.h
+
+    # frames played after the file was closed: cached ones as is, others from the file reopened
+    seq = FrameSequence(F, [2, 3, 3])
+    assert seq.shape == (3, 4, 6)
+    assert (np.asarray(seq) == im[[2, 3, 3]]).all()
+    assert C.misses == 3
+
+
+@pytest.mark.parametrize("orient", [Orientation(), Orientation(True, 1, False, True)])
+def test_framesequence(orient):
+    with h5py.File(R / "testframes_cam0.h5", "r") as f:
+        im = orient.view(f["/rawimg"][:])
+        ind = [1, 1, 0, 1]
+        seq = FrameSequence(FrameFetcher(f["/rawimg"]), ind, orient)
+
+        assert seq.ndim == 3 and len(seq) == 4
+        assert seq.shape == im[ind].shape
+        assert (np.asarray(seq) == im[ind]).all()
+        assert (seq[2] == im[0]).all()
+        assert (seq[-1, 10:20, 5] == im[1, 10:20, 5]).all()
+        assert (seq[1:3, :, 3] == im[[1, 0], :, 3]).all()
+        for a, b in zip(seq, im[ind]):
+            assert (a == b).all()
+
+        # frames handed out are copies, safe to modify in place
+        seq[0][:] = 0
+        assert (seq[0] == im[1]).all()
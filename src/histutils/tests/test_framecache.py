@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+from pathlib import Path
+import h5py
+import numpy as np
+import pytest
+
+from histutils import framecache
+from histutils.framecache import FrameCache, filekey, framekey
+from histutils.orient import Orientation
+from histutils.rawDMCreader import getDMCparam, getDMCframe
+from histutils.stream import prefetch_frames
+
+R = Path(__file__).parent
+
+
+def test_budget():
+    C = FrameCache(maxbytes=3 * 800)
+    for i in range(3):
+        C.put(i, np.zeros(100))  # 800 bytes
+    assert len(C) == 3 and C.nbytes == 2400
+
+    assert C.get(0) is not None  # now most recently used
+    C.put(3, np.zeros(100))
+    assert 1 not in C and 0 in C
+    assert C.evictions == 1
+
+    assert C.get(1) is None
+    assert C.stats()["hits"] == 1 and C.stats()["misses"] == 1
+
+    with pytest.raises(ValueError):
+        C.get(0)[0] = 1  # shared frames are read-only
+
+    C.put(4, np.zeros(1000))  # larger than the budget
+    assert 4 not in C and len(C) == 3
+
+    C.maxbytes = 800
+    assert len(C) == 1 and C.nbytes == 800
+    C.clear()
+    assert len(C) == 0 and C.nbytes == 0
+
+
+def test_keys(tmp_path):
+    fn = tmp_path / "a.bin"
+    fn.write_bytes(b"x")
+
+    k = filekey(fn)
+    assert k == filekey(fn) and k[0] == str(fn.resolve())
+    with fn.open("rb") as f:
+        assert filekey(f, appendonly=True) == k[:3]
+    assert filekey(tmp_path / "nothere") is None
+
+    # equivalent orientations share a key
+    assert framekey(k, "/rawimg", 1, Orientation(False, 2)) == framekey(
+        k, "/rawimg", 1, Orientation(False, 0, True, True)
+    )
+
+
+def test_dmcframe():
+    fn = R / "testframes.DMCdata"
+    finf = getDMCparam(fn, {"xy_pixel": (512, 512), "xy_bin": (1, 1), "header_bytes": 4})
+    framecache.CACHE.clear()
+
+    img, rawind = getDMCframe(fn, np.int64(1), finf)
+    hits = framecache.CACHE.hits
+    img2, rawind2 = getDMCframe(fn, np.int64(1), finf)
+
+    assert img2 is img and rawind2 == rawind
+    assert framecache.CACHE.hits == hits + 1
+    assert not img.flags.writeable
+
+    img3, _ = getDMCframe(fn, np.int64(1), finf, cache=False)
+    assert img3 is not img and (img3 == img).all()
+
+
+def test_prefetch_replay():
+    fn = R / "testframes_cam0.h5"
+    framecache.CACHE.clear()
+
+    list(prefetch_frames(fn, batch=1))  # single pass, not cached by default
+    assert len(framecache.CACHE) == 0
+
+    first = [b[2] for b in prefetch_frames(fn, batch=1, cache=True)]
+    hits = framecache.CACHE.hits
+    again = [b[2] for b in prefetch_frames(fn, batch=1, cache=True)]
+
+    assert framecache.CACHE.hits == hits + 2
+    with h5py.File(fn, "r") as f:
+        for a, b, i in zip(first, again, range(2)):
+            assert (a == f["/rawimg"][i]).all() and (b == a).all()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from pathlib import Path
+import shutil
+import h5py
+import numpy as np
+import pytest
+
+from histutils.keogram import keogram, readkeogram
+from histutils.orient import Orientation
+from histutils.io import rechunkh5
+
+R = Path(__file__).parent
+
+
+@pytest.mark.parametrize("profile", [None, "keogram"])
+@pytest.mark.parametrize("orient", [Orientation(), Orientation(True, 1, False, True)])
+def test_keogram(tmp_path, profile, orient):
+    fn = R / "testframes_cam0.h5"
+    if profile:
+        rechunkh5(fn, tmp_path / "keo.h5", profile)
+        fn = tmp_path / "keo.h5"
+
+    with h5py.File(fn, "r") as f:
+        im = orient.view(f["/rawimg"][:])
+
+    cutcol = np.arange(0, 512, 3)
+    cutrow = (cutcol * 0.7 + 20).astype(int)
+    ind = [1, 0, 1, 1]
+
+    keo = keogram(fn, cutrow, cutcol, ind, orient)
+    assert (keo == im[ind][:, cutrow, cutcol].T).all()
+
+
+def test_keogram_cache(tmp_path):
+    fn = tmp_path / "cache.h5"
+    shutil.copy(R / "testframes_cam0.h5", fn)
+    with h5py.File(fn, "r") as f:
+        im = f["/rawimg"][:]
+
+    keo = keogram(fn, [10, 20, 30], [5, 6, 7], [1, 0], cache=True)
+    assert (keo == im[[1, 0]][:, [10, 20, 30], [5, 6, 7]].T).all()
+
+    with h5py.File(fn, "r+") as f:
+        (name,) = f["/keogram"]
+        assert f["/keogram"][name].shape == (2, 3)
+        f["/keogram"][name][0, 0] = 0  # later reads come from the cache
+
+    assert keogram(fn, [10, 20, 30], [5, 6, 7], [0], cache=True)[0, 0] == 0
+
+
+def test_keogram_readerror(tmp_path, monkeypatch):
+    import histutils.keogram as keo
+
+    fn = tmp_path / "cache.h5"
+    shutil.copy(R / "testframes_cam0.h5", fn)
+    calls = []
+
+    def corrupt(*args):
+        calls.append(args)
+        raise OSError("can't read data (filter returned failure)")
+
+    monkeypatch.setattr(keo, "readkeogram", corrupt)
+    with pytest.raises(OSError, match="filter"):
+        keogram(fn, [10], [5], [0], cache=True)
+    # raised as is, not taken for a read-only file and read again
+    assert len(calls) == 1
+
+
+class Spy:
+    """
+    image stack recording the shape of each read
+    """
+
+    def __init__(self, h):
+        self.h, self.chunks, self.shape, self.dtype = h, h.chunks, h.shape, h.dtype
+        self.reads = []
+
+    def __getitem__(self, key):
+        block = self.h[key]
+        self.reads.append(block.shape)
+        return block
+
+
+def test_keogram_wholeframe(tmp_path):
+    fn = tmp_path / "archive.h5"
+    im = np.random.default_rng(0).integers(0, 4096, (20, 64, 48), dtype=np.uint16)
+    with h5py.File(fn, "w") as f:
+        f.create_dataset("/rawimg", data=im, chunks=(1, 64, 48))
+
+    row = np.array([3, 3, 4, 10, 40, 41])
+    col = np.array([0, 47, 5, 20, 1, 2])
+    ind = np.arange(20)
+    with h5py.File(fn, "r") as f:
+        h = Spy(f["/rawimg"])
+        keo = readkeogram(h, row, col, ind, maxbytes=7 * 2 * (96 + 1 + 4))
+
+    assert (keo == im[:, row, col]).all()
+    # rows 3-4, 10 and 40-41 only, 7 frames at a time
+    assert sorted(set(r[1:] for r in h.reads)) == [(1, 1), (2, 2), (2, 48)]
+    assert max(r[0] for r in h.reads) == 7
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
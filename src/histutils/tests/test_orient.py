@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import itertools
+import numpy as np
+import pytest
+
+from histutils.orient import Orientation
+
+
+def reference(frame, transpose, rotccw, fliplr, flipud):
+    """ step by step, as Cam.doorientimage did """
+    if transpose:
+        frame = frame.transpose(0, 2, 1)
+    if rotccw:
+        frame = np.rot90(frame, rotccw, (1, 2))
+    if fliplr:
+        frame = frame[:, :, ::-1]
+    if flipud:
+        frame = frame[:, ::-1, :]
+    return frame
+
+
+@pytest.mark.parametrize(
+    "orient", itertools.product([False, True], range(-1, 5), [False, True], [False, True])
+)
+def test_orientation(orient):
+    img = np.arange(2 * 3 * 5).reshape((2, 3, 5))
+    o = Orientation(*orient)
+    ref = reference(img, *orient)
+
+    assert (o.view(img) == ref).all()
+    assert (o.view(img[0]) == ref[0]).all()
+    assert o.shape(img.shape) == ref.shape
+    assert (o.inverse().view(o.view(img)) == img).all()
+
+    out = np.empty(ref.shape, img.dtype)
+    assert o.apply(img, out=out) is out
+    assert (out == ref).all()
+    assert o.apply(img).flags["C_CONTIGUOUS"]
+
+    r, c = np.unravel_index(np.arange(15), (3, 5))
+    ro, co = o.pixel(r, c, img.shape)
+    assert (ref[0, ro, co] == img[0, r, c]).all()
+    r2, c2 = o.origpixel(ro, co, ref.shape)
+    assert (r2 == r).all() and (c2 == c).all()
+
+
+def test_params():
+    o = Orientation(True, 6, False, True)
+    assert Orientation.fromparams(o.toparams()) == Orientation(True, 2, False, True)
+
+    names = ("rotccw", "transpose", "flipud", "fliplr")
+    rec = np.array((1, 0, 1, 1), dtype=[(k, "i1") for k in names])
+    assert Orientation.fromparams(rec[()]) == Orientation(False, 1, True, True)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -16,5 +16,21 @@ def test_nearazel():
     assert col[0] == 1
 
 
+def test_nearazel_tree():
+    findnearest = pytest.importorskip("histutils.findnearest")
+
+    el, az = np.meshgrid(np.linspace(10, 80, 40), np.linspace(0, 90, 50), indexing="ij")
+    az[20, 25] = np.nan  # uncalibrated pixel is never chosen
+    tree = findnearest.azeltree(az, el)
+
+    azpts = np.array([az[5, 7], az[20, 25 + 1], 45.0, np.nan])
+    elpts = np.array([el[5, 7], el[20, 25], el[20, 25], 30.0])
+    row, col = findnearest.findClosestAzel(az, el, azpts, elpts, tree=tree)
+
+    assert (row[:2] == [5, 20]).all() and (col[:2] == [7, 26]).all()
+    assert (row[2], col[2]) != (20, 25)
+    assert row.mask[3]  # NaN point gives an edge pixel, which is masked
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+from pathlib import Path
+import shutil
+import h5py
+import numpy as np
+import pytest
+from pytest import approx
+
+from histutils.stats import Histogram16, histframes, autoclim, StackStats, stackstats
+
+R = Path(__file__).parent
+
+
+def test_histogram16():
+    img = np.random.default_rng(0).integers(0, 4096, (4, 32, 32), dtype=np.uint16)
+
+    H = Histogram16().update(img[:2])
+    H += Histogram16().update(img[2:])
+    assert H.n == img.size
+    assert (H.counts == np.bincount(img.ravel(), minlength=2 ** 16)).all()
+
+    q = [0, 0.5, 50, 99.5, 100]
+    assert (H.percentile(q) == np.percentile(img, q, method="lower")).all()
+
+    assert Histogram16().update([np.nan, 3.0, 70000]).n == 2
+
+    with pytest.raises(ValueError):
+        Histogram16().clim()
+
+
+def test_histframes():
+    fn = R / "testframes_cam0.h5"
+    with h5py.File(fn, "r") as f:
+        img = f["/rawimg"][:]
+        ut1 = f["/ut1_unix"][:]
+
+    assert (histframes(fn).counts == Histogram16().update(img).counts).all()
+    H1 = histframes(fn, twin=(ut1[1], ut1[1]))
+    assert (H1.counts == Histogram16().update(img[1]).counts).all()
+    assert (histframes(fn, jobs=2).counts == Histogram16().update(img).counts).all()
+
+
+def test_autoclim(tmp_path):
+    fn = tmp_path / "clim.h5"
+    shutil.copy(R / "testframes_cam0.h5", fn)
+
+    with h5py.File(fn, "r") as f:
+        ref = Histogram16().update(f["/rawimg"][:]).clim(1, 99)
+
+    assert autoclim(fn, 1, 99) == ref
+    with h5py.File(fn, "r") as f:
+        assert tuple(f["/rawimg"].attrs["clim"]) == ref
+        assert autoclim(f["/rawimg"], 1, 99) == ref
+        assert autoclim(f["/rawimg"][:], 1, 99) == ref
+
+    with h5py.File(fn, "r+") as f:  # cached result is reused
+        f["/rawimg"].attrs["clim"] = (1, 2)
+    assert autoclim(fn, 1, 99) == (1, 2)
+    assert autoclim(fn, 1, 99, stop=1) != (1, 2)
+
+
+def test_stackstats():
+    img = np.random.default_rng(1).poisson(1000, (50, 8, 16)).astype(np.uint16)
+
+    S = StackStats(img.shape[1:], nbins=128)
+    for i in range(0, img.shape[0], 7):
+        S.update(img[i : i + 7])  # noqa: E203
+
+    assert S.n == img.shape[0]
+    assert S.mean == approx(img.mean(axis=0))
+    assert S.var == approx(img.var(axis=0, ddof=1))
+    assert (S.min == img.min(axis=0)).all() and (S.max == img.max(axis=0)).all()
+    assert S.hist.n == img.size
+    # median within one histogram bin of the middle samples
+    w = np.diff(S.edges).max()
+    mid = np.sort(img, axis=0)[24:26]
+    assert (S.median >= mid[0] - w).all() and (S.median <= mid[1] + w).all()
+
+    A = StackStats(img.shape[1:], S.edges).update(img[:20])
+    A.merge(StackStats(img.shape[1:], S.edges).update(img[20:]))
+    assert A.mean == approx(S.mean)
+    assert A.var == approx(S.var)
+    assert (A.pixhist == S.pixhist).all()
+
+
+def test_stackstats_h5(tmp_path):
+    fn = tmp_path / "stats.h5"
+    shutil.copy(R / "testframes_cam0.h5", fn)
+
+    S = stackstats(fn, percentiles=(10, 50))
+    with h5py.File(fn, "r") as f:
+        img = f["/rawimg"][:]
+        g = f["/stats"]
+        assert g.attrs["nframes"] == 2
+        assert g["mean"][:] == approx(img.mean(axis=0))
+        assert (g["min"][:] == img.min(axis=0)).all()
+        assert {"median", "p10", "var", "max", "hist", "edges"} <= set(g)
+        assert (g["hist"][:] == S.hist.counts).all()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
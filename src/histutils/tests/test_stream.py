@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+from pathlib import Path
+import threading
+import time
+import h5py
+import pytest
+
+import numpy as np
+
+import histutils.stream as stream
+from histutils.stream import iter_frames, prefetch_frames, playframes, follow_frames
+from histutils.io import rechunkh5
+
+R = Path(__file__).parent
+PARAMS = {
+    "xy_pixel": (512, 512),
+    "xy_bin": (1, 1),
+    "header_bytes": 4,
+    "startUTC": "2013-04-14T06:59:55Z",
+    "kineticsec": 0.0188679245283019,
+}
+
+
+@pytest.mark.parametrize("readahead", [0, 2])
+def test_iter_h5(readahead):
+    fn = R / "testframes_cam0.h5"
+
+    batches = list(iter_frames(fn, batch=1, readahead=readahead))
+    assert len(batches) == 2
+
+    with h5py.File(fn, "r") as f:
+        for i, (ut1, rawind, frames) in enumerate(batches):
+            assert frames.shape == (1, 512, 512)
+            assert (frames == f["/rawimg"][i : i + 1]).all()  # noqa: E203
+            assert ut1[0] == f["/ut1_unix"][i]
+            assert rawind[0] == f["/rawind"][i]
+
+
+@pytest.mark.parametrize("profile", [None, "keogram", "fast-read"])
+def test_prefetch_h5(tmp_path, profile):
+    fn = R / "testframes_cam0.h5"
+    if profile:
+        rechunkh5(fn, tmp_path / "rechunk.h5", profile)
+        fn = tmp_path / "rechunk.h5"
+
+    batches = list(prefetch_frames(fn, batch=1, depth=2, threads=2))
+    assert len(batches) == 2
+
+    with h5py.File(fn, "r") as f:
+        frames = np.concatenate([b[2] for b in batches])
+        assert (frames == f["/rawimg"][:]).all()
+        assert batches[1][1][0] == f["/rawind"][1]
+
+        assert (np.stack(list(playframes(f["/rawimg"]))) == frames).all()
+
+
+def test_iter_dmc():
+    fn = R / "testframes.DMCdata"
+
+    ut1, rawind, frames = next(iter_frames(fn, 1, params=PARAMS))
+    assert frames.shape == (1, 512, 512)
+    assert rawind[0] == 710731
+    assert ut1.size == 1
+
+    with pytest.raises(ValueError):
+        next(iter_frames(fn))
+
+
+@pytest.mark.parametrize("step", [0, -3])
+def test_step(step):
+    with pytest.raises(ValueError):
+        next(iter_frames(R / "testframes.DMCdata", step=step, params=PARAMS))
+    with pytest.raises(ValueError):
+        next(prefetch_frames(R / "testframes_cam0.h5", step=step))
+
+    fn = R / "testframes_cam0.h5"
+    assert [b[1].tolist() for b in iter_frames(fn, 1, step=3, batch=1)] == [[363318]]
+
+
+@pytest.mark.parametrize("inotify", [True, False], ids=["inotify", "poll"])
+def test_follow_dmc(tmp_path, monkeypatch, inotify):
+    if inotify:
+        pytest.importorskip("inotify_simple")
+    else:
+        monkeypatch.setattr(stream, "INotify", None)
+
+    raw = (R / "testframes.DMCdata").read_bytes()
+    nbytes = len(raw) // 2
+    ut1, rawind, frames = next(iter_frames(R / "testframes.DMCdata", batch=2, params=PARAMS))
+
+    fn = tmp_path / "live.DMCdata"
+    # recording: first frame and part of the second
+    fn.write_bytes(raw[: nbytes + 1000])  # noqa: E203
+
+    def record():
+        time.sleep(0.3)
+        with fn.open("ab") as f:
+            f.write(raw[nbytes + 1000 :])  # noqa: E203
+
+    gen = follow_frames(fn, PARAMS, poll=0.05, timeout=1)
+    b = next(gen)
+    assert b[1].tolist() == [710730] and (b[2] == frames[:1]).all()
+    assert b[0] == pytest.approx(ut1[:1])
+
+    t = threading.Thread(target=record)
+    t.start()
+    tic = time.monotonic()
+    b = next(gen)
+    assert time.monotonic() - tic < 1
+    assert b[1].tolist() == [710731] and (b[2] == frames[1:]).all()
+    t.join()
+
+    assert list(gen) == []  # timeout without new frames
+
+    # from now on only
+    assert list(follow_frames(fn, PARAMS, None, timeout=0.1)) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
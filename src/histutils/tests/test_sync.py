@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+import numpy as np
+import pytest
+
+from histutils.sync import nearestframe, timeline, iter_timeline, synctimeline
+
+
+def test_nearestframe():
+    ut1 = np.array([10.0, 11.0, 12.0])
+    ind, terr = nearestframe(ut1, [9.0, 10.2, 10.5, 10.7, 12.0, 12.1])
+
+    assert (ind == [-1, 0, 0, 1, 2, -1]).all()
+    assert terr[1:5] == pytest.approx([-0.2, -0.5, 0.3, 0.0])
+    assert np.isnan(terr[[0, -1]]).all()
+
+
+def test_timeline():
+    fast = 100 + np.arange(0, 10, 0.1)  # 10 fps
+    slow = 100.03 + np.arange(0, 10, 0.25)  # 4 fps, starts later
+
+    tl = timeline([fast, slow], 0.1)
+    assert tl.t[0] == slow[0]
+    assert tl.t[-1] < slow[-1]
+    assert tl.ind.shape == (2, tl.t.size)
+    assert (np.abs(tl.terr) <= 0.125 + 1e-9).all()
+    # slow camera repeats frames, fast camera plays every frame
+    assert tl.repeat[1].sum() > 0 and not tl.repeat[0].any()
+    assert not tl.skip[0].any()
+
+    # streaming in chunks gives the same timeline
+    chunks = list(iter_timeline([fast, slow], 0.1, chunk=7))
+    assert len(chunks) > 1
+    for k in ("ind", "repeat", "skip"):
+        assert (np.concatenate([getattr(c, k) for c in chunks], axis=1) == getattr(tl, k)).all()
+
+    sub = timeline([fast, slow], 0.1, tstart=102, tstop=103)
+    assert (sub.t > 102).all() and (sub.t < 103).all()
+    assert sub.t == pytest.approx(tl.t[(tl.t > 102) & (tl.t < 103)])
+
+
+def test_skip():
+    ut1 = np.arange(10.0)
+    tl = synctimeline([ut1], [0, 3, 3.1, 9])
+    assert (tl.skip[0] == [0, 2, 0, 5]).all()
+    assert (tl.repeat[0] == [False, False, True, False]).all()
+
+    with pytest.raises(ValueError):
+        timeline([ut1[::-1]], 1.0)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+import h5py
+import numpy as np
+import pytest
+from pytest import approx
+
+from histutils.timedmc import datetime2unix, firetime, ppsmodel
+
+R = Path(__file__).parent
+
+T0 = 1365922795.0  # 2013-04-14T06:59:55Z
+
+
+@pytest.mark.parametrize(
+    "t",
+    [
+        "2013-04-14T06:59:55Z",
+        "2013-04-14T06:59:55",
+        "2013-04-14 06:59:55",
+        "2013-04-14T08:59:55+02:00",
+        "Apr 14 2013 06:59:55",
+        str(T0),
+        T0,
+        datetime(2013, 4, 14, 6, 59, 55),
+        datetime(2013, 4, 14, 8, 59, 55, tzinfo=timezone(timedelta(hours=2))),
+        np.datetime64("2013-04-14T06:59:55.000000000"),
+    ],
+)
+def test_scalar(t):
+    u = datetime2unix(t)
+    assert u.shape == (1,) and u.dtype == float
+    assert u[0] == approx(T0)
+
+
+def test_arrays():
+    t = np.datetime64("2013-04-14T06:59:55") + np.arange(5) * np.timedelta64(500, "ms")
+    expected = T0 + np.arange(5) * 0.5
+
+    assert datetime2unix(t) == approx(expected)
+    assert datetime2unix(t.astype(str)) == approx(expected)
+    assert datetime2unix(np.char.add(t.astype(str), "Z")) == approx(expected)
+    assert datetime2unix(t.reshape((1, 5))).shape == (1, 5)
+
+    nat = datetime2unix(np.array(["2013-04-14T06:59:55", "NaT"], dtype="datetime64[ns]"))
+    assert nat[0] == approx(T0) and np.isnan(nat[1])
+
+
+def test_mixed():
+    t = ["2013-04-14T06:59:56Z", str(T0 + 2), "2013-04-14T09:59:58+03:00"]
+    assert datetime2unix(t) == approx(T0 + np.array([1, 2, 3]))
+
+    t = np.array(
+        [
+            datetime(2013, 4, 14, 6, 59, 56),
+            "2013-04-14T06:59:57",
+            T0 + 3,
+            np.datetime64(int(T0 + 4), "s"),
+        ],
+        dtype=object,
+    )
+    assert datetime2unix(t) == approx(T0 + np.arange(1, 5))
+
+    with pytest.raises(TypeError):
+        datetime2unix([T0, None])
+
+
+def test_xarray():
+    xarray = pytest.importorskip("xarray")
+
+    t = np.datetime64("2013-04-14T06:59:55") + np.arange(3) * np.timedelta64(1, "s")
+    d = xarray.DataArray(np.zeros(3), coords={"time": t}, dims="time")
+
+    assert datetime2unix(d.time) == approx(T0 + np.arange(3))
+
+
+def synthclock(tstart=T0, hours=1.0, fs=10e6, seed=0):
+    """
+    tick counter drifting against GPS: ppm offset plus slow wander
+    """
+    rng = np.random.default_rng(seed)
+
+    def tick(t):
+        dt = t - tstart
+        return np.rint(fs * (dt * (1 + 3e-6) + 2e-11 * dt ** 2) + 12345).astype(np.int64)
+
+    utc = np.arange(np.ceil(tstart), tstart + hours * 3600)
+    pps = tick(utc) + rng.integers(-2, 3, utc.size)  # 0.2 us jitter
+
+    return tick, utc, pps
+
+
+def test_firetime():
+    tick, utc, pps = synthclock()
+    kinetic = 0.0188679245283019
+    rawind = np.arange(1, 150_000)
+    texp = T0 + 0.3 + (rawind - 1) * kinetic
+    fire = np.column_stack((tick(texp), rawind))
+    # dropped fire pulses, a spurious PPS edge and a missing one
+    fire = np.delete(fire, [0, 500, 501, 149_000], axis=0)
+    pps[100] += 300_000
+    pps, utc = np.delete(pps, 2000), np.delete(utc, 2000)
+
+    ft = firetime(T0, fire, np.column_stack((pps, utc)), rawind)
+
+    assert np.abs(ft.ut1 - texp).max() < 1e-5
+    assert ft.missing.sum() == 4 and ft.missing[[0, 500, 501, 149_000]].all()
+    assert (ft.ticks[~ft.missing] == tick(texp)[~ft.missing]).all() and ft.ticks[0] == 0
+
+    # PPS edges counted from the start time instead of labeled
+    ft2 = firetime(T0, fire, pps, rawind)
+    assert np.abs(ft2.ut1 - texp).max() < 1e-5
+
+
+def test_ppsmodel():
+    tick, utc, pps = synthclock(hours=0.5)
+    model = ppsmodel(pps, utc, segment=600)
+
+    assert model.offset.size == 3 and model.npps == utc.size
+    assert (model.sigma < 1e-6).all()
+    assert np.abs(model(pps) - utc).max() < 3e-6
+
+    with pytest.raises(ValueError):
+        ppsmodel(pps)  # no labels and no start time
+
+
+def test_convert_fire(tmp_path):
+    from histutils.rawDMCreader import getDMCparam
+    from histutils.convert import dmc2h5
+    from histutils.io import vid2h5
+
+    fn = R / "testframes.DMCdata"
+    params = {"xy_pixel": (512, 512), "xy_bin": (1, 1), "header_bytes": 4}
+    rawind = getDMCparam(fn, params)["frameindex"]["rawind"]
+
+    tick, utc, pps = synthclock(hours=0.1)
+    # fire log with raw frame index, covering just this file
+    find = np.arange(rawind[0] - 5, rawind[-1] + 5)
+    texp = T0 + 0.5 + (find - find[0]) * 0.02
+    np.savetxt(tmp_path / "pps.txt", np.column_stack((pps, utc)), fmt="%d", delimiter=",")
+    np.savetxt(
+        tmp_path / "fire.txt", np.column_stack((tick(texp), find)), fmt="%d", header="tick rawind"
+    )
+
+    params.update(
+        outfn=tmp_path / "fire.h5",
+        fire=tmp_path / "fire.txt",
+        pps=tmp_path / "pps.txt",
+        kineticsec=0.02,
+        rotccw=0,
+        transpose=False,
+        flipud=False,
+        fliplr=False,
+    )
+    ind, finf = dmc2h5(fn, params)
+    vid2h5(
+        None,
+        ut1=finf["ut1"],
+        rawind=ind,
+        ticks=finf["ticks"],
+        params=params,
+        ut1attrs=finf["ut1attrs"],
+    )
+
+    with h5py.File(params["outfn"], "r") as f:
+        assert f["/ut1_unix"][:] == approx(texp[rawind - find[0]], abs=1e-5)
+        assert (f["/ticks"][:] == tick(texp)[rawind - find[0]]).all()
+        assert f["/ut1_unix"].attrs["npps"] == pps.size
+        assert f["/ut1_unix"].attrs["nmissing"] == 0
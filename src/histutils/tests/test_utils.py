@@ -3,6 +3,7 @@ import pytest
 from pathlib import Path
 from pytest import approx
 import shutil
+import numpy as np
 
 from histutils.hstxmlparse import xmlparam
 import histutils.utils as hu
@@ -41,5 +42,28 @@ def test_quota_ok(tmp_path):
         pytest.skip("not enough free space")
 
 
+@pytest.mark.parametrize("clim", [(100, 4000), (0.5, 60000.0)])
+def test_sixteen2eight(clim):
+    img = np.random.default_rng(0).integers(0, 2 ** 16, (3, 32, 32), dtype=np.uint16)
+
+    ref = (hu.normframe(img, clim) * 255).round().astype(np.uint8)
+    assert (hu.sixteen2eight(img, clim) == ref).all()
+    assert (hu.sixteen2eight(img.astype(float), clim) == ref).all()
+
+
+@pytest.mark.parametrize("stretch", hu.STRETCHES)
+def test_scale16to8(stretch):
+    img = np.arange(2 ** 16, dtype=np.uint16).reshape((4, 128, 128))
+    out = np.empty(img.shape, np.uint8)
+
+    assert hu.scale16to8(img, (100, 4000), stretch, out=out) is out
+    assert out[0, 0, 0] == 0 and out[-1, -1, -1] == 255
+    assert (np.diff(out.ravel().astype(int)) >= 0).all()
+    assert (out == hu.sixteen2eight(img.astype(np.float32), (100, 4000), stretch)).all()
+
+    with pytest.raises(TypeError):
+        hu.scale16to8(img.astype(float), (100, 4000))
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
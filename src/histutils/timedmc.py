@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 """
 Estimates time of DMC frames using GPS & fire data, when they exist.
-work in progress
 
 We use UT1 Unix epoch time instead of datetime, since we are working with HDF5 and also need to do fast comparisons
 
@@ -11,7 +10,10 @@ Outputs:
 
 Michael Hirsch
 """
-from datetime import datetime
+from pathlib import Path
+from datetime import datetime, timezone
+import warnings
+import typing as T
 from dateutil.parser import parse
 import numpy as np
 
@@ -47,9 +49,12 @@ def ut12frame(treq, ind, ut1_unix) -> np.ndarray:
         treq = datetime2unix(treq[0])
     # %% handle time range case
     elif treq.size == 2:
-        tstartreq = datetime2unix(treq[0])
-        tendreq = datetime2unix(treq[1])
-        treq = ut1_unix[(ut1_unix > tstartreq) & (ut1_unix < tendreq)]
+        tstartreq = datetime2unix(treq[0])[0]
+        tendreq = datetime2unix(treq[1])[0]
+        # ut1_unix is increasing, so bisect instead of scanning every frame time
+        i0 = np.searchsorted(ut1_unix, tstartreq, side="right")
+        i1 = np.searchsorted(ut1_unix, tendreq, side="left")
+        return np.asarray(ind[i0:i1], dtype=np.int64)
     else:  # otherwise, it's a vector of requested values
         treq = datetime2unix(treq)
     # %% get indices
@@ -62,37 +67,350 @@ def ut12frame(treq, ind, ut1_unix) -> np.ndarray:
     return framereq
 
 
-def datetime2unix(T):
+def datetime2unix(T) -> np.ndarray:
     """
-    converts datetime to UT1 unix epoch time
+    converts times to UT1 unix epoch time, vectorized.
+
+    Accepts scalars or arrays of: numpy.datetime64, datetime, ISO 8601 strings,
+    numbers (already unix time, also in strings), xarray/pandas time coordinates,
+    or any mix of these. Times without timezone are UTC, like numpy.datetime64.
+    NaT gives NaN.
+    """
+    if hasattr(T, "values") and not callable(T.values):  # xarray.DataArray, pandas.Series
+        T = T.values
+    T = np.atleast_1d(np.asarray(T))
+
+    if T.dtype.kind == "M":
+        return _datetime64unix(T)
+    if T.dtype.kind in "biuf":  # already ut1_unix
+        return T.astype(float)
+    if T.dtype.kind in "US":
+        return _str2unix(T.astype(str))
+    if T.dtype.kind != "O":
+        raise TypeError("I only accept datetime or parseable date string")
+
+    # mixed types: convert each kind of element together
+    flat = T.ravel()
+    ut1_unix = np.empty(flat.shape, dtype=float)
+    kinds = {"str": [], "naive": [], "aware": [], "num": []}
+    for i, t in enumerate(flat):
+        if isinstance(t, str):
+            kinds["str"].append(i)
+        elif isinstance(t, datetime):
+            kinds["naive" if t.tzinfo is None else "aware"].append(i)
+        elif isinstance(t, np.datetime64):
+            kinds["naive"].append(i)
+        elif isinstance(t, (int, float, np.number)) and not isinstance(t, bool):
+            kinds["num"].append(i)
+        else:
+            raise TypeError("I only accept datetime or parseable date string")
+
+    if kinds["str"]:
+        ut1_unix[kinds["str"]] = _str2unix(flat[kinds["str"]].astype(str))
+    if kinds["naive"]:
+        t = np.array(flat[kinds["naive"]].tolist(), dtype="datetime64[us]")
+        ut1_unix[kinds["naive"]] = _datetime64unix(t)
+    if kinds["aware"]:
+        ut1_unix[kinds["aware"]] = [t.timestamp() for t in flat[kinds["aware"]]]
+    if kinds["num"]:
+        ut1_unix[kinds["num"]] = flat[kinds["num"]].astype(float)
+
+    return ut1_unix.reshape(T.shape)
+
+
+def _datetime64unix(T: np.ndarray) -> np.ndarray:
+    """
+    numpy.datetime64 to unix time, NaT to NaN
+    """
+    return (T - np.datetime64(0, "s")) / np.timedelta64(1, "s")
+
+
+def _str2unix(T: np.ndarray) -> np.ndarray:
     """
-    T = np.atleast_1d(T)
+    strings to unix time. ISO 8601 dates (optionally "Z" UTC) are parsed by numpy all at once,
+    anything else (numbers, timezone offsets, other formats) one string at a time.
+    """
+    shape = T.shape
+    T = T.ravel()
+    try:  # unix time in strings
+        return T.astype(float).reshape(shape)
+    except ValueError:
+        pass
+
+    ut1_unix = np.empty(T.size, dtype=float)
+    # YYYY-MM-DD...
+    c = T.astype("U8").view("U1").reshape((T.size, 8))
+    isdate = (c[:, 4] == "-") & (c[:, 7] == "-")
+    iso = np.char.rstrip(T, "Z")
 
-    ut1_unix = np.empty(T.shape, dtype=float)
-    for i, t in enumerate(T):
-        if isinstance(t, (datetime, np.datetime64)):
-            pass
-        elif isinstance(t, str):
+    with warnings.catch_warnings():
+        # numpy parsing timezone offsets is deprecated: leave those to dateutil
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            ut1_unix[isdate] = _datetime64unix(iso[isdate].astype("datetime64[us]"))
+        except (ValueError, DeprecationWarning):
+            isdate[:] = False
+
+        for i in np.flatnonzero(~isdate):
             try:
-                ut1_unix[i] = float(t)  # it was ut1_unix in a string
+                ut1_unix[i] = float(T[i])
                 continue
             except ValueError:
-                t = parse(t)  # datetime in a string
-        elif isinstance(t, (float, int)):  # assuming ALL are ut1_unix already
-            return T
-        else:
-            raise TypeError("I only accept datetime or parseable date string")
+                pass
+            try:
+                ut1_unix[i] = _datetime64unix(np.datetime64(iso[i], "us"))
+            except (ValueError, DeprecationWarning):
+                d = parse(T[i])
+                if d.tzinfo is None:
+                    d = d.replace(tzinfo=timezone.utc)
+                ut1_unix[i] = d.timestamp()
+
+    return ut1_unix.reshape(shape)
+
+
+# %% GPSDO 1PPS and camera fire timing
+class TimingModel(T.NamedTuple):
+    """
+    piecewise linear model of the tick counter clock that recorded the GPSDO 1PPS edges
+    and camera fire pulses: UT1 = offset[k] + rate[k] * (tick - edges[k]) in segment k.
+    Outside the recorded ticks the first / last segment is extrapolated.
+    """
+
+    edges: np.ndarray  # Nseg+1 tick boundaries of segments
+    offset: np.ndarray  # Nseg UT1 unix time at the first tick of each segment
+    rate: np.ndarray  # Nseg seconds per tick
+    sigma: np.ndarray  # Nseg robust standard deviation of PPS edges about the fit [sec]
+    npps: int  # PPS edges recorded
+
+    def __call__(self, ticks: np.ndarray) -> np.ndarray:
+        """
+        UT1 unix time of ticks
+        """
+        ticks = np.asarray(ticks, dtype=np.int64)
+        k = (np.searchsorted(self.edges, ticks, side="right") - 1).clip(0, self.offset.size - 1)
+        # difference in integer ticks first, to keep the precision of large counters
+        return self.offset[k] + self.rate[k] * (ticks - self.edges[k]).astype(float)
+
+    def attrs(self) -> T.Dict[str, T.Any]:
+        """
+        for HDF5 attributes of /ut1_unix
+        """
+        return {
+            "timing": "GPSDO 1PPS and camera fire feedback",
+            "model": "UT1 = offset[k] + rate[k] * (tick - edges[k]) for edges[k] <= tick < edges[k+1]",
+            "model_edges": self.edges,
+            "model_offset": self.offset,
+            "model_rate": self.rate,
+            "model_sigma": self.sigma,
+            "npps": self.npps,
+        }
 
-        # ut1 seconds since unix epoch, need [] for error case
-        ut1_unix[i] = t.timestamp()
 
-    return ut1_unix
+class FireTiming(T.NamedTuple):
+    """
+    UT1 of each frame from the camera fire pulses
+    """
 
+    ut1: np.ndarray  # UT1 unix time of exposure start of each frame
+    ticks: np.ndarray  # uint64 fire tick of each frame, 0 if no fire pulse was recorded
+    missing: np.ndarray  # True if the frame had no fire pulse, and was interpolated
+    model: TimingModel
 
-def firetime(tstart, Tfire):
-    """ Highly accurate sub-millisecond absolute timing based on GPSDO 1PPS and camera fire feedback.
-    Right now we have some piecemeal methods to do this, and it's time to make it industrial strength
-    code.
 
+def readticks(fn: Path) -> np.ndarray:
+    """
+    tick log: text file with one tick counter value per line, optionally followed by
+    (comma or whitespace separated) a second column, or a .npy file of the same.
+    Lines starting with # are comments.
+
+    Returns
+    -------
+    ticks: numpy.ndarray
+        N x 1 or N x 2 float, ticks in the first column
     """
-    raise NotImplementedError("Yes this is a priority, would you like to volunteer?")
+    fn = Path(fn).expanduser()
+    if fn.suffix == ".npy":
+        dat = np.load(fn)
+    else:
+        with fn.open("r") as f:
+            line = next((ln for ln in f if ln.strip() and not ln.lstrip().startswith("#")), "")
+        dat = np.loadtxt(fn, comments="#", delimiter="," if "," in line else None, ndmin=2)
+
+    dat = np.asarray(dat, dtype=float)
+    return dat[:, None] if dat.ndim == 1 else dat
+
+
+def ppsmodel(
+    ticks: np.ndarray,
+    utc: np.ndarray = None,
+    tstart: float = None,
+    *,
+    segment: float = 600.0,
+    maxiter: int = 20,
+) -> TimingModel:
+    """
+    fits the tick counter clock to the GPSDO 1PPS edges, piecewise over segments of time
+    to follow the drift of the counter oscillator, by robust (Huber) regression
+    so that spurious or late edges don't bias the fit.
+
+    Parameters
+    ----------
+    ticks: numpy.ndarray of int
+        tick counter at each PPS edge
+    utc: numpy.ndarray, optional
+        UTC unix second of each PPS edge (e.g. from NMEA). If not given, the edges are counted
+        from the first whole second after tstart, with missing edges skipped by their tick spacing.
+    tstart: float, optional
+        UT1 unix time before the first PPS edge, good to a second
+    segment: float, optional
+        length of each linear piece [sec]
+    maxiter: int, optional
+        maximum reweighting iterations
+    """
+    ticks = np.rint(np.asarray(ticks, dtype=float)).astype(np.int64).ravel()
+    if ticks.size < 2:
+        raise ValueError("need at least 2 PPS edges")
+    if (np.diff(ticks) <= 0).any():
+        raise ValueError("PPS ticks must be increasing")
+
+    if utc is None:
+        if tstart is None or not np.isfinite(tstart):
+            raise ValueError("PPS edges without UTC labels need the start time")
+        period = np.median(np.diff(ticks))
+        utc = np.ceil(tstart) + np.rint((ticks - ticks[0]) / period)
+    utc = np.asarray(utc, dtype=float).ravel()
+    if utc.size != ticks.size:
+        raise ValueError("one UTC label per PPS edge")
+
+    # segments of whole seconds, merged into the previous segment if too few edges to fit
+    seg = ((utc - utc[0]) // segment).astype(int)
+    starts = np.flatnonzero(np.diff(seg, prepend=-1))
+    n = np.diff(starts, append=ticks.size)
+    keep = n >= 3
+    keep[-1] &= n[-1] >= segment / 2  # short tail would poorly constrain the rate
+    keep[0] = True
+    starts = starts[keep]
+    stops = np.append(starts[1:], ticks.size)
+
+    Nseg = starts.size
+    edges = np.empty(Nseg + 1, dtype=np.int64)
+    edges[:-1] = ticks[starts]
+    edges[-1] = ticks[-1]
+    offset = np.empty(Nseg)
+    rate = np.empty(Nseg)
+    sigma = np.empty(Nseg)
+
+    for k, (i, j) in enumerate(zip(starts, stops)):
+        x = (ticks[i:j] - edges[k]).astype(float)
+        y = utc[i:j]
+        offset[k], rate[k], sigma[k] = _huberline(x, y, maxiter)
+
+    return TimingModel(edges, offset, rate, sigma, ticks.size)
+
+
+def _huberline(x: np.ndarray, y: np.ndarray, maxiter: int) -> T.Tuple[float, float, float]:
+    """
+    robust line fit y = a + b x by iteratively reweighted least squares with Huber weights
+
+    Returns
+    -------
+    a, b: float
+        intercept, slope
+    sigma: float
+        robust (MAD) standard deviation of residuals
+    """
+    # y relative to its first value, so the normal equations keep the precision of unix times
+    y0 = y[0]
+    y = y - y0
+
+    w = np.ones_like(x)
+    ab = np.zeros(2)
+    for _ in range(maxiter):
+        A = np.stack((np.ones_like(x), x), axis=1) * w[:, None]
+        ab_new = np.linalg.lstsq(A, y * w, rcond=None)[0]
+        r = y - ab_new[0] - ab_new[1] * x
+        mad = np.median(np.abs(r - np.median(r)))
+        sigma = max(1.4826 * mad, 1e-9)
+        c = 1.345 * sigma
+        w = np.sqrt(np.minimum(1.0, c / np.maximum(np.abs(r), 1e-300)))
+        converged = np.allclose(ab_new, ab, rtol=1e-12, atol=1e-12)
+        ab = ab_new
+        if converged:
+            break
+
+    return y0 + ab[0], ab[1], sigma
+
+
+def firetime(
+    tstart: float,
+    Tfire: T.Union[Path, np.ndarray],
+    pps: T.Union[Path, np.ndarray, TimingModel],
+    rawind: np.ndarray = None,
+    *,
+    segment: float = 600.0,
+) -> FireTiming:
+    """
+    Highly accurate sub-millisecond absolute timing based on GPSDO 1PPS and camera fire feedback.
+
+    The tick counter that logged the 1PPS edges also logged the camera fire pulses,
+    so each fire (exposure start) is timed by the clock model fit to the 1PPS edges.
+    Frames without a recorded fire pulse are interpolated from the neighboring frames.
+
+    Parameters
+    ----------
+    tstart: float
+        UT1 unix time of the start of acquisition (software estimate, good to a second).
+        Only used if the PPS log doesn't have UTC labels.
+    Tfire: pathlib.Path or numpy.ndarray
+        fire log: tick of each fire pulse, optionally with the one-based raw frame index
+        of each pulse as a second column (default: pulses are raw frames 1, 2, ...)
+    pps: pathlib.Path or numpy.ndarray or TimingModel
+        PPS log: tick of each PPS edge, optionally with the UTC unix second of each edge
+        as a second column; or an already fit model
+    rawind: numpy.ndarray, optional
+        one-based raw frame indices to time (default: the fire pulses)
+    segment: float, optional
+        length of each linear piece of the clock model [sec]
+    """
+    if isinstance(pps, TimingModel):
+        model = pps
+    else:
+        p = readticks(pps) if isinstance(pps, (str, Path)) else np.asarray(pps, dtype=float)
+        p = p[:, None] if p.ndim == 1 else p
+        tstart = datetime2unix(tstart)[0] if tstart is not None else None
+        model = ppsmodel(p[:, 0], p[:, 1] if p.shape[1] > 1 else None, tstart, segment=segment)
+
+    fire = readticks(Tfire) if isinstance(Tfire, (str, Path)) else np.asarray(Tfire, dtype=float)
+    fire = fire[:, None] if fire.ndim == 1 else fire
+    fticks = np.rint(fire[:, 0]).astype(np.int64)
+    if fire.shape[1] > 1:
+        find = np.rint(fire[:, 1]).astype(np.int64)
+    else:
+        find = np.arange(1, fticks.size + 1, dtype=np.int64)
+
+    if find.size < 2:
+        raise ValueError("need at least 2 fire pulses")
+    if (np.diff(find) <= 0).any():
+        raise ValueError("fire log raw frame indices must be increasing")
+
+    fut1 = model(fticks)
+
+    rawind = find if rawind is None else np.atleast_1d(np.asarray(rawind, dtype=np.int64))
+    j = np.searchsorted(find, rawind).clip(0, find.size - 1)
+    found = find[j] == rawind
+
+    ut1 = np.empty(rawind.size)
+    ut1[found] = fut1[j[found]]
+    if not found.all():
+        # linear in raw index within the fire log, extrapolated by the median frame period
+        miss = ~found
+        period = np.median(np.diff(fut1) / np.diff(find))
+        ut1[miss] = np.interp(rawind[miss], find, fut1)
+        lo = miss & (rawind < find[0])
+        hi = miss & (rawind > find[-1])
+        ut1[lo] = fut1[0] + (rawind[lo] - find[0]) * period
+        ut1[hi] = fut1[-1] + (rawind[hi] - find[-1]) * period
+
+    ticks = np.where(found, fticks[j], 0).astype(np.uint64)
+
+    return FireTiming(ut1, ticks, ~found, model)